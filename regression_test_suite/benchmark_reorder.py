@@ -0,0 +1,78 @@
+#
+# Blendigo mesh reordering benchmark
+#
+# INFO:
+# Measures how long Indigo takes to load and start rendering an exported scene with its
+# meshes as exported, and with the same meshes spatially reordered (the 'Spatially
+# reorder meshes' export option). Export the scene with the option off first, then run:
+#
+#   blender -b -P benchmark_reorder.py -- <export dir> [number of runs]
+#
+# The export dir is copied twice to a temporary directory, so the export is not modified.
+# Every .igs file in it is rendered to 1 sample per pixel and the wall clock time of the
+# Indigo process is reported; the fastest of the runs is the most reliable number.
+
+import os, sys, shutil, subprocess, tempfile, time
+import xml.etree.cElementTree as ET
+
+from indigo_exporter.core import getConsolePath
+from indigo_exporter.export.igmesh import read_igmesh_data, write_igmesh_data, spatial_reorder_mesh_data
+
+def find_files(directory, ext):
+    found = []
+    for dir_path, dir_names, file_names in os.walk(directory):
+        for f in file_names:
+            if f.lower().endswith(ext):
+                found.append(os.path.join(dir_path, f))
+    return sorted(found)
+
+def reorder_meshes(directory):
+    for mesh_path in find_files(directory, '.igmesh'):
+        data = spatial_reorder_mesh_data(read_igmesh_data(mesh_path))
+        with open(mesh_path, 'wb') as f:
+            write_igmesh_data(f, data)
+
+def halt_after_one_sample(igs_path):
+    tree = ET.parse(igs_path)
+    for settings in tree.getroot().iter('renderer_settings'):
+        for halt in ('halt_time', 'halt_samples_per_pixel'):
+            el = settings.find(halt)
+            if el is not None:
+                settings.remove(el)
+        ET.SubElement(settings, 'halt_samples_per_pixel').text = '1'
+    tree.write(igs_path)
+
+def time_render(igs_path, runs):
+    times = []
+    for i in range(runs):
+        start = time.time()
+        subprocess.check_call([getConsolePath(), igs_path, '-o', igs_path + '.png'], stdout=subprocess.DEVNULL)
+        times.append(time.time() - start)
+    return times
+
+def benchmark(export_dir, runs):
+    work_dir = tempfile.mkdtemp(prefix='blendigo_reorder_')
+    try:
+        variants = ('original', 'reordered')
+        for variant in variants:
+            shutil.copytree(export_dir, os.path.join(work_dir, variant))
+            for igs_path in find_files(os.path.join(work_dir, variant), '.igs'):
+                halt_after_one_sample(igs_path)
+        reorder_meshes(os.path.join(work_dir, 'reordered'))
+
+        for igs_path in find_files(os.path.join(work_dir, 'original'), '.igs'):
+            rel_path = os.path.relpath(igs_path, os.path.join(work_dir, 'original'))
+            print(rel_path)
+            for variant in variants:
+                times = sorted(time_render(os.path.join(work_dir, variant, rel_path), runs))
+                print('  %-10s min %7.3f s   median %7.3f s' % (variant, times[0], times[len(times) // 2]))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    if len(args) < 1:
+        print('Usage: blender -b -P benchmark_reorder.py -- <export dir> [number of runs]')
+        sys.exit(-1)
+
+    benchmark(os.path.abspath(args[0]), int(args[1]) if len(args) > 1 else 5)
@@ -0,0 +1,127 @@
+#
+# Blendigo test meshes
+#
+# INFO:
+# Stand-ins for Blender meshes and objects made of numpy arrays, so that the mesh
+# writers can be tested on exact, known data. Their collections support len() and
+# foreach_get() like bpy_prop_collection, which is all the writers use.
+
+import numpy as np
+
+class Collection(list):
+    def __init__(self, count, **attributes):
+        super().__init__(range(count))
+        self.attributes = attributes
+
+    def foreach_get(self, name, out):
+        out[...] = np.asarray(self.attributes[name]).reshape(out.shape)
+
+class UVLayer(object):
+    def __init__(self, name, loop_uvs):
+        self.name = name
+        self.data = Collection(len(loop_uvs), uv=loop_uvs)
+
+class Mesh(object):
+    '''
+    A mesh of the polygons given as lists of vertex indices. Per loop data (uv_layers,
+    normals) is in the order of the polygon corners. Normals are the face normal on
+    flat polygons and the average of the face normals around the vertex on smooth
+    ones; loop_triangles are fans, like Blender's for convex polygons.
+    '''
+
+    def __init__(self, co, polygons, material_indices=None, smooth=None, uv_layers=(), sharp_edges=()):
+        co = np.asarray(co, dtype=np.float32)
+        num_polys = len(polygons)
+        loop_totals = np.array([len(p) for p in polygons], dtype=np.int32)
+        loop_starts = np.concatenate(([0], np.cumsum(loop_totals)[:-1])).astype(np.int32)
+        loop_vertices = np.concatenate(polygons).astype(np.int32)
+        material_indices = np.zeros(num_polys, dtype=np.int32) if material_indices is None else np.asarray(material_indices, dtype=np.int32)
+        smooth = np.zeros(num_polys, dtype=bool) if smooth is None else np.asarray(smooth, dtype=bool)
+
+        face_normals = np.array([np.cross(co[p[1]] - co[p[0]], co[p[2]] - co[p[0]]) for p in polygons], dtype=np.float64)
+        face_normals /= np.linalg.norm(face_normals, axis=1, keepdims=True)
+        vertex_normals = np.zeros((len(co), 3))
+        np.add.at(vertex_normals, loop_vertices, np.repeat(face_normals, loop_totals, axis=0))
+        lengths = np.linalg.norm(vertex_normals, axis=1, keepdims=True)
+        vertex_normals /= np.where(lengths > 0.0, lengths, 1.0)
+        loop_smooth = np.repeat(smooth, loop_totals)
+        loop_normals = np.where(loop_smooth[:, np.newaxis], vertex_normals[loop_vertices], np.repeat(face_normals, loop_totals, axis=0))
+
+        edges = sorted(set(tuple(sorted((p[i], p[(i + 1) % len(p)]))) for p in polygons for i in range(len(p))))
+        sharp_edges = set(tuple(sorted(e)) for e in sharp_edges)
+
+        tri_loops = []
+        tri_polys = []
+        for (i, (start, total)) in enumerate(zip(loop_starts, loop_totals)):
+            for j in range(1, total - 1):
+                tri_loops.append((start, start + j, start + j + 1))
+                tri_polys.append(i)
+
+        self.vertices = Collection(len(co), co=co, normal=vertex_normals.astype(np.float32))
+        centers = np.array([co[p].mean(axis=0) for p in polygons], dtype=np.float32)
+        self.polygons = Collection(num_polys, loop_start=loop_starts, loop_total=loop_totals, material_index=material_indices, use_smooth=smooth, center=centers)
+        self.loops = Collection(len(loop_vertices), vertex_index=loop_vertices, normal=loop_normals.astype(np.float32))
+        self.edges = Collection(len(edges), use_edge_sharp=[e in sharp_edges for e in edges])
+        self.loop_triangles = Collection(len(tri_loops), loops=np.array(tri_loops, dtype=np.int32), polygon_index=np.array(tri_polys, dtype=np.int32))
+        self.uv_layers = [UVLayer(name, np.asarray(uvs, dtype=np.float32)) for (name, uvs) in uv_layers]
+        self.has_custom_normals = False
+
+    def calc_normals_split(self):
+        pass
+
+    def calc_loop_triangles(self):
+        pass
+
+class Material(object):
+    def __init__(self, name):
+        self.name = name
+        self.indigo_material = self
+
+    def get_name(self, material):
+        return material.name
+
+class MaterialSlot(object):
+    def __init__(self, material):
+        self.material = material
+
+class Object(object):
+    def __init__(self, name, material_names=()):
+        self.name = name
+        self.type = 'MESH'
+        self.material_slots = [MaterialSlot(Material(n)) for n in material_names]
+
+def grid(nx, ny, ngon_rows=0):
+    '''
+    Returns (co, polygons) of a grid of nx by ny quads in the XY plane, with a
+    wavy height so that no two faces are coplanar. The quads of the first ngon_rows
+    rows are pentagons instead, with an extra vertex in the middle of their bottom
+    edge.
+    '''
+    co = [(x, y, 0.1 * np.sin(x + 2.0 * y)) for y in range(ny + 1) for x in range(nx + 1)]
+    polygons = []
+    for y in range(ny):
+        for x in range(nx):
+            (a, b, c, d) = (y * (nx + 1) + x, y * (nx + 1) + x + 1, (y + 1) * (nx + 1) + x + 1, (y + 1) * (nx + 1) + x)
+            if y < ngon_rows:
+                co.append(tuple((np.array(co[a]) + np.array(co[b])) / 2.0))
+                # Starting at the middle vertex, so that no fan triangle is degenerate.
+                polygons.append([len(co) - 1, b, c, d, a])
+            else:
+                polygons.append([a, b, c, d])
+    return (np.array(co, dtype=np.float32), polygons)
+
+def face_corners(data):
+    '''
+    Expands the triangles, then the quads of an igmesh_data to what each of their
+    corners references, for comparing meshes however their vertices and UVs are
+    shared. Returns a list of (positions, normals, uvs, material indices) per section,
+    with uvs of shape (layer, face, corner, 2) and normals None without normals.
+    '''
+    sections = []
+    num_uvs = len(data.uvs) // data.num_uv_mappings
+    layer_uvs = data.uvs.reshape(data.num_uv_mappings, num_uvs, 2)
+    for (records, k) in [(data.triangles, 3), (data.quads, 4)]:
+        (vertices, uvs) = (records[:, :k], records[:, k:2*k])
+        normals = data.normals[vertices] if len(data.normals) > 0 else None
+        sections.append((data.vertices[vertices], normals, layer_uvs[:, uvs], records[:, 2*k]))
+    return sections
@@ -0,0 +1,136 @@
+#
+# Blendigo export bundle tests
+#
+# INFO:
+# Bundles a small exported scene into a content-addressed repository, unpacks it
+# again, and checks the manifests and the deltas between successive bundles. Run:
+#
+#   blender -b -P test_bundle.py
+
+import os, sys, shutil, tempfile, unittest
+
+from indigo_exporter.export.bundle import make_bundle, unpack_bundle, read_manifest, object_path, file_hash
+
+SCENE = '''<?xml version="1.0" encoding="utf-8"?>
+<scene>
+	<include><pathname>objects.igs</pathname></include>
+	<include><pathname>materials/wood.igm</pathname></include>
+	<mesh><name>plane</name><external><path>meshes/plane.igmesh</path></external></mesh>
+	<mesh><name>box</name><external><path>meshes/box.igmesh</path></external></mesh>
+	<material><name>nk</name><specular><nk_data>gold</nk_data></specular></material>
+</scene>
+'''
+
+# Includes the scene again, which the bundle has to stop at.
+OBJECTS = '''<?xml version="1.0" encoding="utf-8"?>
+<scene>
+	<include><pathname>scene.igs</pathname></include>
+	<model><mesh_name>plane</mesh_name></model>
+</scene>
+'''
+
+MATERIAL = '''<?xml version="1.0" encoding="utf-8"?>
+<scene>
+	<material><name>wood</name><texture><path>%s</path></texture></material>
+</scene>
+'''
+
+class BundleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='blendigo_bundle_test_')
+        self.export_dir = os.path.join(self.dir, 'export')
+        self.repository = os.path.join(self.dir, 'repository')
+        # A texture outside the export directory, referred to by its absolute path.
+        self.texture = self.write(os.path.join(self.dir, 'textures', 'wood.png'), b'png data')
+        self.write_export(b'plane mesh')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def write_export(self, plane_mesh):
+        self.scene = self.write(os.path.join(self.export_dir, 'scene.igs'), SCENE.encode())
+        self.write(os.path.join(self.export_dir, 'objects.igs'), OBJECTS.encode())
+        self.write(os.path.join(self.export_dir, 'materials', 'wood.igm'), (MATERIAL % self.texture).encode())
+        self.write(os.path.join(self.export_dir, 'meshes', 'plane.igmesh'), plane_mesh)
+        # The same content as the plane at first, so stored once.
+        self.write(os.path.join(self.export_dir, 'meshes', 'box.igmesh'), b'plane mesh')
+
+    def test_bundle(self):
+        (manifest_path, delta, builder) = make_bundle(self.scene, self.repository, name='first')
+        self.assertEqual(os.path.join(self.repository, 'manifests', 'first.json'), manifest_path)
+
+        manifest = read_manifest(manifest_path)
+        external = 'external/%s.png' % file_hash(self.texture)
+        self.assertEqual('scene.igs', manifest['scene'])
+        self.assertEqual(sorted(['scene.igs', 'objects.igs', 'materials/wood.igm', 'meshes/plane.igmesh', 'meshes/box.igmesh', external]), sorted(manifest['files'].keys()))
+        self.assertNotIn('previous', manifest)
+
+        # Files are stored under their hash, the two identical meshes once.
+        for (bundle_path, entry) in manifest['files'].items():
+            stored = os.path.join(self.repository, entry['object'])
+            self.assertEqual(entry['hash'], file_hash(stored))
+            self.assertEqual(object_path(entry['hash'], os.path.splitext(bundle_path)[1]), entry['object'])
+        self.assertEqual(manifest['files']['meshes/plane.igmesh']['object'], manifest['files']['meshes/box.igmesh']['object'])
+        self.assertEqual(5, builder.num_stored)
+        self.assertEqual(sorted(set(entry['object'] for entry in manifest['files'].values())), delta)
+        with open(os.path.join(self.repository, 'manifests', 'first.delta.txt')) as f:
+            self.assertEqual(delta, f.read().splitlines())
+
+        # The export itself is not modified.
+        self.assertIn(self.texture, self.read(os.path.join(self.export_dir, 'materials', 'wood.igm')).decode())
+
+    def test_unpack(self):
+        (manifest_path, delta, builder) = make_bundle(self.scene, self.repository, name='first')
+        job_dir = os.path.join(self.dir, 'job')
+        self.assertEqual(os.path.join(job_dir, 'scene.igs'), unpack_bundle(manifest_path, self.repository, job_dir))
+
+        for name in ['scene.igs', 'objects.igs', 'meshes/plane.igmesh', 'meshes/box.igmesh']:
+            self.assertEqual(self.read(os.path.join(self.export_dir, name)), self.read(os.path.join(job_dir, name)))
+
+        # The material refers to the texture inside the bundle now, relative to the scene.
+        material = self.read(os.path.join(job_dir, 'materials', 'wood.igm')).decode()
+        external = 'external/%s.png' % file_hash(self.texture)
+        self.assertIn('<path>%s</path>' % external, material)
+        self.assertEqual(b'png data', self.read(os.path.join(job_dir, external)))
+
+        # Unpacking again replaces the files.
+        unpack_bundle(manifest_path, self.repository, job_dir)
+        self.assertEqual(b'plane mesh', self.read(os.path.join(job_dir, 'meshes', 'plane.igmesh')))
+
+    def test_delta(self):
+        (first_path, first_delta, builder) = make_bundle(self.scene, self.repository, name='first')
+
+        # Only the changed mesh is new to the repository.
+        self.write_export(b'changed plane mesh')
+        (second_path, delta, builder) = make_bundle(self.scene, self.repository, name='second')
+        second = read_manifest(second_path)
+        self.assertEqual('first.json', second['previous'])
+        self.assertEqual([second['files']['meshes/plane.igmesh']['object']], delta)
+        self.assertEqual(1, builder.num_stored)
+
+        # By default against the latest bundle.
+        os.utime(first_path, (0, 0))
+        (third_path, delta, builder) = make_bundle(self.scene, self.repository, name='third')
+        self.assertEqual('second.json', read_manifest(third_path)['previous'])
+        self.assertEqual([], delta)
+        self.assertEqual(0, builder.num_stored)
+
+        # Against an older one, the changed mesh is new again.
+        (fourth_path, delta, builder) = make_bundle(self.scene, self.repository, name='fourth', previous_manifest=first_path)
+        self.assertEqual([second['files']['meshes/plane.igmesh']['object']], delta)
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    result = unittest.main(argv=[sys.argv[0]] + args, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
@@ -0,0 +1,91 @@
+#
+# Blendigo canonical instancing tests
+#
+# INFO:
+# Checks that rotated and translated copies of a mesh are matched to the same canonical
+# mesh (the 'Detect copied meshes' export option), including symmetric
+# primitives whose principal axes have no unique sign or aren't unique at all. Run:
+#
+#   blender -b -P test_canonical_instancing.py
+#
+# The copies are matched like GeometryExporter.canonicalMeshHash() does: only against
+# meshes with the same shape_signature(), directly in their canonical frame, or else
+# by rigid alignment to the first copy.
+
+import sys, unittest
+
+import numpy as np
+
+from indigo_exporter.export.igmesh import canonical_frame, rigid_alignment, shape_signature
+
+def random_rotation(rng):
+    (q, r) = np.linalg.qr(rng.normal(size=(3, 3)))
+    if np.linalg.det(q) < 0.0:
+        q[:, 0] = -q[:, 0]
+    return q
+
+def box(sx, sy, sz):
+    return np.array([[x, y, z] for x in (-sx, sx) for y in (-sy, sy) for z in (-sz, sz)], dtype=np.float64)
+
+def cylinder(radius, height, segments=16):
+    t = np.linspace(0.0, 2.0 * np.pi, segments, endpoint=False)
+    return np.array([[radius * np.cos(a), radius * np.sin(a), h] for h in (-height / 2, height / 2) for a in t], dtype=np.float64)
+
+class CanonicalInstancingTest(unittest.TestCase):
+
+    def match(self, co, reference):
+        '''
+        Returns the rotation mapping co onto the canonical reference positions, or None.
+        '''
+        (center, rotation) = canonical_frame(co)
+        canonical_co = (co - center) @ rotation
+        tolerance = 1e-5 * float((reference.max(axis=0) - reference.min(axis=0)).max())
+        if np.abs(canonical_co - reference).max() <= tolerance:
+            return rotation
+        (rotation, error) = rigid_alignment(co - center, reference)
+        return rotation if error <= tolerance else None
+
+    def check_copies(self, shape, num_copies=20):
+        rng = np.random.default_rng(1)
+        (center, rotation) = canonical_frame(shape)
+        reference = ((shape - center) @ rotation).astype(np.float32).astype(np.float64)
+        signature = shape_signature(shape.astype(np.float32), center)
+
+        for i in range(num_copies):
+            # Copies are stored as float32 by Blender.
+            co = (shape @ random_rotation(rng).T + rng.normal(size=3) * 10.0).astype(np.float32).astype(np.float64)
+            rotation = self.match(co, reference)
+            self.assertIsNotNone(rotation, 'copy %i was not matched' % i)
+            self.assertAlmostEqual(np.linalg.det(rotation), 1.0, places=6)
+            self.assertEqual(signature, shape_signature(co, canonical_frame(co)[0]), 'copy %i has another signature' % i)
+
+    def test_asymmetric_cloud(self):
+        self.check_copies(np.random.default_rng(5).normal(size=(50, 3)) * [3.0, 2.0, 1.0])
+
+    def test_box(self):
+        self.check_copies(box(2.0, 1.0, 0.5))
+
+    def test_plate(self):
+        self.check_copies(box(3.0, 2.0, 0.01))
+
+    def test_cube(self):
+        self.check_copies(box(1.0, 1.0, 1.0))
+
+    def test_cylinder(self):
+        self.check_copies(cylinder(1.0, 4.0))
+
+    def test_other_shapes_have_other_signatures(self):
+        shapes = [box(2.0, 1.0, 0.5), box(2.0, 1.0, 0.6), box(1.0, 1.0, 1.0), box(2.0, 2.0, 2.0), cylinder(1.0, 4.0)]
+        signatures = [shape_signature(shape, shape.mean(axis=0)) for shape in shapes]
+        self.assertEqual(len(shapes), len(set(signatures)))
+
+    def test_mirrored_copy_is_not_matched(self):
+        shape = np.random.default_rng(5).normal(size=(50, 3)) * [3.0, 2.0, 1.0]
+        (center, rotation) = canonical_frame(shape)
+        reference = (shape - center) @ rotation
+        self.assertIsNone(self.match(shape * [1.0, 1.0, -1.0], reference))
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    result = unittest.main(argv=[sys.argv[0]] + args, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
@@ -0,0 +1,105 @@
+#
+# Blendigo camera culling tests
+#
+# INFO:
+# Tests which instances the frustum culler leaves out, for perspective and
+# orthographic cameras, with view margins, lens shift and a max distance. Run:
+#
+#   blender -b -P test_culling.py
+#
+# The camera is a 50mm lens on a 36mm sensor, rendering at 1920x1080: at a depth
+# of 10 the view is 7.2 wide and 4.05 high. Objects are cubes of size 2.
+
+import math, sys, unittest
+from types import SimpleNamespace
+
+import mathutils
+
+from indigo_exporter.export.culling import CameraView, FrustumCuller
+
+CUBE = [(x, y, z) for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)]
+
+def translation(x, y, z):
+    return mathutils.Matrix([[1, 0, 0, x], [0, 1, 0, y], [0, 0, 1, z], [0, 0, 0, 1]])
+
+def scene(matrix_world=None, type='PERSP', shift_x=0.0):
+    camera_data = SimpleNamespace(type=type, sensor_width=36.0, angle=2.0 * math.atan(18.0 / 50.0), shift_x=shift_x, shift_y=0.0, ortho_scale=6.0)
+    camera = SimpleNamespace(matrix_world=matrix_world or translation(0, 0, 0), data=camera_data)
+    return SimpleNamespace(camera=camera, render=SimpleNamespace(resolution_x=1920, resolution_y=1080, resolution_percentage=100))
+
+def cube(name='cube', emission=False, never_cull=False, section_plane=False):
+    material = SimpleNamespace(indigo_material=SimpleNamespace(type='diffuse', indigo_material_emission=SimpleNamespace(emission_enabled=emission)))
+    indigo_mesh = SimpleNamespace(never_cull=never_cull, section_plane=section_plane, exit_portal=False)
+    return SimpleNamespace(name=name, bound_box=CUBE, material_slots=[SimpleNamespace(material=material)], data=SimpleNamespace(indigo_mesh=indigo_mesh))
+
+class CullingTest(unittest.TestCase):
+
+    def assertCulled(self, culler, positions, obj=None):
+        obj = obj or cube()
+        for p in positions:
+            self.assertTrue(culler.is_culled(obj, translation(*p)), p)
+
+    def assertNotCulled(self, culler, positions, obj=None):
+        obj = obj or cube()
+        for p in positions:
+            self.assertFalse(culler.is_culled(obj, translation(*p)), p)
+
+    def test_perspective(self):
+        culler = FrustumCuller(CameraView(scene()))
+        # Inside, and partly inside the view on each side.
+        self.assertNotCulled(culler, [(0, 0, -10), (4, 0, -10), (-4, 0, -10), (0, 3, -10), (0, -3, -10), (0, 0, 0.5)])
+        # Outside each side, and behind the camera.
+        self.assertCulled(culler, [(5.5, 0, -10), (-5.5, 0, -10), (0, 4, -10), (0, -4, -10), (0, 0, 10)])
+        self.assertEqual(11, culler.num_tested)
+        self.assertEqual(5, culler.num_outside_view)
+        self.assertEqual(0, culler.num_too_far)
+
+    def test_margin(self):
+        self.assertCulled(FrustumCuller(CameraView(scene())), [(5.5, 0, -10)])
+        self.assertNotCulled(FrustumCuller(CameraView(scene()), margin=0.1), [(5.5, 0, -10)])
+
+    def test_lens_shift(self):
+        # Half a sensor width to the right: the view spans x from 0 to 7.2 at a depth of 10.
+        culler = FrustumCuller(CameraView(scene(shift_x=0.5)))
+        self.assertCulled(culler, [(-3, 0, -10)])
+        self.assertNotCulled(culler, [(7, 0, -10)])
+
+    def test_camera_transform(self):
+        # At x = 10, turned to look down -X, and scaled, which doesn't change the view.
+        matrix_world = mathutils.Matrix([[0, 0, 2, 10], [0, 2, 0, 0], [-2, 0, 0, 0], [0, 0, 0, 1]])
+        culler = FrustumCuller(CameraView(scene(matrix_world)))
+        self.assertNotCulled(culler, [(0, 0, 0), (0, 3, 0)])
+        self.assertCulled(culler, [(20, 0, 0), (0, 5, 0)])
+
+    def test_orthographic(self):
+        # The view is 6 wide and 3.375 high, at any depth.
+        culler = FrustumCuller(CameraView(scene(type='ORTHO')))
+        self.assertNotCulled(culler, [(0, 0, -10), (3.5, 0, -100), (0, 2.6, -5)])
+        self.assertCulled(culler, [(4.5, 0, -10), (0, 2.8, -5), (0, 0, 10)])
+
+    def test_max_distance(self):
+        culler = FrustumCuller(CameraView(scene()), max_distance=100.0)
+        self.assertNotCulled(culler, [(0, 0, -100)])
+        self.assertCulled(culler, [(0, 0, -102), (200, 0, 0)])
+        self.assertEqual(2, culler.num_too_far)
+        self.assertEqual(2, culler.num_culled())
+
+        self.assertNotCulled(FrustumCuller(CameraView(scene())), [(0, 0, -1e6)])
+
+    def test_exempt_objects(self):
+        culler = FrustumCuller(CameraView(scene()), max_distance=10.0)
+        for obj in [cube('emitter', emission=True), cube('never', never_cull=True), cube('section', section_plane=True)]:
+            self.assertNotCulled(culler, [(0, 0, 10), (0, 0, -100)], obj)
+        self.assertEqual(0, culler.num_tested)
+
+    def test_projected_size(self):
+        view = CameraView(scene())
+        (near, far) = (view.projected_size(view.camera_space_corners(cube(), translation(0, 0, -z))) for z in (50, 100))
+        self.assertAlmostEqual(2.0, near / far, places=6)
+        # The diameter of the sphere around the cube is 2 sqrt(3), on a view 36 wide at a depth of 50.
+        self.assertAlmostEqual(2.0 * math.sqrt(3.0) / 36.0 * 1920, near, places=6)
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    result = unittest.main(argv=[sys.argv[0]] + args, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
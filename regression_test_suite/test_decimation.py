@@ -0,0 +1,85 @@
+#
+# Blendigo mesh decimation tests
+#
+# INFO:
+# Decimates test meshes for levels of detail, checking the size of the decimated
+# meshes and the fallback to finer levels for meshes which clustering collapses
+# completely. Run:
+#
+#   blender -b -P test_decimation.py
+
+import os, sys, unittest
+
+import numpy as np
+
+from indigo_exporter.export.igmesh import igmesh_writer, decimate_mesh_data, decimate_lod_data
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import mesh_fixtures
+
+def mesh_data(nx, ny):
+    (co, polygons) = mesh_fixtures.grid(nx, ny)
+    mesh = mesh_fixtures.Mesh(co, polygons, smooth=[True] * len(polygons))
+    mesh.uv_layers = [mesh_fixtures.UVLayer('map', co[mesh.loops.attributes['vertex_index'], :2])]
+    (data, used_mat_indices, use_shading_normals) = igmesh_writer.build_mesh_data(mesh_fixtures.Object('grid', ['red']), mesh)
+    return data
+
+class DecimationTest(unittest.TestCase):
+
+    def assertValid(self, data):
+        self.assertEqual(len(data.vertices), len(data.normals))
+        np.testing.assert_allclose(np.linalg.norm(data.normals, axis=1), 1.0, rtol=1e-5)
+        self.assertEqual(0, len(data.quads))
+        corners = data.triangles[:, 0:3]
+        self.assertTrue(((corners >= 0) & (corners < len(data.vertices))).all())
+        # No triangle is collapsed.
+        self.assertTrue(((corners[:, 0] != corners[:, 1]) & (corners[:, 1] != corners[:, 2]) & (corners[:, 2] != corners[:, 0])).all())
+
+    def test_decimate(self):
+        data = mesh_data(40, 40)
+        for ratio in [0.5, 0.25, 0.1]:
+            decimated = decimate_mesh_data(data, ratio)
+            self.assertValid(decimated)
+            # Within the 10% the cell size is adjusted to.
+            self.assertAlmostEqual(1.0, len(decimated.vertices) / (ratio * len(data.vertices)), delta=0.1)
+            self.assertGreater(len(decimated.triangles), 0)
+            self.assertEqual(['red'], decimated.material_names)
+            # UV indices are kept, so the UVs are shared with the full mesh.
+            self.assertIs(data.uvs, decimated.uvs)
+
+    def test_full_mesh(self):
+        data = mesh_data(6, 6)
+        (decimated, level) = decimate_lod_data(data, 0.5, 0)
+        self.assertEqual(0, level)
+        # Quads are split in two, nothing else changes.
+        self.assertIs(data.vertices, decimated.vertices)
+        self.assertEqual(2 * len(data.quads), len(decimated.triangles))
+
+    def test_no_fallback(self):
+        data = mesh_data(40, 40)
+        (decimated, level) = decimate_lod_data(data, 0.25, 2)
+        self.assertEqual(2, level)
+        self.assertValid(decimated)
+        self.assertLess(len(decimated.vertices), len(data.vertices) / 10)
+
+    def test_fallback_to_finer_level(self):
+        # A strip two faces wide collapses to lines at the vertex count of level 2.
+        data = mesh_data(300, 2)
+        self.assertEqual(0, len(decimate_mesh_data(data, 0.25 ** 2).triangles))
+
+        (decimated, level) = decimate_lod_data(data, 0.25, 2)
+        self.assertEqual(1, level)
+        self.assertValid(decimated)
+        self.assertGreater(len(decimated.triangles), 0)
+        self.assertLess(len(decimated.vertices), len(data.vertices))
+
+    def test_fallback_to_full_mesh(self):
+        data = mesh_data(100, 1)
+        (decimated, level) = decimate_lod_data(data, 0.1, 2)
+        self.assertEqual(0, level)
+        self.assertEqual(2 * len(data.quads), len(decimated.triangles))
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    result = unittest.main(argv=[sys.argv[0]] + args, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
@@ -0,0 +1,106 @@
+#
+# Blendigo deterministic export tests
+#
+# INFO:
+# Checks that two exports of the same scene write the same XML with the
+# 'Deterministic export' option, however the objects were visited, and that the
+# fixed float format keeps float32 values exact. Run:
+#
+#   blender -b -P test_deterministic_export.py
+#
+# The exports are put together like the export operator does: materials, meshes,
+# lamps and instances in the order of the GeometryExporter after sortExports(),
+# with floats formatted by format_floats() before the XML is written.
+
+import sys, unittest
+import xml.etree.cElementTree as ET
+
+import numpy as np
+
+from indigo_exporter.export import xml_builder, format_floats
+from indigo_exporter.export.geometry import GeometryExporter
+
+FLOAT_FORMAT = '%.9g'
+
+class Element(xml_builder):
+    properties = []
+
+    def __init__(self, tag, fmt):
+        self.tag = tag
+        self.fmt = fmt
+
+    def build_xml_element(self):
+        xml = self.Element(self.tag)
+        self.build_subelements(None, self.fmt, xml)
+        return xml
+
+def material(name, *dependencies):
+    fmt = {'name': [name], 'albedo': [0.1, 0.2, 0.3]}
+    if dependencies:
+        fmt['blend'] = {'a_name': [dependencies[0]], 'b_name': [dependencies[1]], 'blend': [1.0 / 3.0]}
+    return Element('material', fmt).build_xml_element()
+
+def model(name, x):
+    return Element('model', {'mesh_name': [name], 'pos': [x, x / 7.0, -x], 'emission_scale': [2]}).build_xml_element()
+
+# (name, dependencies) of the materials, (key, mesh name, position) of the instances
+MATERIALS = [('wood', ()), ('paint', ()), ('mix', ('wood', 'paint')), ('clay', ())]
+INSTANCES = [((3, 0), 'chair', 0.1), ((1, 0), 'table', 1e-7), ((1, 1), 'chair', 12345.678), ((2, 0), 'lamp', 2.0 / 3.0)]
+
+class DeterministicExportTest(unittest.TestCase):
+
+    def export(self, materials, instances):
+        ge = GeometryExporter()
+        # Materials are built depth first, so a material comes after its dependencies in the order they were used.
+        for (name, dependencies) in materials:
+            for dependency in dependencies:
+                if dependency not in ge.ExportedMaterials:
+                    ge.ExportedMaterials[dependency] = [material(dependency)]
+            if name not in ge.ExportedMaterials:
+                ge.ExportedMaterials[name] = [material(name, *dependencies)]
+            ge.material_graph.dependencies[name] = list(dependencies)
+        for (key, mesh_name, x) in instances:
+            ge.MeshesOnDisk.setdefault(mesh_name, (mesh_name, Element('mesh', {'name': [mesh_name]}).build_xml_element()))
+            ge.ExportedObjects[key] = ('OBJECT', model(mesh_name, x))
+        ge.ExportedLamps['sun'] = [Element('sun', {'turbidity': [2.2]}).build_xml_element()]
+
+        ge.sortExports()
+
+        root = ET.Element('scene')
+        for elements in ge.ExportedMaterials.values():
+            root.extend(elements)
+        root.extend(xml for (name, xml) in ge.MeshesOnDisk.values())
+        for elements in ge.ExportedLamps.values():
+            root.extend(elements)
+        root.extend(xml for (obj_type, xml) in ge.ExportedObjects.values())
+        format_floats(root, FLOAT_FORMAT)
+        return ET.tostring(root, encoding='utf-8')
+
+    def test_double_export_is_identical(self):
+        first = self.export(MATERIALS, INSTANCES)
+        second = self.export(list(reversed(MATERIALS)), list(reversed(INSTANCES)))
+        self.assertEqual(first, second)
+
+        root = ET.fromstring(first)
+        # By name, except that mix comes after the materials it blends.
+        self.assertEqual(['clay', 'wood', 'paint', 'mix'], [m.findtext('name') for m in root.findall('material')])
+        self.assertEqual(['table', 'chair', 'lamp', 'chair'], [m.findtext('mesh_name') for m in root.findall('model')])
+
+    def test_float_format(self):
+        # A float32 value from Blender, which str() writes with all float64 digits.
+        x = float(np.float32(0.1))
+        root = Element('model', {'pos': [x, 2, True], 'name': ['a b']}).build_xml_element()
+        self.assertEqual('0.10000000149011612 2 True', root.findtext('pos'))
+        format_floats(root, FLOAT_FORMAT)
+        self.assertEqual('0.100000001 2 True', root.findtext('pos'))
+        self.assertEqual('a b', root.findtext('name'))
+
+    def test_float32_values_round_trip(self):
+        values = np.random.default_rng(3).normal(size=1000).astype(np.float32) * np.float32(1e3)
+        for v in values:
+            self.assertEqual(v, np.float32(float(FLOAT_FORMAT % float(v))))
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    result = unittest.main(argv=[sys.argv[0]] + args, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
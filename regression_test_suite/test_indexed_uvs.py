@@ -0,0 +1,112 @@
+#
+# Blendigo indexed UV tests
+#
+# INFO:
+# Builds igmesh data from test meshes with one or more UV layers, writes and reads
+# it back, and checks that every face corner still gets the UVs of its loop in each
+# layer while shared UVs are written once. Run:
+#
+#   blender -b -P test_indexed_uvs.py
+
+import os, sys, shutil, tempfile, unittest
+
+import numpy as np
+
+from indigo_exporter.export.igmesh import igmesh_writer, write_igmesh_data, read_igmesh_data
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import mesh_fixtures
+
+def loop_uvs(mesh, fn):
+    '''
+    UVs of fn(vertex, polygon, corner) for every loop of the mesh, corner being the
+    position of the loop in its polygon.
+    '''
+    uvs = []
+    for (polygon, (start, total)) in enumerate(zip(mesh.polygons.attributes['loop_start'], mesh.polygons.attributes['loop_total'])):
+        for corner in range(total):
+            uvs.append(fn(mesh.loops.attributes['vertex_index'][start + corner], polygon, corner))
+    return np.array(uvs, dtype=np.float32)
+
+class IndexedUVTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='blendigo_indexed_uv_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def round_trip(self, mesh):
+        (data, used_mat_indices, use_shading_normals) = igmesh_writer.build_mesh_data(mesh_fixtures.Object('grid'), mesh)
+        filename = os.path.join(self.dir, 'grid.igmesh')
+        with open(filename, 'wb') as file:
+            write_igmesh_data(file, data)
+        return read_igmesh_data(filename)
+
+    def assertCornerUVs(self, mesh, data):
+        expected = np.stack([layer.data.attributes['uv'] for layer in mesh.uv_layers])
+        polygons = mesh.polygons.attributes
+        loop_triangles = mesh.loop_triangles.attributes
+        # The test meshes have no triangles but those of their n-gons.
+        tri_loops = loop_triangles['loops'][polygons['loop_total'][loop_triangles['polygon_index']] > 4]
+        quad_loops = polygons['loop_start'][polygons['loop_total'] == 4, np.newaxis] + np.arange(4)
+
+        ((_, _, tri_uvs, _), (_, _, quad_uvs, _)) = mesh_fixtures.face_corners(data)
+        np.testing.assert_array_equal(expected[:, tri_loops], tri_uvs)
+        np.testing.assert_array_equal(expected[:, quad_loops], quad_uvs)
+
+    def test_uvs_are_shared(self):
+        (co, polygons) = mesh_fixtures.grid(4, 3)
+        mesh = mesh_fixtures.Mesh(co, polygons)
+        mesh.uv_layers = [mesh_fixtures.UVLayer('map', loop_uvs(mesh, lambda v, polygon, corner: co[v, :2] / 4.0))]
+        data = self.round_trip(mesh)
+
+        self.assertEqual(1, data.num_uv_mappings)
+        # One UV per vertex, instead of one per loop.
+        self.assertEqual(len(co), len(data.uvs))
+        self.assertCornerUVs(mesh, data)
+
+    def test_layers_are_indexed_together(self):
+        (co, polygons) = mesh_fixtures.grid(4, 3, ngon_rows=1)
+        mesh = mesh_fixtures.Mesh(co, polygons)
+        # Each pentagon of the first row has a tile of its own in the second layer, the other faces share their UVs.
+        tile = [(0.5, 0), (1, 0), (1, 1), (0, 1), (0, 0)]
+        mesh.uv_layers = [
+            mesh_fixtures.UVLayer('map', loop_uvs(mesh, lambda v, polygon, corner: co[v, :2] / 4.0)),
+            mesh_fixtures.UVLayer('tiles', loop_uvs(mesh, lambda v, polygon, corner: tile[corner] if polygon < 4 else co[v, :2] % 2.0))]
+        data = self.round_trip(mesh)
+
+        self.assertEqual(2, data.num_uv_mappings)
+        # A UV index addresses both layers, so there is one per distinct pair of UVs.
+        pairs = np.concatenate([layer.data.attributes['uv'] for layer in mesh.uv_layers], axis=1)
+        num_pairs = len(np.unique(pairs, axis=0))
+        self.assertLess(len(co), num_pairs)
+        self.assertLess(num_pairs, len(mesh.loops))
+        self.assertEqual(2 * num_pairs, len(data.uvs))
+        self.assertCornerUVs(mesh, data)
+
+    def test_negative_zero(self):
+        (co, polygons) = mesh_fixtures.grid(2, 1)
+        mesh = mesh_fixtures.Mesh(co, polygons)
+        uvs = np.zeros((len(mesh.loops), 2), dtype=np.float32)
+        uvs[::2] = -0.0
+        mesh.uv_layers = [mesh_fixtures.UVLayer('zero', uvs)]
+        data = self.round_trip(mesh)
+
+        # -0.0 and 0.0 are the same UV.
+        self.assertEqual([[0.0, 0.0]], data.uvs.tolist())
+        self.assertFalse(data.quads[:, 4:8].any())
+
+    def test_dummy_uvs(self):
+        (co, polygons) = mesh_fixtures.grid(2, 2, ngon_rows=1)
+        data = self.round_trip(mesh_fixtures.Mesh(co, polygons))
+
+        self.assertEqual(1, data.num_uv_mappings)
+        self.assertEqual([[0.0, 0.0]], data.uvs.tolist())
+        self.assertFalse(data.triangles[:, 3:6].any())
+        self.assertFalse(data.quads[:, 4:8].any())
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    result = unittest.main(argv=[sys.argv[0]] + args, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
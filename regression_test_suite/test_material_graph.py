@@ -0,0 +1,101 @@
+#
+# Blendigo material graph tests
+#
+# INFO:
+# Builds graphs of stand-in composite materials with MaterialGraph, checking that
+# each material is built once and after the materials it depends on, that the
+# order is the same however the materials were used, and that cycles are
+# reported. Run:
+#
+#   blender -b -P test_material_graph.py
+
+import sys, unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from indigo_exporter.export import material_graph
+from indigo_exporter.export.material_graph import MaterialGraph
+
+class Material(object):
+    '''
+    A stand-in for a Blender material whose indigo_material depends on the named
+    materials, like a blend or coating material, and records when it is built.
+    '''
+
+    def __init__(self, name, dependencies, built):
+        self.name = name
+        self.indigo_material = self
+        self.names = dependencies
+        self.built = built
+
+    def dependencies(self):
+        return list(self.names)
+
+    def factory(self, obj, mat, scene, texture_budget=None):
+        self.built.append((mat.name, texture_budget))
+        return ['<material %s>' % mat.name]
+
+class MaterialGraphTest(unittest.TestCase):
+
+    def materials(self, dependencies):
+        '''
+        Patches bpy.data.materials with stand-ins for the materials in dependencies,
+        a map from material name to the names of the materials it depends on.
+        '''
+        self.built = []
+        materials = dict((name, Material(name, names, self.built)) for (name, names) in dependencies.items())
+        patcher = mock.patch.object(material_graph, 'bpy', SimpleNamespace(data=SimpleNamespace(materials=materials)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return materials
+
+    def test_dependencies_come_first(self):
+        materials = self.materials({'mix': ['coated', 'base'], 'coated': ['base'], 'base': [], 'other': []})
+        compiled = {}
+        graph = MaterialGraph(compiled)
+        graph.compile(None, materials['mix'], None, 'budget')
+
+        self.assertEqual(['base', 'coated', 'mix'], list(compiled.keys()))
+        self.assertEqual([('base', 'budget'), ('coated', 'budget'), ('mix', 'budget')], self.built)
+        self.assertEqual(['<material mix>'], compiled['mix'])
+        # base was used a second time, by mix.
+        self.assertEqual(1, graph.num_shared)
+
+    def test_materials_are_built_once(self):
+        materials = self.materials({'a': ['shared'], 'b': ['shared'], 'shared': []})
+        graph = MaterialGraph({})
+        for name in ['a', 'b', 'shared', 'a']:
+            graph.compile(None, materials[name], None)
+
+        self.assertEqual(['shared', 'a', 'b'], [name for (name, texture_budget) in self.built])
+        self.assertEqual(1, graph.num_shared)
+
+    def test_cycles(self):
+        materials = self.materials({'top': ['loop'], 'loop': ['middle'], 'middle': ['loop'], 'self': ['self']})
+        graph = MaterialGraph({})
+        with self.assertRaisesRegex(Exception, '"loop" refers to itself: loop -> middle -> loop'):
+            graph.compile(None, materials['top'], None)
+        with self.assertRaisesRegex(Exception, 'self -> self'):
+            graph.compile(None, materials['self'], None)
+        self.assertEqual([], self.built)
+
+    def test_sort(self):
+        dependencies = {'mix': ['wood', 'paint'], 'wood': [], 'paint': ['primer'], 'primer': [], 'clay': []}
+        orders = []
+        for names in [['mix', 'clay'], ['clay', 'paint', 'mix'], ['primer', 'wood', 'mix', 'clay']]:
+            materials = self.materials(dependencies)
+            compiled = {}
+            graph = MaterialGraph(compiled)
+            for name in names:
+                graph.compile(None, materials[name], None)
+            graph.sort()
+            orders.append(list(compiled.keys()))
+
+        # By name, except that a material comes after the materials it depends on.
+        self.assertEqual(['clay', 'wood', 'primer', 'paint', 'mix'], orders[0])
+        self.assertEqual([orders[0]] * 3, orders)
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    result = unittest.main(argv=[sys.argv[0]] + args, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
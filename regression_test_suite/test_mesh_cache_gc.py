@@ -0,0 +1,176 @@
+#
+# Blendigo mesh cache garbage collection tests
+#
+# INFO:
+# Checks that the mesh cache garbage collection never evicts a mesh which an
+# exported frame still refers to, on the layout of a multi-frame export. Run:
+#
+#   blender -b -P test_mesh_cache_gc.py
+#
+# An animation exported to <export dir>/scene.####.igs has one .igs per frame in
+# the export directory, with the <path> of each mesh relative to it, and the
+# objects.igs of each frame (models referring to meshes by name only) in
+# <export dir>/scene/<frame>/.
+
+import os, sys, time, socket, shutil, tempfile, subprocess, unittest
+
+from indigo_exporter.export.mesh_cache import MeshCache, collect_garbage, referenced_by_scenes, touch, export_lock_name, lock_path
+
+SCENE_IGS = '''<?xml version="1.0" encoding="utf-8"?>
+<scene>
+%s	<include>
+		<pathname>scene/%05i/objects.igs</pathname>
+	</include>
+</scene>
+'''
+
+MESH = '''	<mesh>
+		<name>%s</name>
+		<path>scene/%s.igmesh</path>
+	</mesh>
+'''
+
+OBJECTS_IGS = '''<?xml version="1.0" encoding="utf-8"?>
+<scenedata>
+%s</scenedata>
+'''
+
+MODEL = '''	<model>
+		<mesh_name>%s</mesh_name>
+	</model>
+'''
+
+class MeshCacheGarbageCollectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.export_dir = tempfile.mkdtemp(prefix='blendigo_gc_test_')
+        self.mesh_dir = os.path.join(self.export_dir, 'scene')
+        os.makedirs(self.mesh_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.export_dir)
+
+    def write_mesh(self, name, age_days):
+        path = os.path.join(self.mesh_dir, name + '.igmesh')
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 1024)
+        mtime = time.time() - age_days * 86400
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def write_frame(self, frame, mesh_names):
+        with open(os.path.join(self.export_dir, 'scene.%04i.igs' % frame), 'w') as f:
+            f.write(SCENE_IGS % (''.join(MESH % (n, n) for n in mesh_names), frame))
+        frame_dir = os.path.join(self.mesh_dir, '%05i' % frame)
+        os.makedirs(frame_dir)
+        with open(os.path.join(frame_dir, 'objects.igs'), 'w') as f:
+            f.write(OBJECTS_IGS % ''.join(MODEL % n for n in mesh_names))
+
+    def test_frames_keep_their_meshes(self):
+        # The meshes of the first frames were last touched long ago, but the frames still need them.
+        shared = self.write_mesh('shared', 30)
+        frame1 = self.write_mesh('frame1', 20)
+        frame2 = self.write_mesh('frame2', 10)
+        frame3 = self.write_mesh('frame3', 0)
+        unreferenced = self.write_mesh('unreferenced', 5)
+        self.write_frame(1, ['shared', 'frame1'])
+        self.write_frame(2, ['shared', 'frame2'])
+        self.write_frame(3, ['shared', 'frame3'])
+
+        keep = referenced_by_scenes(self.mesh_dir)
+        self.assertEqual(set(os.path.normpath(p) for p in [shared, frame1, frame2, frame3]), keep)
+
+        gc = collect_garbage(self.mesh_dir, max_bytes=1, max_age=86400, keep=keep, dry_run=False)
+        self.assertEqual([unreferenced], [path for (path, size, mtime) in gc.evicted])
+        for path in [shared, frame1, frame2, frame3]:
+            self.assertTrue(os.path.isfile(path), '%s was evicted' % path)
+        self.assertFalse(os.path.exists(unreferenced))
+
+    def test_partially_written_scene_is_skipped(self):
+        mesh = self.write_mesh('frame1', 10)
+        self.write_frame(1, ['frame1'])
+        with open(os.path.join(self.export_dir, 'scene.0002.igs'), 'w') as f:
+            f.write('<?xml version="1.0" encoding="utf-8"?>\n<scene>\n\t<mesh>')
+
+        self.assertEqual(set([os.path.normpath(mesh)]), referenced_by_scenes(self.mesh_dir))
+
+    def test_touch_only_in_mesh_dir(self):
+        mesh = self.write_mesh('mesh', 10)
+        # E.g. an OBJ proxy of the user, next to the export.
+        asset = os.path.join(self.export_dir, 'proxy.obj')
+        with open(asset, 'w') as f:
+            f.write('v 0 0 0\n')
+        old = time.time() - 86400
+        os.utime(asset, (old, old))
+
+        touch([mesh, asset, os.path.join(self.mesh_dir, 'missing.igmesh')], self.mesh_dir)
+        self.assertGreater(os.path.getmtime(mesh), time.time() - 60)
+        self.assertAlmostEqual(os.path.getmtime(asset), old, places=3)
+
+    def write_export_lock(self, pid):
+        owner = '%s %i' % (socket.gethostname(), pid)
+        path = lock_path(os.path.join(self.mesh_dir, export_lock_name(owner)))
+        with open(path, 'w') as f:
+            f.write(owner)
+        return path
+
+    def test_other_export_defers_eviction(self):
+        # E.g. a command line worker which reused the mesh but hasn't written its scene yet.
+        mesh = self.write_mesh('reused', 30)
+        export_lock = self.write_export_lock(os.getppid())
+
+        gc = collect_garbage(self.mesh_dir, max_bytes=1, max_age=86400, dry_run=False)
+        self.assertEqual([], gc.evicted)
+        self.assertEqual(1, len(gc.other_exports))
+        self.assertTrue(os.path.isfile(mesh))
+
+        os.remove(export_lock)
+        gc = collect_garbage(self.mesh_dir, max_bytes=1, max_age=86400, dry_run=False)
+        self.assertEqual([mesh], [path for (path, size, mtime) in gc.evicted])
+
+    def test_lock_of_stopped_export_is_ignored(self):
+        mesh = self.write_mesh('old', 30)
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        self.write_export_lock(process.pid)
+
+        gc = collect_garbage(self.mesh_dir, max_age=86400, dry_run=False)
+        self.assertEqual([mesh], [path for (path, size, mtime) in gc.evicted])
+
+    def test_own_export_lock(self):
+        mesh = self.write_mesh('old', 30)
+        cache = MeshCache()
+        cache.begin(self.mesh_dir)
+        self.assertTrue(cache.reuse(mesh))
+        self.assertFalse(cache.reuse(os.path.join(self.mesh_dir, 'missing.igmesh')))
+
+        # The lock of this process doesn't hold back its own cleanup.
+        gc = collect_garbage(self.mesh_dir, max_age=86400, keep=[mesh], dry_run=False)
+        self.assertEqual([], gc.other_exports)
+
+        cache.release_all()
+        self.assertEqual(['old.igmesh'], os.listdir(self.mesh_dir))
+
+    def test_deleted_reused_mesh_fails_export(self):
+        mesh = self.write_mesh('reused', 0)
+        cache = MeshCache()
+        self.assertTrue(cache.reuse(mesh))
+        os.remove(mesh)
+        self.assertRaises(Exception, cache.wait)
+
+    def test_rewritten_scene_is_parsed_again(self):
+        self.write_mesh('a', 0)
+        b = self.write_mesh('b', 0)
+        self.write_frame(1, ['a'])
+        referenced_by_scenes(self.mesh_dir)
+
+        # Another size, so that the change is seen even where file times are coarse.
+        scene = os.path.join(self.export_dir, 'scene.0001.igs')
+        with open(scene, 'w') as f:
+            f.write(SCENE_IGS % (MESH % ('b', 'b') + '\n', 1))
+        self.assertEqual(set([os.path.normpath(b)]), referenced_by_scenes(self.mesh_dir))
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    result = unittest.main(argv=[sys.argv[0]] + args, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
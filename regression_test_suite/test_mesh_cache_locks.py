@@ -0,0 +1,201 @@
+#
+# Blendigo mesh cache lock tests
+#
+# INFO:
+# Checks how exporters sharing a mesh directory claim, write and wait for mesh
+# files: one writer per mesh, waiting for other exporters, and breaking the locks
+# of exporters which stopped. Run:
+#
+#   blender -b -P test_mesh_cache_locks.py
+#
+# Other exporters are either lock files written by the test, or processes forked
+# from it which race for the same mesh.
+
+import os, sys, time, json, socket, shutil, tempfile, threading, subprocess, unittest
+
+from indigo_exporter.export import ExportCancelledException, mesh_cache
+from indigo_exporter.export.mesh_cache import MeshCache, publishing, lock_path, read_lock
+
+def owner(pid):
+    return '%s %i' % (socket.gethostname(), pid)
+
+class MeshCacheLockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='blendigo_mesh_cache_lock_test_')
+        self.path = os.path.join(self.dir, 'mesh.igmesh')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def cache(self):
+        cache = MeshCache()
+        cache.poll_interval = 0.01
+        self.addCleanup(cache.release_all)
+        return cache
+
+    def write_lock(self, lock_owner, age=0):
+        with open(lock_path(self.path), 'w') as f:
+            f.write(lock_owner)
+        if age > 0:
+            t = time.time() - age
+            os.utime(lock_path(self.path), (t, t))
+
+    def publish_later(self, data, delay=0.1):
+        # Another exporter publishing its file: the file first, then its lock is removed.
+        def publish():
+            time.sleep(delay)
+            with open(self.path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(self.path + '.tmp', self.path)
+            os.remove(lock_path(self.path))
+        t = threading.Thread(target=publish)
+        t.start()
+        self.addCleanup(t.join)
+
+    def dead_pid(self):
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        return process.pid
+
+    def test_claim_and_publish(self):
+        cache = self.cache()
+        self.assertFalse(cache.reuse(self.path))
+        self.assertTrue(cache.claim(self.path))
+        self.assertEqual(mesh_cache.OWNER, read_lock(self.path))
+        # Claiming again in the same export is allowed.
+        self.assertTrue(cache.claim(self.path))
+
+        with publishing(self.path) as f:
+            f.write(b'mesh')
+        self.assertEqual(['mesh.igmesh'], os.listdir(self.dir))
+        self.assertTrue(cache.reuse(self.path))
+
+    def test_failed_write(self):
+        cache = self.cache()
+        self.assertTrue(cache.claim(self.path))
+        with self.assertRaises(ZeroDivisionError):
+            with publishing(self.path) as f:
+                f.write(b'half a mesh')
+                1 / 0
+        # Neither the temporary file nor the lock is left, so another exporter can write it.
+        self.assertEqual([], os.listdir(self.dir))
+
+    def test_unwritten_claims_are_released(self):
+        cache = self.cache()
+        self.assertTrue(cache.claim(self.path))
+        cache.release_all()
+        self.assertEqual([], os.listdir(self.dir))
+
+    def test_wait_for_other_exporter(self):
+        self.write_lock(owner(os.getppid()))
+        cache = self.cache()
+        self.assertFalse(cache.claim(self.path))
+        self.assertEqual(set([self.path]), cache.waiting)
+        self.assertEqual(1, cache.num_shared)
+
+        self.publish_later(b'mesh')
+        cache.wait()
+        with open(self.path, 'rb') as f:
+            self.assertEqual(b'mesh', f.read())
+        self.assertEqual(set(), cache.waiting)
+
+    def test_cancel_waiting(self):
+        self.write_lock(owner(os.getppid()))
+        cache = self.cache()
+        self.assertFalse(cache.claim(self.path))
+        with self.assertRaises(ExportCancelledException):
+            cache.wait(should_abort=lambda: True)
+        # The other exporter's lock is left alone.
+        self.assertEqual(owner(os.getppid()), read_lock(self.path))
+
+    def test_other_exporter_stops(self):
+        self.write_lock(owner(os.getppid()))
+        cache = self.cache()
+        self.assertFalse(cache.claim(self.path))
+        os.remove(lock_path(self.path))
+        with self.assertRaisesRegex(Exception, 'stopped without writing it'):
+            cache.wait()
+
+    def test_stale_locks_are_broken(self):
+        # The owner doesn't run anymore.
+        self.write_lock(owner(self.dead_pid()))
+        self.assertTrue(self.cache().claim(self.path))
+        self.assertEqual(mesh_cache.OWNER, read_lock(self.path))
+        os.remove(lock_path(self.path))
+
+        # The owner still runs, but the lock is older than stale_time.
+        self.write_lock(owner(os.getppid()), age=MeshCache.stale_time + 60)
+        self.assertTrue(self.cache().claim(self.path))
+        os.remove(lock_path(self.path))
+
+        # A lock from another host is only broken by its age.
+        self.write_lock('elsewhere %i' % self.dead_pid())
+        self.assertFalse(self.cache().claim(self.path))
+
+    def test_waiting_on_stale_lock(self):
+        self.write_lock(owner(os.getppid()))
+        cache = self.cache()
+        self.assertFalse(cache.claim(self.path))
+        self.write_lock(owner(self.dead_pid()))
+        with self.assertRaisesRegex(Exception, 'stopped without writing it'):
+            cache.wait()
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'Exporters are forked processes')
+    def test_contention(self):
+        # Exporters racing for the same mesh from a common start time: one writes it, the others wait for it.
+        num_exporters = 8
+        start_time = time.time() + 0.5
+        pids = []
+        for i in range(num_exporters):
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    code = self.contend(i, start_time)
+                finally:
+                    os._exit(code)
+            pids.append(pid)
+
+        for pid in pids:
+            (_, status) = os.waitpid(pid, 0)
+            self.assertEqual(0, status)
+
+        results = []
+        for i in range(num_exporters):
+            with open(os.path.join(self.dir, 'result%i.json' % i)) as f:
+                results.append(json.load(f))
+        self.assertEqual(1, [r['action'] for r in results].count('wrote'))
+        self.assertTrue(all(r['data'] == 'mesh' for r in results))
+        self.assertEqual(['mesh.igmesh'], [f for f in os.listdir(self.dir) if not f.startswith('result')])
+
+    def contend(self, i, start_time):
+        # In a forked exporter, which needs an owner of its own.
+        mesh_cache.OWNER = owner(os.getpid())
+        cache = MeshCache()
+        cache.poll_interval = 0.01
+        time.sleep(max(0.0, start_time - time.time()))
+
+        if cache.reuse(self.path):
+            action = 'reused'
+        elif cache.claim(self.path):
+            with publishing(self.path) as f:
+                # Slowly, so that the others find the mesh claimed.
+                time.sleep(0.2)
+                f.write(b'mesh')
+            action = 'wrote'
+        else:
+            cache.wait()
+            action = 'waited'
+        cache.release_all()
+
+        with open(self.path) as f:
+            data = f.read()
+        with open(os.path.join(self.dir, 'result%i.json' % i), 'w') as f:
+            json.dump({'action': action, 'data': data}, f)
+        return 0
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    result = unittest.main(argv=[sys.argv[0]] + args, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
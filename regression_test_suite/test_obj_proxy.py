@@ -0,0 +1,104 @@
+#
+# Blendigo OBJ proxy conversion tests
+#
+# INFO:
+# Converts small OBJ files with the OBJ proxy converter and reads the igmesh
+# files back, checking faces, UVs, materials and normals. Run:
+#
+#   blender -b -P test_obj_proxy.py
+
+import os, sys, stat, shutil, tempfile, unittest
+
+import numpy as np
+
+from indigo_exporter.export.igmesh import read_igmesh_data
+from indigo_exporter.export.mesh_cache import MeshCache, lock_path
+from indigo_exporter.export.obj_proxy import obj_proxy_converter
+
+# Two quads and a triangle of a unit cube, each face with its own normal.
+FACETED = '''v 0 0 0
+v 1 0 0
+v 1 1 0
+v 0 1 0
+v 0 0 1
+v 1 0 1
+vt 0 0
+vt 1 0
+vt 1 1
+vt 0 1
+vn 0 0 -1
+vn 0 -1 0
+vn 0 0 2
+usemtl bottom
+f 1/1/1 4/4/1 3/3/1 2/2/1
+usemtl side
+f 1/1/2 2/2/2 6/3/2 5/4/2
+f 5/1/3 6/2/3 2/3/3
+'''
+
+class ObjProxyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='blendigo_obj_proxy_test_')
+        self.cache_dir = os.path.join(self.dir, 'proxies')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def convert(self, text, mesh_cache=None):
+        path = os.path.join(self.dir, 'proxy.obj')
+        with open(path, 'w') as f:
+            f.write(text)
+        converter = obj_proxy_converter(self.cache_dir, mesh_cache)
+        (igmesh_path, material_names) = converter.convert(path)
+        return (igmesh_path, material_names, read_igmesh_data(igmesh_path))
+
+    def test_faceted_normals(self):
+        (igmesh_path, material_names, data) = self.convert(FACETED)
+        self.assertEqual(['bottom', 'side'], material_names)
+        self.assertEqual(1, len(data.quads[data.quads[:, 8] == 0]))
+        self.assertEqual(1, len(data.triangles))
+
+        # No two faces share a normal, so each face gets vertices of its own.
+        self.assertEqual(4 + 4 + 3, len(data.vertices))
+        self.assertEqual(len(data.vertices), len(data.normals))
+        np.testing.assert_allclose(np.linalg.norm(data.normals, axis=1), 1.0, rtol=1e-6)
+
+        # Every corner still has its OBJ position, and the normal of its face.
+        face_normals = [(0, 0, -1), (0, -1, 0), (0, 0, 1)]
+        for (face, normal) in zip([data.quads[0, :4], data.quads[1, :4], data.triangles[0, :3]], face_normals):
+            for v in face:
+                np.testing.assert_allclose(data.normals[v], normal)
+        np.testing.assert_allclose(data.vertices[data.quads[0, :4]], [(0, 0, 0), (0, 1, 0), (1, 1, 0), (1, 0, 0)])
+        np.testing.assert_allclose(data.uvs[data.quads[0, 4:8]], [(0, 0), (0, 1), (1, 1), (1, 0)])
+
+    def test_missing_normals(self):
+        # Without a normal on every corner, no normals are written and no vertices are split.
+        (igmesh_path, material_names, data) = self.convert(FACETED.replace('f 5/1/3 6/2/3 2/3/3', 'f 5/1 6/2 2/3'))
+        self.assertEqual(0, len(data.normals))
+        self.assertEqual(6, len(data.vertices))
+
+    def test_polygons_are_fan_triangulated(self):
+        (igmesh_path, material_names, data) = self.convert('v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0.5 2 0\nv 0 1 0\nf 1 2 3 4 5\n')
+        self.assertEqual(['blendigo_clay'], material_names)
+        self.assertEqual([[0, 1, 2], [0, 2, 3], [0, 3, 4]], data.triangles[:, :3].tolist())
+        self.assertEqual(0, len(data.quads))
+
+    def test_published_file(self):
+        mesh_cache = MeshCache()
+        (igmesh_path, material_names, data) = self.convert(FACETED, mesh_cache)
+        self.assertEqual(0o644, stat.S_IMODE(os.stat(igmesh_path).st_mode))
+        self.assertEqual([os.path.basename(igmesh_path)], os.listdir(self.cache_dir))
+        self.assertFalse(os.path.exists(lock_path(igmesh_path)))
+
+        # Another converter sharing the cache directory reuses the converted file.
+        before = os.stat(igmesh_path).st_mtime_ns
+        converter = obj_proxy_converter(self.cache_dir, mesh_cache)
+        self.assertEqual((igmesh_path, material_names), converter.convert(os.path.join(self.dir, 'proxy.obj')))
+        self.assertEqual(before, os.stat(igmesh_path).st_mtime_ns)
+        mesh_cache.release_all()
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    result = unittest.main(argv=[sys.argv[0]] + args, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
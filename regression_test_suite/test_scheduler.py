@@ -0,0 +1,162 @@
+#
+# Blendigo local render scheduler tests
+#
+# INFO:
+# Runs the render scheduler as a separate Python process, without Blender, on
+# render queues whose items are rendered by a stub script standing in for the
+# Indigo console. Run:
+#
+#   blender -b -P test_scheduler.py
+#
+# or with any Python 3 which finds the indigo_exporter package, e.g.
+#
+#   PYTHONPATH=/path/to/sources python test_scheduler.py
+
+import os, sys, json, time, stat, signal, shutil, tempfile, subprocess, unittest, importlib.util
+import xml.etree.cElementTree as ET
+
+# The package imports bpy, so only its location is looked up.
+SCHEDULER = os.path.join(os.path.dirname(importlib.util.find_spec('indigo_exporter').origin), 'scheduler.py')
+
+# Called as: console <scene> -o <output> -t <threads> [<arg> <path>]...
+# Scenes named 'flaky' fail on their first attempt, 'bad' always fail, 'slow' take long.
+STUB_CONSOLE = '''#!%s
+import os, sys, json, time
+scene = sys.argv[1]
+output = sys.argv[3]
+name = os.path.basename(os.path.splitext(output)[0])
+count_path = output + '.count'
+count = 0
+if os.path.exists(count_path):
+    with open(count_path) as f:
+        count = int(f.read())
+with open(count_path, 'w') as f:
+    f.write(str(count + 1))
+with open(output + '.args', 'w') as f:
+    json.dump(sys.argv[1:], f)
+if name == 'slow':
+    time.sleep(60)
+if name == 'bad' or (name == 'flaky' and count == 0):
+    sys.exit(1)
+with open(output, 'w') as f:
+    f.write(scene)
+'''
+
+ITEM = '''	<item>
+		<scene_path>%s.igs</scene_path>
+		<halt_time>-1</halt_time>
+		<halt_spp>-1</halt_spp>
+		<output_path>%s</output_path>
+%s	</item>
+'''
+
+@unittest.skipIf(os.name == 'nt', 'The stub console is run through its #! line')
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='blendigo_scheduler_test_')
+        self.console = os.path.join(self.dir, 'console.py')
+        with open(self.console, 'w') as f:
+            f.write(STUB_CONSOLE % sys.executable)
+        os.chmod(self.console, stat.S_IRWXU)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def write_queue(self, names, seeds={}):
+        items = ''.join(ITEM % (self.path(n), self.path(n), '\t\t<seed>%s</seed>\n' % seeds[n] if n in seeds else '') for n in names)
+        filename = self.path('queue.igq')
+        with open(filename, 'w') as f:
+            f.write('<?xml version="1.0" encoding="utf-8"?>\n<render_queue>\n%s</render_queue>\n' % items)
+        return filename
+
+    def scheduler(self, queue, *args):
+        return subprocess.Popen([sys.executable, SCHEDULER, queue, '--console', self.console] + list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+    def run_scheduler(self, queue, *args):
+        process = self.scheduler(queue, *args)
+        (output, _) = process.communicate(timeout=60)
+        return (process.returncode, output)
+
+    def console_args(self, name):
+        with open(self.path(name) + '.png.args') as f:
+            return json.load(f)
+
+    def attempts(self, name):
+        count_path = self.path(name) + '.png.count'
+        if not os.path.exists(count_path):
+            return 0
+        with open(count_path) as f:
+            return int(f.read())
+
+    def test_output_paths_and_threads(self):
+        queue = self.write_queue(['a', 'b'])
+        (returncode, output) = self.run_scheduler(queue, '--processes', '2', '--threads', '8', '--output-arg=-uexro,_untonemapped.exr')
+        self.assertEqual(0, returncode, output)
+
+        for name in ['a', 'b']:
+            self.assertTrue(os.path.isfile(self.path(name) + '.png'))
+            self.assertEqual([self.path(name) + '.igs', '-o', self.path(name) + '.png', '-t', '4', '-uexro', self.path(name) + '_untonemapped.exr'], self.console_args(name))
+
+    def test_seed_is_rendered_from_its_own_queue(self):
+        queue = self.write_queue(['seeded', 'unseeded'], seeds={'seeded': '1234'})
+        (returncode, output) = self.run_scheduler(queue)
+        self.assertEqual(0, returncode, output)
+
+        self.assertEqual(self.path('unseeded') + '.igs', self.console_args('unseeded')[0])
+        item_queue = self.console_args('seeded')[0]
+        self.assertEqual(self.path('seeded') + '.igq', item_queue)
+        items = ET.parse(item_queue).getroot().findall('item')
+        self.assertEqual(1, len(items))
+        self.assertEqual('1234', items[0].findtext('seed'))
+        self.assertEqual(self.path('seeded') + '.igs', items[0].findtext('scene_path'))
+        self.assertEqual(self.path('seeded'), items[0].findtext('output_path'))
+
+    def test_retries_and_failures(self):
+        queue = self.write_queue(['flaky', 'bad'])
+        (returncode, output) = self.run_scheduler(queue, '--retries', '1')
+        self.assertEqual(1, returncode, output)
+        self.assertEqual(2, self.attempts('flaky'))
+        self.assertTrue(os.path.isfile(self.path('flaky') + '.png'))
+        self.assertEqual(2, self.attempts('bad'))
+        self.assertIn('1 failed', output)
+
+    def test_existing_outputs_are_skipped(self):
+        queue = self.write_queue(['done', 'new'])
+        with open(self.path('done') + '.png', 'w') as f:
+            f.write('')
+        (returncode, output) = self.run_scheduler(queue)
+        self.assertEqual(0, returncode, output)
+        self.assertEqual(0, self.attempts('done'))
+        self.assertEqual(1, self.attempts('new'))
+
+        (returncode, output) = self.run_scheduler(queue, '--no-skip-existing')
+        self.assertEqual(1, self.attempts('done'))
+
+    def test_cancel(self):
+        queue = self.write_queue(['slow', 'next'])
+        process = self.scheduler(queue, '--processes', '1', '--retries', '3')
+        deadline = time.time() + 30
+        while self.attempts('slow') == 0 and time.time() < deadline:
+            time.sleep(0.05)
+
+        start_time = time.time()
+        process.send_signal(signal.SIGTERM)
+        (output, _) = process.communicate(timeout=30)
+        self.assertLess(time.time() - start_time, 30)
+        self.assertEqual(1, process.returncode, output)
+
+        # The running item was stopped and neither retried nor followed by the next one.
+        self.assertIn('slow.igs: cancelled', output)
+        self.assertEqual(1, self.attempts('slow'))
+        self.assertFalse(os.path.exists(self.path('slow') + '.png'))
+        self.assertEqual(0, self.attempts('next'))
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    result = unittest.main(argv=[sys.argv[0]] + args, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
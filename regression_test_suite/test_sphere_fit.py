@@ -0,0 +1,84 @@
+#
+# Blendigo sphere primitive detection tests
+#
+# INFO:
+# Tests which meshes fit_sphere() takes for spheres, to be exported as sphere
+# primitives: fine UV spheres do, coarse ones, ellipsoids, hemispheres and meshes
+# with several materials don't. Run:
+#
+#   blender -b -P test_sphere_fit.py
+
+import os, sys, unittest
+
+import numpy as np
+
+from indigo_exporter.export.geometry import GeometryExporter, fit_sphere
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import mesh_fixtures
+
+TOLERANCE = GeometryExporter.sphere_tolerance
+
+def uv_sphere(segments=32, rings=16, radius=2.0, center=(1.0, -2.0, 0.5), scale=(1.0, 1.0, 1.0), num_rings=None, material_indices=None):
+    '''
+    A UV sphere like Blender's, of num_rings of its rings counted from the top.
+    '''
+    num_rings = rings if num_rings is None else num_rings
+    co = [(0.0, 0.0, radius), (0.0, 0.0, -radius)]
+    for i in range(1, rings):
+        theta = np.pi * i / rings
+        for j in range(segments):
+            phi = 2.0 * np.pi * j / segments
+            co.append((radius * np.sin(theta) * np.cos(phi), radius * np.sin(theta) * np.sin(phi), radius * np.cos(theta)))
+    co = np.array(co) * scale + center
+
+    ring = lambda i, j: 2 + (i - 1) * segments + j % segments
+    polygons = [[0, ring(1, j), ring(1, j + 1)] for j in range(segments)]
+    for i in range(1, min(num_rings, rings - 1)):
+        polygons += [[ring(i, j), ring(i + 1, j), ring(i + 1, j + 1), ring(i, j + 1)] for j in range(segments)]
+    if num_rings == rings:
+        polygons += [[1, ring(rings - 1, j + 1), ring(rings - 1, j)] for j in range(segments)]
+
+    # Only the vertices used by the polygons.
+    used = np.unique(np.concatenate(polygons))
+    remap = np.zeros(len(co), dtype=np.int32)
+    remap[used] = np.arange(len(used))
+    return mesh_fixtures.Mesh(co[used], [remap[p].tolist() for p in polygons], material_indices=material_indices)
+
+class SphereFitTest(unittest.TestCase):
+
+    def test_uv_sphere(self):
+        (center, radius, material_index) = fit_sphere(uv_sphere(material_indices=[3] * (32 * 16)), TOLERANCE)
+        np.testing.assert_allclose((1.0, -2.0, 0.5), tuple(center), atol=1e-5)
+        self.assertAlmostEqual(2.0, radius, places=5)
+        self.assertEqual(3, material_index)
+
+    def test_scaled_sphere(self):
+        (center, radius, material_index) = fit_sphere(uv_sphere(radius=1e-3, center=(0.0, 0.0, 0.0)), TOLERANCE)
+        self.assertAlmostEqual(1e-3, radius, places=8)
+
+    def test_coarse_sphere(self):
+        # Its vertices are on a sphere, but its faces cut well inside it.
+        self.assertIsNone(fit_sphere(uv_sphere(segments=8, rings=6), TOLERANCE))
+        self.assertIsNotNone(fit_sphere(uv_sphere(segments=8, rings=6), 0.25))
+
+    def test_ellipsoid(self):
+        self.assertIsNone(fit_sphere(uv_sphere(scale=(1.0, 1.0, 1.2)), TOLERANCE))
+        self.assertIsNotNone(fit_sphere(uv_sphere(scale=(1.0, 1.0, 1.01)), TOLERANCE))
+
+    def test_hemisphere(self):
+        self.assertIsNone(fit_sphere(uv_sphere(num_rings=8), TOLERANCE))
+
+    def test_materials(self):
+        self.assertIsNone(fit_sphere(uv_sphere(material_indices=[0] * 256 + [1] * 256), TOLERANCE))
+
+    def test_small_meshes(self):
+        # A cube has all its vertices on a sphere, but too few of them.
+        co = [(x, y, z) for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)]
+        polygons = [[0, 1, 3, 2], [4, 6, 7, 5], [0, 4, 5, 1], [2, 3, 7, 6], [0, 2, 6, 4], [1, 5, 7, 3]]
+        self.assertIsNone(fit_sphere(mesh_fixtures.Mesh(co, polygons), 1.0))
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    result = unittest.main(argv=[sys.argv[0]] + args, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
@@ -0,0 +1,111 @@
+#
+# Blendigo streamed mesh tests
+#
+# INFO:
+# Writes test meshes both with the streaming writer used for huge meshes and from
+# the igmesh data built in memory, and checks that both files describe the same
+# faces. Run:
+#
+#   blender -b -P test_stream_mesh.py
+#
+# The meshes have more faces than fit in a block, so that they are streamed in
+# several blocks.
+
+import os, sys, shutil, tempfile, unittest
+
+import numpy as np
+
+from indigo_exporter.export.igmesh import igmesh_writer, read_igmesh_data
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import mesh_fixtures
+
+# Blocks are at least 1024 elements, whatever the memory budget.
+MEMORY_BUDGET = 0
+
+def split_quads(polygons):
+    # Every third quad becomes two triangles.
+    result = []
+    for (i, p) in enumerate(polygons):
+        if len(p) == 4 and i % 3 == 0:
+            result += [[p[0], p[1], p[2]], [p[0], p[2], p[3]]]
+        else:
+            result.append(p)
+    return result
+
+class StreamMeshTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='blendigo_stream_mesh_test_')
+        self.obj = mesh_fixtures.Object('grid', ['red', 'blue'])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_both(self, mesh):
+        streamed = os.path.join(self.dir, 'streamed.igmesh')
+        in_memory = os.path.join(self.dir, 'in_memory.igmesh')
+        stream_result = igmesh_writer.stream_mesh(streamed, self.obj, mesh, MEMORY_BUDGET)
+        (data, used_mat_indices, use_shading_normals) = igmesh_writer.build_mesh_data(self.obj, mesh)
+        igmesh_writer.write_data(in_memory, data)
+        self.assertEqual((used_mat_indices, use_shading_normals), stream_result)
+        # Only the two files are left, no scratch buffers.
+        self.assertEqual(['in_memory.igmesh', 'streamed.igmesh'], sorted(os.listdir(self.dir)))
+        return (streamed, in_memory)
+
+    def assertSameFaces(self, streamed, in_memory):
+        (a, b) = (read_igmesh_data(streamed), read_igmesh_data(in_memory))
+        self.assertEqual(a.material_names, b.material_names)
+        self.assertEqual(a.num_uv_mappings, b.num_uv_mappings)
+        for (section_a, section_b) in zip(mesh_fixtures.face_corners(a), mesh_fixtures.face_corners(b)):
+            for (x, y) in zip(section_a, section_b):
+                if x is None or y is None:
+                    self.assertIs(x, y)
+                else:
+                    np.testing.assert_array_equal(x, y)
+
+    def mesh(self, nx, ny, ngon_rows=0, smooth=None, uv_layers=0, sharp_edges=()):
+        (co, polygons) = mesh_fixtures.grid(nx, ny, ngon_rows)
+        polygons = split_quads(polygons)
+        smooth = None if smooth is None else [smooth(i) for i in range(len(polygons))]
+        mesh = mesh_fixtures.Mesh(co, polygons, material_indices=[i % 2 for i in range(len(polygons))], smooth=smooth, sharp_edges=sharp_edges)
+        self.assertGreater(len(mesh.polygons), 1024)
+        num_loops = len(mesh.loops)
+        mesh.uv_layers = [mesh_fixtures.UVLayer('uv%i' % i, np.random.default_rng(i).random((num_loops, 2))) for i in range(uv_layers)]
+        return mesh
+
+    def test_flat_mesh_is_identical(self):
+        (streamed, in_memory) = self.write_both(self.mesh(40, 20))
+        with open(streamed, 'rb') as f:
+            a = f.read()
+        with open(in_memory, 'rb') as f:
+            b = f.read()
+        self.assertEqual(a, b)
+
+    def test_smooth_mesh(self):
+        (streamed, in_memory) = self.write_both(self.mesh(40, 20, smooth=lambda i: True))
+        self.assertGreater(len(read_igmesh_data(streamed).normals), 0)
+        self.assertSameFaces(streamed, in_memory)
+
+    def test_split_normals(self):
+        # Flat and smooth faces, so the normals are per loop.
+        (streamed, in_memory) = self.write_both(self.mesh(40, 20, smooth=lambda i: i % 5 != 0))
+        self.assertSameFaces(streamed, in_memory)
+
+        (streamed, in_memory) = self.write_both(self.mesh(40, 20, smooth=lambda i: True, sharp_edges=[(0, 1)]))
+        self.assertSameFaces(streamed, in_memory)
+
+    def test_uvs_and_ngons(self):
+        mesh = self.mesh(40, 20, ngon_rows=3, smooth=lambda i: i % 5 != 0, uv_layers=2)
+        (streamed, in_memory) = self.write_both(mesh)
+        data = read_igmesh_data(streamed)
+        self.assertEqual(2, data.num_uv_mappings)
+        # The triangles, then the three triangles of each pentagon.
+        loop_totals = mesh.polygons.attributes['loop_total']
+        self.assertEqual(np.count_nonzero(loop_totals == 3) + 3 * np.count_nonzero(loop_totals == 5), len(data.triangles))
+        self.assertSameFaces(streamed, in_memory)
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    result = unittest.main(argv=[sys.argv[0]] + args, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
@@ -0,0 +1,106 @@
+#
+# Blendigo tiled render tests
+#
+# INFO:
+# Splits images into tiles, writes tile scenes and stitches tiles, given as numpy
+# arrays, back into one image, checking that the result is the image the tiles
+# were cut from. Run:
+#
+#   blender -b -P test_tiles.py
+
+import os, sys, shutil, tempfile, unittest
+import xml.etree.cElementTree as ET
+
+import numpy as np
+
+from indigo_exporter.core.tiles import tile_regions, scene_region, write_tile_scene, stitch_pixels
+
+SCENE = '''<?xml version="1.0" encoding="utf-8"?>
+<scene>
+	<renderer_settings>
+		<width>640</width>
+		<height>480</height>
+%s	</renderer_settings>
+	<camera><pos>0 0 0</pos></camera>
+</scene>
+'''
+
+def covered(regions, width, height):
+    # How many regions cover each pixel.
+    count = np.zeros((height, width), dtype=np.int32)
+    for (x1, y1, x2, y2) in regions:
+        count[y1:y2, x1:x2] += 1
+    return count
+
+class TilesTest(unittest.TestCase):
+
+    def test_tile_regions(self):
+        for count in [1, 2, 3, 4, 5, 9, 10]:
+            regions = tile_regions((0, 0, 640, 480), count)
+            self.assertGreaterEqual(len(regions), count)
+            self.assertTrue((covered(regions, 640, 480) == 1).all(), count)
+
+    def test_border_region(self):
+        regions = tile_regions((100, 50, 301, 250), 4)
+        self.assertEqual(4, len(regions))
+        count = covered(regions, 640, 480)
+        self.assertTrue((count[50:250, 100:301] == 1).all())
+        self.assertEqual(201 * 200, count.sum())
+
+    def test_small_region(self):
+        # No tile is empty, even with more tiles than pixels.
+        regions = tile_regions((0, 0, 2, 1), 9)
+        self.assertEqual([(0, 0, 1, 1), (1, 0, 2, 1)], sorted(regions))
+
+    def test_tile_scenes(self):
+        dir = tempfile.mkdtemp(prefix='blendigo_tiles_test_')
+        try:
+            igs_path = os.path.join(dir, 'scene.igs')
+            with open(igs_path, 'w') as f:
+                f.write(SCENE % '\t\t<render_region><x1>0</x1><y1>0</y1><x2>320</x2><y2>240</y2></render_region>\n')
+            (width, height, region) = scene_region(igs_path)
+            self.assertEqual((640, 480, (0, 0, 320, 240)), (width, height, region))
+
+            tile_path = write_tile_scene(igs_path, 2, (160, 0, 320, 120))
+            self.assertEqual(os.path.join(dir, 'scene.tile2.igs'), tile_path)
+            self.assertEqual((640, 480, (160, 0, 320, 120)), scene_region(tile_path))
+            # The region replaces the scene's own.
+            self.assertEqual(1, len(ET.parse(tile_path).getroot().find('renderer_settings').findall('render_region')))
+
+            with open(igs_path, 'w') as f:
+                f.write(SCENE % '')
+            self.assertEqual((640, 480, (0, 0, 640, 480)), scene_region(igs_path))
+        finally:
+            shutil.rmtree(dir)
+
+    def test_stitch(self):
+        image = np.random.default_rng(1).random((48, 64, 4)).astype(np.float32)
+        regions = tile_regions((8, 4, 60, 44), 6)
+
+        # Tiles either cover the whole image, rendered only in their region, or just their region.
+        tiles = []
+        for (i, (x1, y1, x2, y2)) in enumerate(regions):
+            if i % 2 == 0:
+                pixels = np.full(image.shape, -1.0, dtype=np.float32)
+                pixels[y1:y2, x1:x2] = image[y1:y2, x1:x2]
+            else:
+                pixels = image[y1:y2, x1:x2].copy()
+            tiles.append(('tile%i' % i, pixels))
+
+        result = stitch_pixels(iter(tiles), regions, 64, 48)
+        self.assertEqual((48, 64, 4), result.shape)
+        np.testing.assert_array_equal(image[4:44, 8:60], result[4:44, 8:60])
+        # Outside the border region the image is black and opaque.
+        outside = covered(regions, 64, 48) == 0
+        self.assertTrue((result[outside] == (0.0, 0.0, 0.0, 1.0)).all())
+
+    def test_tile_size_mismatch(self):
+        regions = [(0, 0, 32, 48), (32, 0, 64, 48)]
+        tiles = [('left', np.zeros((48, 32, 4))), ('right', np.zeros((48, 31, 4)))]
+        with self.assertRaisesRegex(Exception, 'Tile right is 31x48 pixels, expected 64x48 or 32x48'):
+            stitch_pixels(tiles, regions, 64, 48)
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    result = unittest.main(argv=[sys.argv[0]] + args, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
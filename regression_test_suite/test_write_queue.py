@@ -0,0 +1,150 @@
+#
+# Blendigo mesh write queue tests
+#
+# INFO:
+# Writes files through the background mesh write queue, checking flush(), cancel(),
+# the limit on queued bytes and how write errors are reported. Run:
+#
+#   blender -b -P test_write_queue.py
+
+import os, sys, shutil, tempfile, threading, unittest
+from unittest import mock
+
+import numpy as np
+
+from indigo_exporter.export import write_queue
+from indigo_exporter.export.write_queue import MeshWriteQueue
+from indigo_exporter.export.igmesh import igmesh_writer, read_igmesh_data
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import mesh_fixtures
+
+class WriteQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='blendigo_write_queue_test_')
+        self.queues = []
+
+    def tearDown(self):
+        for queue in self.queues:
+            queue.cancel()
+            queue.close()
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def queue(self, *args, **kwargs):
+        queue = MeshWriteQueue(*args, **kwargs)
+        self.queues.append(queue)
+        return queue
+
+    def held_writes(self):
+        '''
+        Patches the queue to wait for the returned event before writing each file,
+        and to set started when it does.
+        '''
+        (release, self.started) = (threading.Event(), threading.Event())
+        publish_buffers = write_queue.publish_buffers
+        def held_publish_buffers(path, buffers):
+            self.started.set()
+            release.wait(30)
+            publish_buffers(path, buffers)
+        patcher = mock.patch.object(write_queue, 'publish_buffers', held_publish_buffers)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(release.set)
+        return release
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+    def test_flush(self):
+        queue = self.queue(num_threads=3)
+        for i in range(10):
+            queue.submit(self.path('%i.bin' % i), [b'header', np.arange(i, dtype=np.int32)])
+        queue.flush()
+
+        for i in range(10):
+            self.assertEqual(b'header' + np.arange(i, dtype=np.int32).tobytes(), self.read('%i.bin' % i))
+        self.assertEqual(10, queue.files_written)
+        self.assertEqual(10 * 6 + 4 * sum(range(10)), queue.bytes_written)
+        self.assertEqual(0, queue.pending_bytes)
+
+    def test_mesh_sections(self):
+        # A mesh without quads or normals, which have empty sections.
+        (co, polygons) = mesh_fixtures.grid(3, 2)
+        polygons = [p[:3] for p in polygons]
+        (data, used_mat_indices, use_shading_normals) = igmesh_writer.build_mesh_data(mesh_fixtures.Object('tris'), mesh_fixtures.Mesh(co, polygons))
+
+        queue = self.queue()
+        igmesh_writer.write_data(self.path('queued.igmesh'), data, write_queue=queue)
+        queue.flush()
+        igmesh_writer.write_data(self.path('direct.igmesh'), data)
+
+        self.assertEqual(self.read('direct.igmesh'), self.read('queued.igmesh'))
+        self.assertEqual(0, len(read_igmesh_data(self.path('queued.igmesh')).quads))
+
+    def test_submit_waits_for_room(self):
+        release = self.held_writes()
+        queue = self.queue(num_threads=1, max_bytes=100)
+        queue.submit(self.path('a.bin'), [bytes(80)])
+        self.assertTrue(self.started.wait(30))
+
+        # A file larger than the limit is accepted when nothing else is queued.
+        submitted = threading.Event()
+        def submit():
+            queue.submit(self.path('b.bin'), [bytes(200)])
+            submitted.set()
+        t = threading.Thread(target=submit)
+        t.start()
+        self.assertFalse(submitted.wait(0.2))
+
+        release.set()
+        t.join(30)
+        self.assertTrue(submitted.is_set())
+        queue.flush()
+        self.assertEqual(200, len(self.read('b.bin')))
+
+    def test_cancel(self):
+        release = self.held_writes()
+        queue = self.queue(num_threads=1)
+        for name in ['a.bin', 'b.bin', 'c.bin']:
+            queue.submit(self.path(name), [name.encode()])
+        self.assertTrue(self.started.wait(30))
+
+        # The file being written is finished, the others are dropped.
+        queue.cancel()
+        release.set()
+        queue.flush()
+        self.assertEqual(['a.bin'], os.listdir(self.dir))
+        self.assertEqual(1, queue.files_written)
+
+    def test_errors(self):
+        queue = self.queue(num_threads=2)
+        queue.submit(self.path('missing/a.bin'), [b'a'])
+        queue.submit(self.path('b.bin'), [b'b'])
+        with self.assertRaisesRegex(Exception, 'Failed to write .*a.bin'):
+            queue.flush()
+        self.assertEqual(b'b', self.read('b.bin'))
+
+        # Later files are refused rather than written after a failure.
+        with self.assertRaisesRegex(Exception, 'Failed to write'):
+            queue.submit(self.path('c.bin'), [b'c'])
+        self.assertFalse(os.path.exists(self.path('c.bin')))
+
+    def test_close(self):
+        queue = self.queue(num_threads=2)
+        queue.submit(self.path('a.bin'), [b'a'])
+        queue.close()
+        # Queued files are written before the threads stop.
+        self.assertEqual(b'a', self.read('a.bin'))
+        self.assertFalse(any(t.is_alive() for t in queue.threads))
+        with self.assertRaisesRegex(Exception, 'closed'):
+            queue.submit(self.path('b.bin'), [b'b'])
+
+if __name__ == '__main__':
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    result = unittest.main(argv=[sys.argv[0]] + args, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
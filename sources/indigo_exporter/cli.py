@@ -0,0 +1,201 @@
+#
+# Blendigo command line export
+#
+# INFO:
+# Exports a range of frames of a .blend file to Indigo scenes without the UI, split
+# across several Blender processes:
+#
+#   blender -b file.blend -P /path/to/indigo_exporter/cli.py -- --frames 1-500 --workers 8
+#
+# The frames are split into one contiguous range per worker, and each worker is a
+# 'blender -b' process exporting its range one frame after another. The workers
+# share the mesh directory: a mesh written by one of them is reused by the others
+# (see export/mesh_cache.py). When all workers are done, the render queue items of
+# all frames are merged into the .igq of the scene, in frame order, and the export
+# time of each frame is printed.
+#
+# --frames takes frame numbers and ranges separated by commas, e.g. 1-10,20,30-40,
+# and defaults to the frame range of the scene. --workers defaults to 1, which
+# exports in this Blender process.
+
+import os, sys, json, time, argparse, subprocess, tempfile, importlib
+
+ADDON = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_frames(spec):
+    '''
+    Returns the sorted frame numbers of a spec like '1-10,20,30-40'.
+    '''
+    frames = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if part == '':
+            continue
+        (first, sep, last) = part.partition('-')
+        if sep == '':
+            frames.add(int(first))
+        else:
+            frames.update(range(int(first), int(last) + 1))
+    return sorted(frames)
+
+def frames_spec(frames):
+    '''
+    Inverse of parse_frames().
+    '''
+    ranges = []
+    for frame in frames:
+        if len(ranges) > 0 and ranges[-1][1] == frame - 1:
+            ranges[-1][1] = frame
+        else:
+            ranges.append([frame, frame])
+    return ','.join(('%i' % a) if a == b else ('%i-%i' % (a, b)) for (a, b) in ranges)
+
+def partition(frames, num_workers):
+    '''
+    Split frames into at most num_workers contiguous chunks of nearly equal size.
+    '''
+    num_workers = max(1, min(num_workers, len(frames)))
+    return [frames[len(frames) * i // num_workers:len(frames) * (i + 1) // num_workers] for i in range(num_workers)]
+
+def export_frames(frames, part_filename):
+    '''
+    Export frames in this Blender process, writing the result of each frame (render
+    queue item and export time) to part_filename as soon as it is exported.
+    '''
+    import bpy, addon_utils            #@UnresolvedImport
+
+    addon_utils.enable(ADDON, default_set=False)
+    core = importlib.import_module(ADDON + '.core')
+    operators = importlib.import_module(ADDON + '.operators')
+
+    scene = bpy.context.scene
+    # Reuse meshes the other workers have written already.
+    scene.indigo_engine.skip_existing_meshes = True
+
+    results = []
+    for frame in frames:
+        scene.frame_set(frame)
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+
+        (output_path, output_filename, image_out_path) = core.scene_file_paths(scene, True)
+        if not os.path.exists(output_path):
+            os.makedirs(output_path, exist_ok=True)
+        exported_file = '/'.join([output_path, output_filename])
+
+        start_time = time.time()
+        # The scene stands in for the render engine, see EXPORT_OT_indigo.
+        export_result = operators._Impl_OT_indigo(
+            directory = output_path,
+            filename = output_filename
+        ).execute(scene, depsgraph)
+        finished = 'FINISHED' in export_result
+
+        results.append({
+            'frame': frame,
+            'time': time.time() - start_time,
+            'status': 'done' if finished else 'failed',
+            'igq': core.render_queue_filename(scene, output_path),
+            'item': core.render_queue_item(scene, exported_file, image_out_path) if finished else None,
+        })
+        print('Frame %i: %s in %.2f s' % (frame, results[-1]['status'], results[-1]['time']))
+
+        with open(part_filename, 'w') as f:
+            json.dump(results, f)
+
+def write_render_queues(results):
+    '''
+    Write the items of results to their .igq files, in frame order.
+    '''
+    queues = {}
+    for result in sorted(results, key=lambda r: r['frame']):
+        if result['item'] is not None:
+            queues.setdefault(result['igq'], []).append(result['item'])
+
+    for (igq_filename, items) in queues.items():
+        with open(igq_filename, 'w') as igq_file:
+            igq_file.write('<?xml version="1.0" encoding="utf-8" standalone="no" ?>\n')
+            igq_file.write('<render_queue>\n')
+            for item in items:
+                igq_file.write(item)
+            igq_file.write('</render_queue>\n')
+        print('Wrote render queue %s (%i frames)' % (igq_filename, len(items)))
+
+def run(frames, num_workers, blend_filename):
+    '''
+    Export frames with num_workers worker processes, then merge and report their
+    results. Returns the number of frames which weren't exported.
+    '''
+    work_dir = tempfile.mkdtemp(prefix='blendigo_cli_')
+    chunks = partition(frames, num_workers)
+    part_filenames = [os.path.join(work_dir, 'worker%i.json' % i) for i in range(len(chunks))]
+
+    start_time = time.time()
+    if len(chunks) == 1:
+        export_frames(chunks[0], part_filenames[0])
+    else:
+        import bpy            #@UnresolvedImport
+        processes = []
+        for (i, chunk) in enumerate(chunks):
+            log_file = open(os.path.join(work_dir, 'worker%i.log' % i), 'w')
+            command = [bpy.app.binary_path, '-b', blend_filename, '-P', os.path.abspath(__file__), '--',
+                '--frames', frames_spec(chunk), '--part', part_filenames[i]]
+            processes.append((subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT), log_file))
+            print('Worker %i: frames %s, log %s' % (i, frames_spec(chunk), log_file.name))
+
+        for (process, log_file) in processes:
+            process.wait()
+            log_file.close()
+    wall_time = time.time() - start_time
+
+    results = []
+    for part_filename in part_filenames:
+        if os.path.exists(part_filename):
+            with open(part_filename, 'r') as f:
+                results.extend(json.load(f))
+
+    exported = dict((r['frame'], r) for r in results)
+    print('%8s %10s %10s' % ('frame', 'status', 'seconds'))
+    for frame in frames:
+        if frame in exported:
+            print('%8i %10s %10.2f' % (frame, exported[frame]['status'], exported[frame]['time']))
+        else:
+            print('%8i %10s %10s' % (frame, 'missing', '-'))
+
+    write_render_queues(results)
+
+    num_failed = len(frames) - sum(1 for r in results if r['status'] == 'done')
+    export_time = sum(r['time'] for r in results)
+    print('Exported %i of %i frames with %i workers in %.1f s (%.1f s of frame exports, %.1fx)' % (
+        len(frames) - num_failed, len(frames), len(chunks), wall_time, export_time, export_time / max(wall_time, 1e-6)))
+    if num_failed > 0:
+        print('Worker logs are in %s' % work_dir)
+
+    return num_failed
+
+def main(argv):
+    import bpy            #@UnresolvedImport
+
+    parser = argparse.ArgumentParser(prog='blender -b file.blend -P cli.py --', description='Export frames of a .blend file to Indigo scenes')
+    parser.add_argument('--frames', help='Frames to export, e.g. 1-10,20 (default: the frame range of the scene)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of Blender processes exporting at the same time')
+    parser.add_argument('--part', help=argparse.SUPPRESS) # Set for worker processes: where to write their results
+    args = parser.parse_args(argv)
+
+    scene = bpy.context.scene
+    if args.frames is None:
+        frames = list(range(scene.frame_start, scene.frame_end + 1, scene.frame_step))
+    else:
+        frames = parse_frames(args.frames)
+
+    if args.part is not None:
+        export_frames(frames, args.part)
+        return 0
+
+    if bpy.data.filepath == '':
+        print('Open a saved .blend file: blender -b file.blend -P cli.py -- ...')
+        return -1
+
+    return 1 if run(frames, args.workers, bpy.data.filepath) > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []))
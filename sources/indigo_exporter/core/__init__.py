@@ -13,6 +13,8 @@ from .. export import indigo_log
 from .. import operators
 
 from . util import getVersion, getGuiPath, getConsolePath, getInstallPath, count_contiguous
+from .. scheduler import LocalScheduler, QueueItem, read_render_queue
+from . tiles import tile_regions, scene_region, write_tile_scene, stitch_tiles, tiling_conflicts, STITCHED_OUTPUTS
 
 BL_IDNAME = 'indigo_renderer'
 
@@ -57,6 +59,87 @@ def unregister():
         if BL_IDNAME in panel.COMPAT_ENGINES:
             panel.COMPAT_ENGINES.remove(BL_IDNAME)
 
+def scene_file_paths(scene, is_animation):
+    '''
+    Returns (output_path, output_filename, image_out_path) for exporting the
+    current frame of scene: the directory and name of the scene file, and the
+    image output path without extension.
+    '''
+    frame_path = efutil.filesystem_path(scene.render.frame_path())
+
+    # Get the filename for the frame sans extension.
+    image_out_path = os.path.splitext(frame_path)[0]
+
+    # Generate the name for the scene file(s).
+    if scene.indigo_engine.use_output_path == True:
+        # Get the output path from the frame path.
+        output_path = os.path.dirname(frame_path)
+
+        # Generate the output filename
+        output_filename = '%s.%s.%05i.igs' % (efutil.scene_filename(), bpy.path.clean_name(scene.name), scene.frame_current)
+    else:
+        # Get export path from the indigo_engine.
+        export_path = efutil.filesystem_path(scene.indigo_engine.export_path)
+
+        # Get the directory name from the output path.
+        output_path = os.path.dirname(export_path)
+
+        # Get the filename from the output path and remove the extension.
+        output_filename = os.path.splitext(os.path.basename(export_path))[0]
+
+        # Count contiguous # chars and replace them with the frame number.
+        # If the hash count is 0 and we are exporting an animation, append the frame numbers.
+        hash_count = util.count_contiguous('#', output_filename)
+        if hash_count != 0:
+            output_filename = output_filename.replace('#'*hash_count, ('%%0%0ii'%hash_count)%scene.frame_current)
+        elif is_animation:
+            output_filename = output_filename + ('%%0%0ii'%4)%scene.frame_current
+
+        # Add .igs extension.
+        output_filename += '.igs'
+
+    return (output_path, output_filename, image_out_path)
+
+def render_queue_filename(scene, output_path):
+    return '%s/%s.%s.igq'%(output_path, efutil.scene_filename(), bpy.path.clean_name(scene.name))
+
+def render_queue_item(scene, exported_file, image_out_path):
+    '''
+    Returns the <item> of the current frame of scene in an Indigo render queue (.igq).
+    '''
+    rnd = random.Random()
+    rnd.seed(scene.frame_current)
+
+    return ''.join([
+        '\t<item>\n',
+        '\t\t<scene_path>%s</scene_path>\n' % exported_file,
+        '\t\t<halt_time>%d</halt_time>\n' % scene.indigo_engine.halttime,
+        '\t\t<halt_spp>%d</halt_spp>\n' % scene.indigo_engine.haltspp,
+        '\t\t<output_path>%s</output_path>\n' % image_out_path,
+        '\t\t<seed>%s</seed>\n' % rnd.randint(1, 1000000),
+        '\t</item>\n',
+    ])
+
+def output_args(scene):
+    '''
+    Returns the Indigo arguments of the optional outputs of scene (EXR, IGI and
+    render channels) as (argument, suffix) pairs; the path of each output is the
+    image output path without extension followed by the suffix.
+    '''
+    args = []
+    if scene.indigo_engine.save_exr_utm:
+        args.append(('-uexro', '_untonemapped.exr'))
+    if scene.indigo_engine.save_exr_tm:
+        args.append(('-texro', '_tonemapped.exr'))
+    if scene.indigo_engine.save_igi:
+        if scene.indigo_engine.igi_timestamp_filename:
+            args.append(('-igio', '_' + str(int(time.time())) + '.igi'))
+        else:
+            args.append(('-igio', '.igi'))
+    if scene.indigo_engine.save_render_channels_exr:
+        args.append(('-channels', '_channels.exr'))
+    return args
+
 from .. auto_load import force_register 
 @force_register
 class RENDERENGINE_indigo(bpy.types.RenderEngine):
@@ -67,6 +150,7 @@ class RENDERENGINE_indigo(bpy.types.RenderEngine):
     bl_use_eevee_viewport = True
 
     render_lock = threading.Lock()
+    progress_range = (0.0, 1.0) # Part of the progress bar covered by the export of the current frame
 
     def render(self, depsgraph):
         '''
@@ -91,39 +175,7 @@ class RENDERENGINE_indigo(bpy.types.RenderEngine):
 
             # Get the frame path.
             scene = depsgraph.scene_eval
-            frame_path = efutil.filesystem_path(scene.render.frame_path())
-
-            # Get the filename for the frame sans extension.
-            image_out_path = os.path.splitext(frame_path)[0]
-
-            # Generate the name for the scene file(s).
-            if scene.indigo_engine.use_output_path == True:
-                # Get the output path from the frame path.
-                output_path = os.path.dirname(frame_path)
-
-                # Generate the output filename
-                output_filename = '%s.%s.%05i.igs' % (efutil.scene_filename(), bpy.path.clean_name(scene.name), scene.frame_current)
-            else:
-                # Get export path from the indigo_engine.
-                export_path = efutil.filesystem_path(scene.indigo_engine.export_path)
-
-                # Get the directory name from the output path.
-                output_path = os.path.dirname(export_path)
-
-                # Get the filename from the output path and remove the extension.
-                output_filename = os.path.splitext(os.path.basename(export_path))[0]
-
-                # Count contiguous # chars and replace them with the frame number.
-                # If the hash count is 0 and we are exporting an animation, append the frame numbers.
-                hash_count = util.count_contiguous('#', output_filename)
-                if hash_count != 0:
-                    output_filename = output_filename.replace('#'*hash_count, ('%%0%0ii'%hash_count)%scene.frame_current)
-                elif self.is_animation:
-                    output_filename = output_filename + ('%%0%0ii'%4)%scene.frame_current
-
-                # Add .igs extension.
-                output_filename += '.igs'
-
+            (output_path, output_filename, image_out_path) = scene_file_paths(scene, self.is_animation)
 
             # The full path of the exported scene file.
             exported_file = '/'.join([
@@ -137,39 +189,19 @@ class RENDERENGINE_indigo(bpy.types.RenderEngine):
 
             # If an animation is rendered, write an indigo queue file (.igq).
             if self.is_animation:
-                igq_filename = '%s/%s.%s.igq'%(output_path, efutil.scene_filename(), bpy.path.clean_name(scene.name))
+                igq_filename = render_queue_filename(scene, output_path)
 
                 if scene.frame_current == scene.frame_start:
                     # Start a new igq file.
-                    igq_file = open(igq_filename, 'w')
-                    igq_file.write('<?xml version="1.0" encoding="utf-8" standalone="no" ?>\n')
-                    igq_file.write('<render_queue>\n')
-                else:
-                    # Append to existing igq.
-                    igq_file = open(igq_filename, 'a')
-                    
-                rnd = random.Random()
-                rnd.seed(scene.frame_current)
-
-                # Write igq item.
-                igq_file.write('\t<item>\n')
-                igq_file.write('\t\t<scene_path>%s</scene_path>\n' % exported_file)
-                igq_file.write('\t\t<halt_time>%d</halt_time>\n' % scene.indigo_engine.halttime)
-                igq_file.write('\t\t<halt_spp>%d</halt_spp>\n' % scene.indigo_engine.haltspp)
-                igq_file.write('\t\t<output_path>%s</output_path>\n' % image_out_path)
-                igq_file.write('\t\t<seed>%s</seed>\n' % rnd.randint(1, 1000000))
-                igq_file.write('\t</item>\n')
-
-                # If this is the last frame, write the closing tag.
-                if scene.frame_current == scene.frame_end:
-                    igq_file.write('</render_queue>\n')
-
-                igq_file.close()
-
-                # Calculate the progress by frame with frame range (fr) and frame offset (fo).
-                fr = scene.frame_end - scene.frame_start
-                fo = scene.frame_current - scene.frame_start
-                self.update_progress(fo/fr)
+                    with open(igq_filename, 'w') as igq_file:
+                        igq_file.write('<?xml version="1.0" encoding="utf-8" standalone="no" ?>\n')
+                        igq_file.write('<render_queue>\n')
+
+                # The progress bar covers the whole animation, each frame gets its slice of it.
+                num_frames = scene.frame_end - scene.frame_start + 1
+                frame_offset = scene.frame_current - scene.frame_start
+                self.progress_range = (frame_offset / num_frames, (frame_offset + 1) / num_frames)
+                self.update_progress(self.progress_range[0])
 
             scene_writer = operators._Impl_OT_indigo(
                 directory = output_path,
@@ -178,9 +210,20 @@ class RENDERENGINE_indigo(bpy.types.RenderEngine):
 
             # Write the scene file.
             export_result = scene_writer.execute(self, depsgraph)
+            finished = 'FINISHED' in export_result
+
+            if self.is_animation:
+                with open(igq_filename, 'a') as igq_file:
+                    # Only frames which were exported get an item.
+                    if finished:
+                        igq_file.write(render_queue_item(scene, exported_file, image_out_path))
+
+                    # Close the queue after the last frame, or when the render was cancelled and no more frames follow.
+                    if scene.frame_current == scene.frame_end or (not finished and self.test_break()):
+                        igq_file.write('</render_queue>\n')
 
             # Return if the export didn't finish.
-            if not 'FINISHED' in export_result:
+            if not finished:
                 return
 
             #------------------------------------------------------------------------------
@@ -233,6 +276,21 @@ class RENDERENGINE_indigo(bpy.types.RenderEngine):
                 if self.is_animation and scene.frame_current != scene.frame_end:
                     return
 
+                # Render the queue with several local processes instead of one Indigo.
+                if self.is_animation and scene.indigo_engine.local_scheduler:
+                    if scene.indigo_engine.network_mode == 'off':
+                        self.run_local_scheduler(scene, igq_filename)
+                        return
+                    indigo_log('Parallel animation frames are not used with network rendering', message_type='WARNING')
+
+                # Render a still as tiles with several local processes.
+                if not self.is_animation and scene.indigo_engine.tiled_render:
+                    conflicts = tiling_conflicts(scene)
+                    if len(conflicts) == 0:
+                        self.run_tiled_render(scene, exported_file, image_out_path)
+                        return
+                    indigo_log('Not rendering tiles: %s' % '; '.join(conflicts), message_type='WARNING')
+
                 # if animation and final frame, launch queue instead of single frame
                 if self.is_animation and scene.frame_current == scene.frame_end:
                     exported_file = igq_filename
@@ -248,22 +306,9 @@ class RENDERENGINE_indigo(bpy.types.RenderEngine):
                         image_out_path + '.png'
                     ]
 
-                # export exrs
-                if scene.indigo_engine.save_exr_utm:
-                    indigo_args.extend(['-uexro', image_out_path + '_untonemapped.exr'])
-                if scene.indigo_engine.save_exr_tm:
-                    indigo_args.extend(['-texro', image_out_path + '_tonemapped.exr'])
-                if scene.indigo_engine.save_igi:
-                    if scene.indigo_engine.igi_timestamp_filename:
-                        #import datetime
-                        #filename = image_out_path+" "+str(datetime.datetime.today().strftime('%y-%m-%d %H %M %S'))
-                        filename = image_out_path+"_"+str(int(time.time()))
-                    else:
-                        filename = image_out_path
-                    indigo_args.extend(['-igio', filename + '.igi'])
-
-                if scene.indigo_engine.save_render_channels_exr:
-                    indigo_args.extend(['-channels', image_out_path + '_channels.exr'])
+                # export exrs, igi and render channels
+                for (arg, suffix) in output_args(scene):
+                    indigo_args.extend([arg, image_out_path + suffix])
 
                 # Set master or working master command line args.
                 if scene.indigo_engine.network_mode == 'master':
@@ -320,6 +365,97 @@ class RENDERENGINE_indigo(bpy.types.RenderEngine):
             # Finished
             return
 
+    def run_local_scheduler(self, scene, igq_filename):
+        '''
+        Render the items of the queue file with a LocalScheduler, and wait for them.
+
+        Returns None
+        '''
+
+        scheduler = LocalScheduler(
+            efutil.filesystem_path(getConsolePath(scene)),
+            num_processes=scene.indigo_engine.scheduler_processes,
+            num_threads=0 if scene.indigo_engine.threads_auto else scene.indigo_engine.threads,
+            max_retries=scene.indigo_engine.scheduler_retries,
+            output_args=output_args(scene),
+            log=indigo_log
+        )
+        results = self.wait_for_scheduler(scheduler, read_render_queue(igq_filename))
+        if results is None:
+            return
+
+        failed = [os.path.basename(r.item.scene_path) for r in results if r.status == 'failed']
+        if len(failed) > 0:
+            self.report({'ERROR'}, 'Indigo failed to render %s' % ', '.join(failed))
+
+    def wait_for_scheduler(self, scheduler, items):
+        '''
+        Run items with scheduler on another thread, and wait for them while
+        reporting progress. Cancelling the render (Esc) cancels the scheduler.
+
+        Returns the results of scheduler.run(), or None if the render was cancelled
+        '''
+
+        results = []
+        thread = threading.Thread(target=lambda: results.extend(scheduler.run(items)))
+        thread.start()
+        cancelled = False
+        while thread.is_alive():
+            if not cancelled and self.test_break():
+                indigo_log('Cancelling Indigo processes')
+                scheduler.cancel()
+                cancelled = True
+            self.update_stats('', 'Indigo Renderer: %i of %i rendered' % (scheduler.num_finished, len(items)))
+            self.update_progress(scheduler.num_finished / max(1, len(items)))
+            thread.join(0.5)
+
+        if cancelled:
+            return None
+        if len(results) != len(items):
+            self.report({'ERROR'}, 'The Indigo scheduler stopped unexpectedly, see the console')
+            return None
+        return results
+
+    def run_tiled_render(self, scene, exported_file, image_out_path):
+        '''
+        Render the exported scene as tiles with a LocalScheduler, one process per
+        tile, and stitch them into image_out_path.png.
+
+        Returns None
+        '''
+
+        (width, height, region) = scene_region(exported_file)
+        regions = tile_regions(region, scene.indigo_engine.tile_count)
+
+        items = []
+        for (i, tile) in enumerate(regions):
+            items.append(QueueItem(write_tile_scene(exported_file, i, tile), '%s.tile%i' % (image_out_path, i)))
+
+        # Old tiles of the same name are from an earlier render, so they are not skipped.
+        stitched_args = [(arg, suffix) for (arg, suffix) in output_args(scene) if arg in STITCHED_OUTPUTS]
+        scheduler = LocalScheduler(
+            efutil.filesystem_path(getConsolePath(scene)),
+            num_processes=len(items),
+            num_threads=0 if scene.indigo_engine.threads_auto else scene.indigo_engine.threads,
+            max_retries=scene.indigo_engine.scheduler_retries,
+            skip_existing=False,
+            output_args=stitched_args,
+            log=indigo_log
+        )
+        results = self.wait_for_scheduler(scheduler, items)
+        if results is None:
+            return
+
+        failed = [os.path.basename(r.item.scene_path) for r in results if r.status != 'done']
+        if len(failed) > 0:
+            self.report({'ERROR'}, 'Indigo failed to render %s' % ', '.join(failed))
+            return
+
+        stitch_tiles([scheduler.output_file(r.item) for r in results], regions, width, height, image_out_path + '.png')
+        for (arg, suffix) in stitched_args:
+            stitch_tiles([r.item.output_path + suffix for r in results], regions, width, height, image_out_path + suffix, STITCHED_OUTPUTS[arg])
+        indigo_log('Stitched %i tiles into %s.png' % (len(regions), image_out_path))
+
     def stats_timer(self):
         '''
         Update the displayed rendering statistics and detect end of rendering
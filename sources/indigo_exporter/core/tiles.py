@@ -0,0 +1,156 @@
+'''
+Tiled rendering: one exported scene is rendered as several render regions, each
+by its own Indigo process (see LocalScheduler), and the tiles are stitched
+together into the final image.
+
+The tile scenes are copies of the exported .igs which only differ in their
+render_region, written next to it, so they share its mesh, material and object
+files.
+
+Each Indigo process tonemaps and post-processes its own tile, so only settings
+which work on each pixel on its own give tiles which match at their edges, see
+tiling_conflicts(). The PNG and EXR outputs are stitched; IGI and render channel
+outputs can't be.
+'''
+
+import os, math
+import xml.etree.cElementTree as ET
+
+import numpy as np
+
+import bpy            #@UnresolvedImport
+
+# Outputs of tiles which are stitched, as (Indigo argument, Blender file format).
+STITCHED_OUTPUTS = {
+    '-uexro': 'OPEN_EXR',
+    '-texro': 'OPEN_EXR',
+}
+
+def tiling_conflicts(scene):
+    '''
+    Returns the settings of scene which rule out a tiled render, as a list of
+    messages: tonemapping and post-processing which depend on the whole image, and
+    outputs which can't be stitched.
+    '''
+    conflicts = []
+    if scene.camera is not None:
+        if scene.camera.data.indigo_tonemapping.tonemap_type not in ('linear', 'camera'):
+            conflicts.append('Tiles need Linear or Camera tonemapping')
+        if scene.camera.data.indigo_camera.autoexposure:
+            conflicts.append('Tiles need Auto Exposure off')
+        if scene.camera.data.indigo_camera.ad and scene.camera.data.indigo_camera.ad_post:
+            conflicts.append('Tiles need AD Post-Process off')
+    indigo_engine = scene.indigo_engine
+    if indigo_engine.denoise:
+        conflicts.append('Tiles need Denoise off')
+    if indigo_engine.ov_info or indigo_engine.ov_watermark:
+        conflicts.append('Tiles need the overlays off')
+    if indigo_engine.save_igi or indigo_engine.save_render_channels_exr:
+        conflicts.append('IGI and render channel outputs can\'t be stitched')
+    if indigo_engine.network_mode != 'off':
+        conflicts.append('Tiles are not rendered over the network')
+    return conflicts
+
+def tile_regions(region, count):
+    '''
+    Split region (x1, y1, x2, y2), in pixels from the top left, into a grid of at
+    least count tiles. Returns a list of regions, row by row.
+    '''
+    (x1, y1, x2, y2) = region
+    cols = max(1, int(math.ceil(math.sqrt(count))))
+    rows = max(1, int(math.ceil(count / cols)))
+
+    xs = [x1 + (x2 - x1) * i // cols for i in range(cols + 1)]
+    ys = [y1 + (y2 - y1) * i // rows for i in range(rows + 1)]
+
+    regions = []
+    for r in range(rows):
+        for c in range(cols):
+            if xs[c + 1] > xs[c] and ys[r + 1] > ys[r]:
+                regions.append((xs[c], ys[r], xs[c + 1], ys[r + 1]))
+    return regions
+
+def scene_region(igs_path):
+    '''
+    Returns (width, height, region) of an exported scene, where region is its
+    render_region or the whole image.
+    '''
+    settings = ET.parse(igs_path).getroot().find('renderer_settings')
+    width = int(settings.findtext('width'))
+    height = int(settings.findtext('height'))
+
+    region = (0, 0, width, height)
+    rr = settings.find('render_region')
+    if rr is not None:
+        region = tuple(int(rr.findtext(k)) for k in ('x1', 'y1', 'x2', 'y2'))
+    return (width, height, region)
+
+def write_tile_scene(igs_path, index, region):
+    '''
+    Write a copy of the scene at igs_path rendering only region. Returns its path.
+    '''
+    tree = ET.parse(igs_path)
+    settings = tree.getroot().find('renderer_settings')
+
+    rr = settings.find('render_region')
+    if rr is not None:
+        settings.remove(rr)
+    rr = ET.SubElement(settings, 'render_region')
+    for (k, v) in zip(('x1', 'y1', 'x2', 'y2'), region):
+        ET.SubElement(rr, k).text = str(v)
+
+    tile_path = '%s.tile%i.igs' % (os.path.splitext(igs_path)[0], index)
+    tree.write(tile_path, encoding='utf-8')
+    return tile_path
+
+def stitch_pixels(tiles, regions, width, height):
+    '''
+    Copy the region of each tile into one (height, width, 4) float32 array, top row
+    first. tiles yields (name, pixels) per region, pixels being a (h, w, 4) array,
+    top row first, the size of the whole image or of its region.
+    '''
+    result = np.zeros((height, width, 4), dtype=np.float32)
+    result[:, :, 3] = 1.0
+
+    for ((name, pixels), (x1, y1, x2, y2)) in zip(tiles, regions):
+        (h, w) = pixels.shape[:2]
+        if (w, h) == (width, height):
+            result[y1:y2, x1:x2] = pixels[y1:y2, x1:x2]
+        elif (w, h) == (x2 - x1, y2 - y1):
+            result[y1:y2, x1:x2] = pixels
+        else:
+            raise Exception('Tile %s is %ix%i pixels, expected %ix%i or %ix%i' % (name, w, h, width, height, x2 - x1, y2 - y1))
+
+    return result
+
+def load_tile_pixels(tile_files):
+    # One tile at a time, so that only one of them is in memory.
+    for tile_file in tile_files:
+        img = bpy.data.images.load(tile_file, check_existing=False)
+        try:
+            (w, h) = img.size
+            pixels = np.empty(w * h * 4, dtype=np.float32)
+            img.pixels.foreach_get(pixels)
+        finally:
+            bpy.data.images.remove(img)
+
+        # Blender stores the bottom row first, regions count from the top.
+        yield (tile_file, pixels.reshape(h, w, 4)[::-1])
+
+def stitch_tiles(tile_files, regions, width, height, out_path, file_format='PNG'):
+    '''
+    Copy the region of each tile image into one image of width x height, and save
+    it to out_path in file_format, 'PNG' or 'OPEN_EXR'. A tile image may be the
+    size of the whole image or of its region.
+    '''
+    result = stitch_pixels(load_tile_pixels(tile_files), regions, width, height)
+
+    # EXR tiles are linear floats, which a byte image would clamp and quantize.
+    img = bpy.data.images.new('blendigo_stitched_tiles', width, height, alpha=True, float_buffer=(file_format == 'OPEN_EXR'))
+    try:
+        img.pixels.foreach_set(np.ascontiguousarray(result[::-1]).reshape(-1))
+        img.filepath_raw = out_path
+        img.file_format = file_format
+        img.save()
+    finally:
+        bpy.data.images.remove(img)
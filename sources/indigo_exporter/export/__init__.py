@@ -19,6 +19,25 @@ class xml_cdata(str):
 class xml_multichild(list):
     pass
 
+class xml_values(str):
+    '''
+    Element text made of values, formatted with str(). The values are kept, so
+    that format_floats() can format them differently when the XML is written.
+    '''
+    def __new__(cls, values):
+        text = super().__new__(cls, ' '.join([str(v) for v in values]))
+        text.values = values
+        return text
+
+def format_floats(root, float_format):
+    '''
+    Format the float values of the elements under root with float_format, e.g.
+    '%.9g' for deterministic exports, instead of str().
+    '''
+    for elem in root.iter():
+        if type(elem.text) is xml_values:
+            elem.text = ' '.join([float_format % v if type(v) is float else str(v) for v in elem.text.values])
+
 class xml_builder(object):
     """Formatting functions for various data types"""
     format_types = {
@@ -66,7 +85,7 @@ class xml_builder(object):
                 
             # list provides direct value insertion
             elif type(d[key]) is list:
-                x.text = ' '.join([str(i) for i in d[key]])
+                x.text = xml_values(d[key])
             
             # else look up property
             else:
@@ -75,12 +94,12 @@ class xml_builder(object):
                         if 'compute' in p.keys():
                             x.text = str(p['compute'](context, self))
                         else:
-                            x.text = str(
+                            x.text = xml_values([
                                 self.format_types[p['type']](
                                     context,
                                     getattr(self, d[key])
                                 )
-                            )
+                            ])
                             
 class InvalidGeometryException(Exception):
     pass
@@ -88,6 +107,9 @@ class InvalidGeometryException(Exception):
 class UnexportableObjectException(Exception):
     pass
 
+class ExportCancelledException(Exception):
+    pass
+
 class ExportCache(object):
     
     name = 'Cache'
@@ -130,13 +152,49 @@ class SceneIterator(object):
     ]
     
     scene = None
+    depsgraph = None
     abort = False
+    render_engine = None # Optional RenderEngine, to report progress to and to check for cancellation
+    progress_interval = 0.1 # Seconds between progress reports
+    progress_range = (0.0, 1.0) # Part of the progress bar covered by this export, e.g. the current frame of an animation
+    num_instances = 0 # Instances handled by the last complete iterateSceneSteps()
+    expected_instances = 0 # Estimate of the instances of the current iterateSceneSteps(), for progress reports
     
     def canAbort(self):
+        # test_break() is True once the user cancelled the render (Esc).
+        if not self.abort and self.render_engine is not None and hasattr(self.render_engine, 'test_break'):
+            self.abort = self.render_engine.test_break()
         return self.abort
     
+    def reportProgress(self, num_done, obj):
+        if self.render_engine is None or not hasattr(self.render_engine, 'update_progress'):
+            return
+        now = time.time()
+        if now - self.last_progress_time < self.progress_interval:
+            return
+        self.last_progress_time = now
+        (start, end) = self.progress_range
+        self.render_engine.update_progress(start + (end - start) * num_done / max(num_done + 1, self.expected_instances))
+        self.render_engine.update_stats('', '%s: %i objects, %s' % (self.progress_thread_action, num_done, obj.name))
+    
     def iterateScene(self, depsgraph):
+        for num_done in self.iterateSceneSteps(depsgraph):
+            pass
+    
+    def iterateSceneSteps(self, depsgraph):
+        """
+        Handle the objects of depsgraph one at a time, yielding the number handled
+        so far after each one, so that the caller can do other work in between.
+        Stops early when canAbort() becomes true.
+        """
         self.scene = depsgraph.scene_eval
+        self.depsgraph = depsgraph
+        self.last_progress_time = 0.0
+        # Particles and collection instances are only known while iterating, and counting them
+        # would walk all instances twice. The previous frame usually has as many instances,
+        # otherwise the top level objects are a lower bound.
+        self.expected_instances = max(self.num_instances, len(depsgraph.objects))
+        num_done = 0
 
         for ob_inst in depsgraph.object_instances:
             if ob_inst.is_instance:  # Real dupli instance
@@ -161,4 +219,10 @@ class SceneIterator(object):
                     self.handleMesh(ob_inst)
             
             except UnexportableObjectException as err:
-                if OBJECT_ANALYSIS: indigo_log(' -> Unexportable object: %s : %s : %s' % (obj, obj.type, err))
\ No newline at end of file
+                if OBJECT_ANALYSIS: indigo_log(' -> Unexportable object: %s : %s : %s' % (obj, obj.type, err))
+            
+            num_done += 1
+            self.reportProgress(num_done, obj)
+            yield num_done
+        else:
+            self.num_instances = num_done
\ No newline at end of file
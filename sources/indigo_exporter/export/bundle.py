@@ -0,0 +1,246 @@
+'''
+Content-addressed export bundles, for shipping exports to a render farm.
+
+A bundle is the dependency closure of an exported scene: the .igs, the files it
+includes (objects.igs, external .igm materials) and every file they refer to
+(meshes, textures, IES profiles, nk data, apertures). Each file is stored once in
+a repository directory under the hash of its content, so a file shared by many
+exports, e.g. a mesh which didn't change between jobs, is stored and shipped once.
+
+The manifest of a bundle maps the path of each file in the bundle, relative to
+the directory of the scene, to its hash. Files outside that directory (textures
+referenced by absolute path) get the path external/<hash><ext> in the bundle, and
+the scene files referring to them are rewritten to use it. The delta of a bundle
+lists the repository objects which a previous bundle doesn't have, i.e. what has
+to be copied to a farm which already has the previous bundle.
+
+This module doesn't use Blender.
+
+Example usage:
+(manifest_path, delta, builder) = make_bundle('/path/to/export/scene.igs', '/path/to/repository')
+unpack_bundle(manifest_path, '/path/to/repository', '/path/to/job')
+'''
+
+import os, json, hashlib, shutil, time
+import xml.etree.cElementTree as ET
+
+# Elements whose text is the path of a file.
+PATH_TAGS = ('path', 'pathname', 'nk_data')
+
+# Files which are parsed for further references.
+SCENE_EXTENSIONS = ('.igs', '.igm')
+
+MANIFEST_DIR = 'manifests'
+OBJECT_DIR = 'objects'
+
+def file_hash(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def object_path(file_hash, ext):
+    '''
+    Path of a repository object, relative to the repository.
+    '''
+    return '/'.join([OBJECT_DIR, file_hash[:2], file_hash + ext.lower()])
+
+def resolve_reference(text, base_dirs):
+    '''
+    Returns the real path of a file referenced by text, relative to one of
+    base_dirs or absolute, or None if it's not an existing file.
+    '''
+    text = text.strip()
+    if text == '':
+        return None
+    if os.path.isabs(text):
+        return os.path.normpath(text) if os.path.isfile(text) else None
+    for base_dir in base_dirs:
+        candidate = os.path.normpath(os.path.join(base_dir, text))
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+class BundleBuilder(object):
+    '''
+    Collects the files of the scene at scene_path and stores them in the
+    repository. See make_bundle().
+    '''
+
+    def __init__(self, scene_path, repository):
+        self.scene_path = os.path.abspath(scene_path)
+        self.root_dir = os.path.dirname(self.scene_path)
+        self.repository = os.path.abspath(repository)
+
+        self.files = {} # Map from bundle path to manifest entry
+        self.bundle_paths = {} # Map from real path to bundle path
+        self.num_stored = 0
+        self.bytes_stored = 0
+
+    def bundle_path(self, real_path, content_hash):
+        rel_path = os.path.relpath(real_path, self.root_dir)
+        if rel_path.startswith('..') or os.path.isabs(rel_path):
+            return 'external/%s%s' % (content_hash, os.path.splitext(real_path)[1].lower())
+        return rel_path.replace('\\', '/')
+
+    def store(self, data, ext):
+        '''
+        Store data in the repository unless it's already there. Returns its hash.
+        '''
+        content_hash = hashlib.sha256(data).hexdigest()
+        target = os.path.join(self.repository, object_path(content_hash, ext))
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = '%s.%i.tmp' % (target, os.getpid())
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, target)
+            self.num_stored += 1
+            self.bytes_stored += len(data)
+        return content_hash
+
+    def store_file(self, real_path):
+        ext = os.path.splitext(real_path)[1]
+        content_hash = file_hash(real_path)
+        target = os.path.join(self.repository, object_path(content_hash, ext))
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = '%s.%i.tmp' % (target, os.getpid())
+            shutil.copyfile(real_path, tmp)
+            os.replace(tmp, target)
+            self.num_stored += 1
+            self.bytes_stored += os.path.getsize(target)
+        return content_hash
+
+    def add(self, real_path, content_hash):
+        ext = os.path.splitext(real_path)[1]
+        bundle_path = self.bundle_path(real_path, content_hash)
+        self.bundle_paths[real_path] = bundle_path
+        self.files[bundle_path] = {
+            'hash': content_hash,
+            'object': object_path(content_hash, ext),
+            'size': os.path.getsize(os.path.join(self.repository, object_path(content_hash, ext))),
+            'source': real_path,
+        }
+        return bundle_path
+
+    def visit(self, real_path):
+        '''
+        Add the file at real_path, and for scene files everything they refer to.
+        Returns its bundle path.
+        '''
+        if real_path in self.bundle_paths:
+            return self.bundle_paths[real_path]
+
+        if os.path.splitext(real_path)[1].lower() not in SCENE_EXTENSIONS:
+            return self.add(real_path, self.store_file(real_path))
+
+        # Reserve the path first, so that files which include each other terminate.
+        self.bundle_paths[real_path] = None
+
+        tree = ET.parse(real_path)
+        base_dirs = [os.path.dirname(real_path), self.root_dir]
+        rewritten = False
+        for el in tree.getroot().iter():
+            if el.tag not in PATH_TAGS or el.text is None:
+                continue
+            referenced = resolve_reference(el.text, base_dirs)
+            if referenced is None:
+                continue # E.g. nk data presets, which are in the Indigo installation
+            bundle_path = self.visit(referenced)
+            if bundle_path is not None and bundle_path.startswith('external/'):
+                # Like the exporter's own paths, relative to the directory of the scene.
+                el.text = bundle_path
+                rewritten = True
+
+        if rewritten:
+            data = ET.tostring(tree.getroot(), encoding='utf-8')
+            content_hash = self.store(data, os.path.splitext(real_path)[1])
+        else:
+            content_hash = self.store_file(real_path)
+
+        del self.bundle_paths[real_path]
+        return self.add(real_path, content_hash)
+
+    def manifest(self, name):
+        return {
+            'name': name,
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'scene': self.bundle_paths[self.scene_path],
+            'files': dict(sorted(self.files.items())),
+        }
+
+def manifest_objects(manifest):
+    return set(entry['object'] for entry in manifest['files'].values())
+
+def read_manifest(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def latest_manifest(repository, exclude=None):
+    '''
+    Returns the path of the most recently written manifest in repository, or None.
+    '''
+    manifest_dir = os.path.join(repository, MANIFEST_DIR)
+    if not os.path.isdir(manifest_dir):
+        return None
+    manifests = [os.path.join(manifest_dir, f) for f in os.listdir(manifest_dir) if f.endswith('.json')]
+    manifests = [m for m in manifests if exclude is None or os.path.abspath(m) != os.path.abspath(exclude)]
+    if len(manifests) == 0:
+        return None
+    return max(manifests, key=os.path.getmtime)
+
+def make_bundle(scene_path, repository, name=None, previous_manifest=None):
+    '''
+    Store the bundle of the scene at scene_path in repository, and write its
+    manifest to <repository>/manifests/<name>.json and its delta against
+    previous_manifest (by default the latest manifest in the repository) to
+    <repository>/manifests/<name>.delta.txt, one repository object path per line,
+    e.g. for rsync --files-from.
+
+    Returns (manifest path, delta list, bundle builder).
+    '''
+    if name is None:
+        name = '%s.%s' % (os.path.splitext(os.path.basename(scene_path))[0], time.strftime('%Y%m%d-%H%M%S'))
+
+    manifest_dir = os.path.join(repository, MANIFEST_DIR)
+    manifest_path = os.path.join(manifest_dir, name + '.json')
+    if previous_manifest is None:
+        previous_manifest = latest_manifest(repository, exclude=manifest_path)
+
+    builder = BundleBuilder(scene_path, repository)
+    builder.visit(builder.scene_path)
+    manifest = builder.manifest(name)
+
+    previous_objects = set()
+    if previous_manifest is not None:
+        manifest['previous'] = os.path.basename(previous_manifest)
+        previous_objects = manifest_objects(read_manifest(previous_manifest))
+    delta = sorted(manifest_objects(manifest) - previous_objects)
+
+    os.makedirs(manifest_dir, exist_ok=True)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    with open(os.path.join(manifest_dir, name + '.delta.txt'), 'w', encoding='utf-8') as f:
+        f.write(''.join(line + '\n' for line in delta))
+
+    return (manifest_path, delta, builder)
+
+def unpack_bundle(manifest_path, repository, target_dir):
+    '''
+    Recreate the files of a bundle in target_dir from the repository, hard linking
+    where possible. Returns the path of the scene file.
+    '''
+    manifest = read_manifest(manifest_path)
+    for (bundle_path, entry) in manifest['files'].items():
+        target = os.path.join(target_dir, bundle_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            os.remove(target)
+        source = os.path.join(repository, entry['object'])
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+    return os.path.join(target_dir, manifest['scene'])
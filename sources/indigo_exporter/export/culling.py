@@ -0,0 +1,175 @@
+import mathutils        #@UnresolvedImport
+
+from .. properties.camera import aspect_ratio, lens_sensor_dist, lens_shift
+
+class CameraView(object):
+    '''
+    The view of the scene camera as Indigo will render it, built from the same
+    values Indigo_Camera_Properties exports (sensor, lens, shift and ortho).
+
+    Points are tested in camera space: the camera looks down -Z with +Y up.
+    For perspective cameras the view extents are tangents (x/depth, y/depth),
+    for orthographic cameras they are distances in Blender units.
+    '''
+
+    def __init__(self, scene):
+        camera = scene.camera
+        cam_data = camera.data
+
+        # Ignore any scale on the camera object so that camera space distances are world distances.
+        loc, rot, scale = camera.matrix_world.decompose()
+        self.position = loc
+        self.world_to_camera = (mathutils.Matrix.Translation(loc) @ rot.to_matrix().to_4x4()).inverted()
+
+        aspect = aspect_ratio(scene, None)
+        self.resolution = (
+            scene.render.resolution_x * scene.render.resolution_percentage / 100.0,
+            scene.render.resolution_y * scene.render.resolution_percentage / 100.0
+        )
+
+        self.ortho = cam_data.type == 'ORTHO'
+        if self.ortho:
+            # Indigo uses ortho_scale as the sensor width, see Indigo_Camera_Properties.
+            self.half_x = cam_data.ortho_scale / 2.0
+            self.half_y = self.half_x / aspect
+            self.center_x = cam_data.shift_x * cam_data.ortho_scale
+            self.center_y = cam_data.shift_y * cam_data.ortho_scale
+        else:
+            lsd = lens_sensor_dist(scene, None)
+            sx, sy = lens_shift(scene, None)
+            self.half_x = (cam_data.sensor_width / 1000.0) / 2.0 / lsd
+            self.half_y = self.half_x / aspect
+            self.center_x = sx / lsd
+            self.center_y = sy / lsd
+
+    def camera_space_corners(self, obj, matrix_world):
+        m = self.world_to_camera @ matrix_world
+        return [m @ mathutils.Vector(c) for c in obj.bound_box]
+
+    def in_frustum(self, corners, margin=0.0):
+        '''
+        Conservative test of a convex set of camera space points against the view:
+        returns False only if all of them are outside the same side of the view.
+        margin widens the view by that fraction of its size on each side.
+        '''
+        hx = self.half_x * (1.0 + 2.0*margin)
+        hy = self.half_y * (1.0 + 2.0*margin)
+
+        # Indigo does not render anything behind the camera, for either camera type.
+        if all(c.z > 0.0 for c in corners):
+            return False
+
+        if self.ortho:
+            planes = (
+                lambda c: c.x - self.center_x > hx,
+                lambda c: c.x - self.center_x < -hx,
+                lambda c: c.y - self.center_y > hy,
+                lambda c: c.y - self.center_y < -hy,
+            )
+        else:
+            # Planes through the camera position; depth is -z.
+            planes = (
+                lambda c: c.x > (self.center_x + hx) * -c.z,
+                lambda c: c.x < (self.center_x - hx) * -c.z,
+                lambda c: c.y > (self.center_y + hy) * -c.z,
+                lambda c: c.y < (self.center_y - hy) * -c.z,
+            )
+
+        for outside in planes:
+            if all(outside(c) for c in corners):
+                return False
+        return True
+
+    def distance(self, corners):
+        '''
+        Distance from the camera to the camera space bounding box of the points.
+        Never more than the distance to the points' convex hull.
+        '''
+        d = mathutils.Vector((0.0, 0.0, 0.0))
+        for i in range(3):
+            lo = min(c[i] for c in corners)
+            hi = max(c[i] for c in corners)
+            if lo > 0.0:
+                d[i] = lo
+            elif hi < 0.0:
+                d[i] = hi
+        return d.length
+
+    def projected_size(self, corners):
+        '''
+        Approximate size in pixels of the points on the rendered image: the
+        projected diameter of the sphere around their camera space bounding box.
+        '''
+        lo = [min(c[i] for c in corners) for i in range(3)]
+        hi = [max(c[i] for c in corners) for i in range(3)]
+        radius = mathutils.Vector([(hi[i] - lo[i]) / 2.0 for i in range(3)]).length
+
+        if self.ortho:
+            return radius / self.half_x * self.resolution[0]
+
+        depth = -(lo[2] + hi[2]) / 2.0
+        if depth <= radius:
+            # The camera is inside or right next to the sphere.
+            return float('inf')
+        return radius / (depth * self.half_x) * self.resolution[0]
+
+def has_emission(obj):
+    for ms in obj.material_slots:
+        if ms.material == None: continue
+        im = ms.material.indigo_material
+        if im.type == 'external':
+            if im.indigo_material_external.emission_enabled: return True
+        elif im.indigo_material_emission.emission_enabled:
+            return True
+    return False
+
+class FrustumCuller(object):
+    '''
+    Decides which instances can be left out of the export because they are
+    outside the camera view or further away than max_distance.
+
+    Objects which emit light, section planes, exit portals and meshes with
+    'Never cull' enabled are always exported.
+    '''
+
+    def __init__(self, view, margin=0.0, max_distance=0.0):
+        self.view = view
+        self.margin = margin
+        self.max_distance = max_distance
+
+        self.exempt = {} # Map from object name to bool
+
+        # Stats
+        self.num_tested = 0
+        self.num_outside_view = 0
+        self.num_too_far = 0
+
+    def is_exempt(self, obj):
+        exempt = self.exempt.get(obj.name)
+        if exempt is None:
+            exempt = has_emission(obj)
+            if obj.data is not None and hasattr(obj.data, 'indigo_mesh'):
+                im = obj.data.indigo_mesh
+                exempt |= im.never_cull or im.section_plane or im.exit_portal
+            self.exempt[obj.name] = exempt
+        return exempt
+
+    def is_culled(self, obj, matrix_world):
+        if self.is_exempt(obj):
+            return False
+
+        self.num_tested += 1
+        corners = self.view.camera_space_corners(obj, matrix_world)
+
+        if self.max_distance > 0.0 and self.view.distance(corners) > self.max_distance:
+            self.num_too_far += 1
+            return True
+
+        if not self.view.in_frustum(corners, self.margin):
+            self.num_outside_view += 1
+            return True
+
+        return False
+
+    def num_culled(self):
+        return self.num_outside_view + self.num_too_far
@@ -5,12 +5,13 @@ from decimal import *
 from .. core.util import get_worldscale
 
 
-def getTransform(scene, obj, matrix, xml_format='matrix'):
-        ws = get_worldscale(scene)
+def getTransform(scene, obj, matrix, xml_format='matrix', worldscale=None):
+        # Callers transforming many matrices can pass the world scale, instead of reading it for each.
+        ws = get_worldscale(scene) if worldscale is None else worldscale
         mat = matrix.transposed() * ws
         
         xform = {
-            'pos': [str(co) for co in mat.row[3][0:3]],
+            'pos': list(mat.row[3][0:3]),
         }
 
         if xml_format=='quat':
@@ -73,7 +74,7 @@ def getTransform(scene, obj, matrix, xml_format='matrix'):
 
         return xform'''
 
-def matrixListToKeyframes(scene, obj, matrix_list):
+def matrixListToKeyframes(scene, obj, matrix_list, worldscale=None):
     if matrix_list[0][1] == None:
         base_matrix = obj.matrix_world
     else:
@@ -105,7 +106,7 @@ def matrixListToKeyframes(scene, obj, matrix_list):
             matrix_kf = mathutils.Matrix.Translation(lm_k) @ \
                         mathutils.Matrix.Rotation(r_diff.angle, 4, r_diff.axis)
 
-        xform = getTransform(scene, obj, matrix_kf, xml_format='quat')
+        xform = getTransform(scene, obj, matrix_kf, xml_format='quat', worldscale=worldscale)
 
         xform['time'] = [time]
 
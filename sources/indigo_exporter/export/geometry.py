@@ -9,6 +9,8 @@ import math
 import hashlib
 import array
 
+import numpy as np
+
 from ..extensions_framework import util as efutil
 
 from .. core.util import get_worldscale
@@ -17,7 +19,10 @@ from .. export import ( indigo_log,
                             SceneIterator, OBJECT_ANALYSIS,
                             exportutil
                             )
-from .. export.igmesh import igmesh_writer
+from .. export.igmesh import igmesh_writer, decimate_lod_data, spatial_reorder_mesh_data, canonical_frame, rigid_alignment, shape_signature, read_igmesh_materials
+from .. export.culling import has_emission
+from .. export.material_graph import MaterialGraph
+from .. export.mesh_cache import MeshCache
 from . import ExportCache
 
 class model_base(xml_builder):
@@ -25,11 +30,26 @@ class model_base(xml_builder):
 
     def __init__(self, scene):
         self.scene = scene
+        self.worldscale = get_worldscale(scene)
+        self.templates = {} # Map from object name to the xml elements all its instances share
         super().__init__()
 
     def get_additional_elements(self, obj):
         return {}
 
+    def get_template(self, obj):
+        """
+        The elements of get_additional_elements() only depend on the source object, so
+        they are built once per object and appended to the <model> of each instance.
+        """
+        template = self.templates.get(obj.name)
+        if template is None:
+            holder = self.Element(self.element_type)
+            self.build_subelements(obj, self.get_additional_elements(obj), holder)
+            template = list(holder)
+            self.templates[obj.name] = template
+        return template
+
     def get_format(self, obj, mesh_name, matrix_list):
         if len(matrix_list) > 0:
             matrix = matrix_list[0]
@@ -42,8 +62,7 @@ class model_base(xml_builder):
             'scale': [1.0],
         }
 
-        xml_format.update(exportutil.getTransform(self.scene, obj, matrix))
-        xml_format.update(self.get_additional_elements(obj))
+        xml_format.update(exportutil.getTransform(self.scene, obj, matrix, worldscale=self.worldscale))
         return xml_format
 
     def build_xml_element(self, obj, mesh_name, matrix_list):
@@ -52,6 +71,7 @@ class model_base(xml_builder):
         xml_format = self.get_format(obj, mesh_name, matrix_list)
 
         self.build_subelements(obj, xml_format, xml)
+        xml.extend(self.get_template(obj))
 
         return xml
 
@@ -120,17 +140,16 @@ class model_object(model_base):
         }
 
         # Add a base static rotation.
-        xml_format.update(exportutil.getTransform(self.scene, obj, matrix_list[0][1], xml_format='matrix'))
+        xml_format.update(exportutil.getTransform(self.scene, obj, matrix_list[0][1], xml_format='matrix', worldscale=self.worldscale))
 
         if len(matrix_list) > 1:
             # Remove pos, conflicts with keyframes.
             del(xml_format['pos'])
         
-            keyframes = exportutil.matrixListToKeyframes(self.scene, obj, matrix_list)
+            keyframes = exportutil.matrixListToKeyframes(self.scene, obj, matrix_list, worldscale=self.worldscale)
                 
             xml_format['keyframe'] = tuple(keyframes)
 
-        xml_format.update(self.get_additional_elements(obj))
         return xml_format
 
 class exit_portal(model_base):
@@ -158,32 +177,18 @@ class SectionPlane(xml_builder):
         return xml
 
 class SpherePrimitive(xml_builder):
-    def __init__(self, matrix_world, obj):
+    def __init__(self, matrix_world, obj, sphere=None):
         self.matrix_world = matrix_world
         self.obj = obj
+        # Optional (object space center, object space radius, material name), see sphere_source().
+        self.sphere = sphere if sphere is not None else sphere_source(obj)
         super().__init__()
 
     def build_xml_element(self):
 
-        mat = ""
-        for ms in self.obj.material_slots:
-            mat = ms.material.name
-
+        center, bb_radius, mat = self.sphere
 
-        # Compute radius in object space from bounding box
-        bb = self.obj.bound_box # Get object-space bounding box
-        bb_min = bb[0]
-        bb_max = bb[6]
-
-        #print("min")
-        #for i in range(0, 8):
-        #    print("bb[" + str(i) + "]:")
-        #    for c in range(0, 3):
-        #        print(str(bb[i][c]))
-
-        bb_radius = max(bb_max[0] - bb_min[0], bb_max[1] - bb_min[1], bb_max[2] - bb_min[2]) * 0.5
-
-        pos = self.matrix_world.col[3]
+        pos = self.matrix_world @ center
 
         # Compute object->world space scale, use the max of the scalings to scale the sphere radius.
         scale_vec = self.matrix_world.to_scale()
@@ -207,6 +212,109 @@ class SpherePrimitive(xml_builder):
         )
         return xml
 
+def sphere_source(obj):
+    '''
+    Sphere of an object with the Sphere Primitive option set: centered on the object
+    origin with the radius taken from the bounding box.
+    Returns (object space center, object space radius, material name).
+    '''
+    mat = ""
+    for ms in obj.material_slots:
+        mat = ms.material.name
+
+    # Compute radius in object space from bounding box
+    bb = obj.bound_box # Get object-space bounding box
+    bb_min = bb[0]
+    bb_max = bb[6]
+
+    bb_radius = max(bb_max[0] - bb_min[0], bb_max[1] - bb_min[1], bb_max[2] - bb_min[2]) * 0.5
+
+    return (mathutils.Vector((0.0, 0.0, 0.0)), bb_radius, mat)
+
+def fit_sphere(mesh, tolerance):
+    '''
+    Test if the mesh is a closed sphere, like a UV or ico sphere: all vertices and
+    polygon centers must be within tolerance (relative to the radius) of a sphere
+    around the bounding box center, and all polygons must use the same material.
+    Returns (center, radius, material_index), or None if the mesh is not a sphere.
+    '''
+    num_verts = len(mesh.vertices)
+    num_polys = len(mesh.polygons)
+    if num_verts < 12 or num_polys < 20:
+        return None
+
+    co = np.empty(num_verts * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', co)
+    co = co.reshape(num_verts, 3).astype(np.float64)
+
+    center = (co.min(axis=0) + co.max(axis=0)) / 2.0
+    dist = np.sqrt(((co - center) ** 2).sum(axis=1))
+    radius = dist.mean()
+    if radius <= 0.0 or np.abs(dist - radius).max() > tolerance * radius:
+        return None
+
+    # Vertices on a sphere can still make a very coarse polyhedron, so check the faces too.
+    poly_centers = np.empty(num_polys * 3, dtype=np.float32)
+    mesh.polygons.foreach_get('center', poly_centers)
+    poly_centers = poly_centers.reshape(num_polys, 3).astype(np.float64)
+    poly_dist = np.sqrt(((poly_centers - center) ** 2).sum(axis=1))
+    if np.abs(poly_dist - radius).max() > tolerance * radius:
+        return None
+
+    mat_indices = np.empty(num_polys, dtype=np.int32)
+    mesh.polygons.foreach_get('material_index', mat_indices)
+    if mat_indices.min() != mat_indices.max():
+        return None
+
+    return (mathutils.Vector(center), float(radius), int(mat_indices[0]))
+
+def has_creases(mesh):
+    '''
+    True if any edge of mesh has a subdivision crease.
+    '''
+    # Blender 4 stores creases as an attribute, earlier versions on the edges.
+    attribute = mesh.attributes.get('crease_edge') if hasattr(mesh, 'attributes') else None
+    if attribute is not None:
+        creases = np.empty(len(mesh.edges), dtype=np.float32)
+        attribute.data.foreach_get('value', creases)
+        return bool((creases > 0.0).any())
+    if len(mesh.edges) > 0 and hasattr(mesh.edges[0], 'crease'):
+        creases = np.empty(len(mesh.edges), dtype=np.float32)
+        mesh.edges.foreach_get('crease', creases)
+        return bool((creases > 0.0).any())
+    return False
+
+def cage_modifier(obj):
+    '''
+    Returns the Subdivision Surface modifier which obj can leave to Indigo, or None.
+    It has to be the last modifier enabled for rendering, with render levels, and
+    obj can't be a proxy, section plane or sphere primitive, which don't use the
+    evaluated mesh.
+    
+    Indigo's subdivision has no creases, UV smoothing or boundary smoothing
+    options. Objects with creases keep Blender's subdivision; the other options
+    are not carried over.
+    '''
+    if obj.type != 'MESH':
+        return None
+    
+    modifiers = [m for m in obj.modifiers if m.show_render]
+    if len(modifiers) == 0:
+        return None
+    
+    modifier = modifiers[-1]
+    if modifier.type != 'SUBSURF' or modifier.render_levels == 0:
+        return None
+    
+    im = obj.data.indigo_mesh
+    if im.valid_proxy() or im.section_plane or im.sphere_primitive:
+        return None
+    
+    if modifier.use_creases and has_creases(obj.original.data):
+        return None
+    
+    return modifier
+
 class LightingChecker:
     def __init__(self, geometry_exporter):        
         self.valid_lighting = False
@@ -288,6 +396,21 @@ class GeometryExporter(SceneIterator):
     rel_mesh_dir = None
     skip_existing_meshes = False
     verbose = False
+    write_queue = None # Optional MeshWriteQueue, to write meshes on background threads
+    culler = None # Optional FrustumCuller, to skip instances the camera can't see
+    camera_view = None # CameraView of the current frame, used to pick levels of detail
+    
+    canonical_instancing = False # Share meshes which only differ by a rigid transform
+    use_subdivision_cages = False # Leave trailing Subdivision Surface modifiers to Indigo, see prepareSubdivisionCages()
+    subdivision_cages = None # Map from object name to (levels, smooth) of a Subdivision Surface modifier left to Indigo
+    proxy_converter = None # Optional obj_proxy_converter, to export OBJ proxies as igmesh
+    texture_budget = None # Optional TextureBudget, to export downscaled textures
+    auto_spheres = False # Export meshes which are spheres as sphere primitives
+    sphere_tolerance = 0.05
+    
+    # Number of new instances exported at each level of detail.
+    lod_counts = None
+    num_auto_spheres = 0
     
     # Stats
     total_mesh_export_time = 0
@@ -304,10 +427,91 @@ class GeometryExporter(SceneIterator):
         self.MeshesOnDisk = {}
         
         self.mesh_uses_shading_normals = {} # Map from exported_mesh_name to boolean
+        self.material_graph = MaterialGraph(self.ExportedMaterials)
+        self.mesh_cache = MeshCache() # Coordinates mesh writes with other exporters sharing mesh_dir
+        self.lod_counts = [0, 0, 0]
+        
+        self.subdivision_cages = {}
+        self.disabled_cage_modifiers = [] # List of (modifier, show_render, show_viewport), see prepareSubdivisionCages()
+        self.ProxyMeshes = {} # Map from proxy path to (exported path, material names or None)
+        self.CanonicalMeshes = {} # Map from the key of canonicalMeshHash() to list of (canonical vertex positions, canonical custom normals or None, mesh hash)
+        
+        self.SphereTests = {} # Map from mesh datablock (or object, if it has modifiers) to fit_sphere() result
+        self.SphereSources = {} # Map from object name to (center, radius, material name), or None if not a sphere
         
         # Lighting
         self.lc = LightingChecker(self)
     
+    def findSubdivisionCages(self, objects):
+        """
+        Record which of objects (original objects) leave their Subdivision Surface
+        modifier to Indigo, see cage_modifier(). Returns their modifiers.
+        """
+        
+        modifiers = []
+        if not self.use_subdivision_cages:
+            return modifiers
+        
+        for obj in objects:
+            if obj.name in self.subdivision_cages:
+                continue
+            modifier = cage_modifier(obj)
+            if modifier is None:
+                continue
+            self.subdivision_cages[obj.name] = (modifier.render_levels, modifier.subdivision_type == 'CATMULL_CLARK')
+            modifiers.append(modifier)
+        return modifiers
+    
+    def prepareSubdivisionCages(self, objects):
+        """
+        Disable the Subdivision Surface modifier of each of objects (original objects)
+        which leaves it to Indigo, so that their evaluated meshes, with the rest of
+        the modifier stack applied, are the cages. The depsgraph has to be updated
+        afterwards. restoreSubdivisionCages() enables the modifiers again; call it
+        in a finally block.
+        """
+        
+        for modifier in self.findSubdivisionCages(objects):
+            self.disabled_cage_modifiers.append((modifier, modifier.show_render, modifier.show_viewport))
+            modifier.show_render = False
+            modifier.show_viewport = False
+    
+    def restoreSubdivisionCages(self):
+        for (modifier, show_render, show_viewport) in self.disabled_cage_modifiers:
+            modifier.show_render = show_render
+            modifier.show_viewport = show_viewport
+        self.disabled_cage_modifiers = []
+    
+    def cageSubdivision(self, obj):
+        """
+        If the mesh of obj is exported as a cage for Indigo to subdivide, return the
+        (levels, smooth) of its Subdivision Surface modifier, otherwise None. See
+        findSubdivisionCages().
+        """
+        
+        return self.subdivision_cages.get(obj.name)
+    
+    def meshFilesOnDisk(self):
+        """
+        Returns the real paths of the mesh files referenced by MeshesOnDisk.
+        """
+        paths = set()
+        for (exported_mesh_name, xml) in self.MeshesOnDisk.values():
+            for el in xml.iter('path'):
+                paths.add(os.path.normpath(os.path.join(efutil.export_path, el.text)))
+        return paths
+    
+    def sortExports(self):
+        """
+        Reorder the exported lamps, materials, meshes and instances by name (or key),
+        so that exports of the same scene write the same files.
+        """
+        for d in (self.ExportedLamps, self.MeshesOnDisk, self.ExportedObjects):
+            items = sorted(d.items(), key=lambda item: item[0])
+            d.clear()
+            d.update(items)
+        self.material_graph.sort()
+    
     def isLightingValid(self):
         return self.lc.valid_lighting
 
@@ -319,7 +523,7 @@ class GeometryExporter(SceneIterator):
         if obj.data.type == 'AREA':
             pass
         elif obj.data.type == 'SUN' and obj.data.indigo_lamp_sun.type == "hemi":
-            self.ExportedLamps[obj.name] = [obj.data.indigo_lamp_hemi.build_xml_element(obj, self.scene)]
+            self.ExportedLamps[obj.name] = [obj.data.indigo_lamp_hemi.build_xml_element(obj, self.scene, self.texture_budget)]
         elif obj.data.type == 'SUN':
             self.ExportedLamps[obj.name] = [obj.data.indigo_lamp_sun.build_xml_element(obj, self.scene)]
 
@@ -331,18 +535,215 @@ class GeometryExporter(SceneIterator):
 
         if OBJECT_ANALYSIS: indigo_log(' -> handleMesh: %s' % obj)
         self.lc.handleMesh(obj)
+        
+        # Instances already exported in an earlier frame only get a new keyframe.
+        if self.instanceKey(ob_inst, obj) in self.ExportedObjects:
+            self.exportModelElements(ob_inst, None, ob_inst.matrix_world.copy())
+            return
+        
+        if self.culler is not None and self.culler.is_culled(obj, ob_inst.matrix_world):
+            if OBJECT_ANALYSIS: indigo_log(' -> culled: %s' % obj)
+            return
+        
+        # Sphere primitives don't need a mesh.
+        if self.instanceSphere(obj, ob_inst.matrix_world) is not None:
+            self.exportModelElements(ob_inst, None, ob_inst.matrix_world.copy())
+            return
+        
+        lod_level = self.lodLevel(obj, ob_inst.matrix_world)
+        self.lod_counts[lod_level] += 1
+        
         self.exportModelElements(
             ob_inst,
-            self.buildMesh(obj),
+            self.buildMesh(obj, lod_level),
             ob_inst.matrix_world.copy()
         )
+    
+    def instanceSphere(self, obj, matrix_world):
+        """
+        Returns the (center, radius, material name) to export this instance as a sphere
+        primitive with, or None to export it as a mesh.
+        """
+        
+        if obj.data == None or not hasattr(obj.data, 'indigo_mesh'):
+            return None
+        
+        if obj.data.indigo_mesh.sphere_primitive:
+            sphere = self.SphereSources.get(obj.name)
+            if sphere is None:
+                sphere = sphere_source(obj)
+                self.SphereSources[obj.name] = sphere
+            return sphere
+        
+        if not self.auto_spheres or obj.type != 'MESH':
+            return None
+        
+        if obj.name not in self.SphereSources:
+            self.SphereSources[obj.name] = self.detectSphere(obj)
+        sphere = self.SphereSources[obj.name]
+        
+        if sphere is not None:
+            # A sphere primitive can't be scaled non-uniformly.
+            scale = matrix_world.to_scale()
+            lo = min(abs(scale[0]), abs(scale[1]), abs(scale[2]))
+            hi = max(abs(scale[0]), abs(scale[1]), abs(scale[2]))
+            if hi - lo > self.sphere_tolerance * hi:
+                return None
+        
+        return sphere
+    
+    def detectSphere(self, obj):
+        """
+        Check if a source object can be exported as a sphere primitive instead of a mesh.
+        Returns (center, radius, material name), or None.
+        """
+        
+        im = obj.data.indigo_mesh
+        if im.section_plane or im.exit_portal or im.invisible_to_camera or im.max_num_subdivisions > 0 or im.lod_mode != 'none' or im.valid_proxy():
+            return None
+        if self.cageSubdivision(obj) is not None:
+            return None
+        
+        # Emitters need the extra model elements of a mesh object.
+        if has_emission(obj):
+            return None
+        
+        # The evaluated mesh of an object with modifiers is its own; otherwise objects share the datablock's.
+        if len(obj.modifiers) > 0:
+            test_key = ('OBJECT', obj.name)
+        else:
+            test_key = ('MESH', obj.data.name)
+        
+        if test_key not in self.SphereTests:
+            mesh = obj.to_mesh()
+            self.SphereTests[test_key] = fit_sphere(mesh, self.sphere_tolerance)
+            obj.to_mesh_clear()
+        
+        fit = self.SphereTests[test_key]
+        if fit is None:
+            return None
+        
+        (center, radius, mat_index) = fit
+        
+        material_name = 'blendigo_clay'
+        if mat_index < len(obj.material_slots):
+            mat = obj.material_slots[mat_index].material
+            if mat != None:
+                material_name = mat.indigo_material.get_name(mat)
+                self.exportMeshMaterials(obj, [mat_index])
+        
+        if self.verbose: indigo_log('Exporting %s as a sphere primitive' % obj.name)
+        
+        return (center, radius, material_name)
 
-    def buildMesh(self, obj):
+    def buildMesh(self, obj, lod_level=0):
         """
         Process the mesh into required format.
         """
+        
+        if lod_level > 0:
+            mesh_definition = self.exportLODMeshElement(obj, lod_level)
+            if mesh_definition != None:
+                return mesh_definition
 
         return self.exportMeshElement(obj)
+    
+    def lodLevel(self, obj, matrix_world):
+        """
+        Pick the level of detail for an instance from its size on the rendered image:
+        0 is the full mesh, 1 and 2 are coarser variants.
+        """
+        
+        if self.camera_view is None or not hasattr(obj.data, 'indigo_mesh'):
+            return 0
+        
+        im = obj.data.indigo_mesh
+        if self.cageSubdivision(obj) is not None:
+            return 0
+        if im.lod_mode == 'none' or im.section_plane or im.sphere_primitive or im.exit_portal or im.valid_proxy():
+            return 0
+        
+        size = self.camera_view.projected_size(self.camera_view.camera_space_corners(obj, matrix_world))
+        if size < im.lod_pixels_2:
+            return 2
+        if size < im.lod_pixels_1:
+            return 1
+        return 0
+    
+    def exportLODMeshElement(self, obj, lod_level):
+        """
+        Export the mesh for a level of detail of obj, either from the LOD objects
+        set on the mesh or by decimating the object's own mesh.
+        Returns None if there is no such level, in which case the full mesh is used.
+        """
+        
+        im = obj.data.indigo_mesh
+        
+        if im.lod_mode == 'objects':
+            # Fall back to the next finer level that has an object.
+            lod_objects = [im.lod_object_1, im.lod_object_2][:lod_level]
+            lod_objects = [o for o in lod_objects if o is not None and o.type in ('MESH', 'CURVE', 'SURFACE', 'FONT')]
+            if len(lod_objects) == 0:
+                return None
+            return self.exportMeshElement(lod_objects[-1].evaluated_get(self.depsgraph))
+        
+        # Decimated levels are cached by the hash of the full mesh and the decimation ratio.
+        exported_mesh = self.ExportedMeshes.get((obj, lod_level))
+        if exported_mesh != None:
+            return exported_mesh
+        
+        start_time = time.time()
+        
+        mesh = obj.to_mesh()
+        ratio = im.lod_ratio ** lod_level
+        exported_mesh_name = bpy.path.clean_name('%s_lod%i' % (self.meshHash(obj, mesh), round(ratio * 10000)))
+        
+        exported_mesh = self.MeshesOnDisk.get(exported_mesh_name)
+        if exported_mesh != None:
+            self.ExportedMeshes[(obj, lod_level)] = exported_mesh
+            obj.to_mesh_clear()
+            self.total_mesh_export_time += time.time() - start_time
+            return exported_mesh
+        
+        mesh_filename = exported_mesh_name + '.igmesh'
+        full_mesh_path = efutil.filesystem_path( '/'.join([self.mesh_dir, mesh_filename]) )
+        
+        if self.mesh_cache.reuse(full_mesh_path) or not self.mesh_cache.claim(full_mesh_path):
+            # A decimated mesh only depends on the full mesh and the ratio, so an existing file is always valid.
+            used_mat_indices = set()
+            num_smooth = 0
+            for face in mesh.polygons:
+                used_mat_indices.add(face.material_index)
+                if face.use_smooth:
+                    num_smooth += 1
+            
+            use_shading_normals = num_smooth > 0
+        else:
+            (data, used_mat_indices, use_shading_normals) = igmesh_writer.build_mesh_data(obj, mesh)
+            data = igmesh_writer.validate_mesh_data(obj, data, self.scene.indigo_engine.geometry_validation)
+            (data, level) = decimate_lod_data(data, im.lod_ratio, lod_level)
+            if level != lod_level:
+                indigo_log('LOD %i of %s has no triangles left, using LOD %i instead' % (lod_level, obj.name, level), message_type='WARNING')
+            if self.scene.indigo_engine.spatial_reorder:
+                data = spatial_reorder_mesh_data(data)
+            igmesh_writer.write_data(full_mesh_path, data, self.write_queue)
+            if self.verbose: indigo_log('Decimated %s to %i triangles for LOD %i' % (obj.name, len(data.triangles), lod_level))
+        
+        obj.to_mesh_clear()
+        
+        self.exportMeshMaterials(obj, used_mat_indices)
+        
+        filename = '/'.join([self.rel_mesh_dir, mesh_filename])
+        xml = im.build_xml_element(obj, filename, use_shading_normals, exported_name=exported_mesh_name)
+        
+        mesh_definition = (exported_mesh_name, xml)
+        
+        self.MeshesOnDisk[exported_mesh_name] = mesh_definition
+        self.ExportedMeshes[(obj, lod_level)] = mesh_definition
+        
+        self.total_mesh_export_time += time.time() - start_time
+        
+        return mesh_definition
 
 
     def add_vec2_list_hash(self, hash, vec2_list):
@@ -389,6 +790,146 @@ class GeometryExporter(SceneIterator):
 
         return hash.hexdigest()
 
+    def proxyMesh(self, obj):
+        """
+        Find the file for a proxy object, converting OBJ files to igmesh when a
+        proxy converter is set, and the material slots its materials use.
+        Returns (path, used_mat_indices).
+        """
+        
+        path = efutil.filesystem_path(obj.data.indigo_mesh.mesh_path)
+        
+        proxy = self.ProxyMeshes.get(path)
+        if proxy is None:
+            material_names = None
+            if path.lower().endswith('.obj') and self.proxy_converter is not None:
+                (proxy_path, material_names) = self.proxy_converter.convert(path)
+            elif path.lower().endswith('.igmesh'):
+                proxy_path = path
+                material_names = read_igmesh_materials(path)
+            else:
+                proxy_path = path
+            proxy = (proxy_path, material_names)
+            self.ProxyMeshes[path] = proxy
+        
+        (proxy_path, material_names) = proxy
+        
+        if material_names is None:
+            # Assume the file has the same materials as the proxy object
+            return (proxy_path, range(len(obj.material_slots)))
+        
+        used_mat_indices = []
+        slot_names = set()
+        for (mi, ms) in enumerate(obj.material_slots):
+            if ms.material == None: continue
+            name = ms.material.indigo_material.get_name(ms.material)
+            slot_names.add(name)
+            if name in material_names:
+                used_mat_indices.append(mi)
+        
+        missing = [name for name in material_names if name not in slot_names and name != 'blendigo_clay']
+        if len(missing) > 0:
+            indigo_log('Proxy %s uses materials which are not on object %s: %s' % (proxy_path, obj.name, ', '.join(missing)), message_type='WARNING')
+        
+        return (proxy_path, used_mat_indices)
+    
+    def canonicalMeshHash(self, obj, mesh):
+        """
+        Hash the mesh in its canonical frame (see canonical_frame()).
+        Meshes with the same materials, topology, UVs and normal settings whose canonical
+        vertex positions (and custom normals) match within a small tolerance get the same
+        hash, so they are exported once. Candidates are found by a key of the exact parts
+        and the shape_signature() of the positions, so only meshes of the same shape are
+        compared.
+        Returns (hash, (center, rotation)).
+        """
+        
+        num_verts = len(mesh.vertices)
+        co = np.empty(num_verts * 3, dtype=np.float32)
+        mesh.vertices.foreach_get('co', co)
+        co = co.reshape(num_verts, 3)
+        
+        frame = canonical_frame(co)
+        (center, rotation) = frame
+        canonical_co = ((co - center) @ rotation).astype(np.float32)
+        
+        # Exact part of the key: materials, topology, UVs and whatever decides the normals.
+        key_hash = hashlib.sha224()
+        for ms in obj.material_slots:
+            if ms.material != None:
+                key_hash.update(ms.material.name.encode(encoding='UTF-8'))
+        
+        num_loops = len(mesh.loops)
+        num_polys = len(mesh.polygons)
+        loop_vertex_indices = np.empty(num_loops, dtype=np.int32)
+        mesh.loops.foreach_get('vertex_index', loop_vertex_indices)
+        loop_totals = np.empty(num_polys, dtype=np.int32)
+        mesh.polygons.foreach_get('loop_total', loop_totals)
+        poly_mat_indices = np.empty(num_polys, dtype=np.int32)
+        mesh.polygons.foreach_get('material_index', poly_mat_indices)
+        key_hash.update(loop_vertex_indices)
+        key_hash.update(loop_totals)
+        key_hash.update(poly_mat_indices)
+        
+        loop_uvs = np.empty(num_loops * 2, dtype=np.float32)
+        for uv_layer in mesh.uv_layers:
+            uv_layer.data.foreach_get('uv', loop_uvs)
+            key_hash.update(uv_layer.name.encode(encoding='UTF-8'))
+            key_hash.update(loop_uvs)
+        
+        poly_smooth = np.empty(num_polys, dtype=bool)
+        mesh.polygons.foreach_get('use_smooth', poly_smooth)
+        edge_sharp = np.empty(len(mesh.edges), dtype=bool)
+        mesh.edges.foreach_get('use_edge_sharp', edge_sharp)
+        key_hash.update(poly_smooth)
+        key_hash.update(edge_sharp)
+        key_hash.update(('%s|%s|%r' % (mesh.has_custom_normals, getattr(mesh, 'use_auto_smooth', False), getattr(mesh, 'auto_smooth_angle', 0.0))).encode(encoding='UTF-8'))
+        
+        # Custom normals turn with the mesh, so they are compared like the positions.
+        loop_normals = None
+        canonical_normals = None
+        if mesh.has_custom_normals:
+            mesh.calc_normals_split()
+            loop_normals = np.empty(num_loops * 3, dtype=np.float32)
+            mesh.loops.foreach_get('normal', loop_normals)
+            loop_normals = loop_normals.reshape(num_loops, 3).astype(np.float64)
+            canonical_normals = (loop_normals @ rotation).astype(np.float32)
+        
+        key_hash.update(shape_signature(co, center).encode(encoding='UTF-8'))
+        key = key_hash.hexdigest()
+        
+        # Positions can't be hashed directly: copies differ by rounding errors. Compare them
+        # against the meshes with the same key instead, and reuse the hash of a match.
+        extent = float((canonical_co.max(axis=0) - canonical_co.min(axis=0)).max())
+        tolerance = 1e-5 * extent
+        normal_tolerance = 1e-4
+        candidates = self.CanonicalMeshes.setdefault(key, [])
+        for (candidate_co, candidate_normals, candidate_hash) in candidates:
+            if np.abs(candidate_co - canonical_co).max() <= tolerance and \
+                (loop_normals is None or np.abs(candidate_normals - canonical_normals).max() <= normal_tolerance):
+                return (candidate_hash, frame)
+        
+        # Symmetric meshes have no unique principal frame. The topology is the same, so
+        # vertex i of a copy is vertex i of the candidate: align them directly instead.
+        d = co.astype(np.float64) - center
+        for (candidate_co, candidate_normals, candidate_hash) in candidates:
+            (rotation, error) = rigid_alignment(d, candidate_co.astype(np.float64))
+            if error <= tolerance and \
+                (loop_normals is None or np.abs(loop_normals @ rotation - candidate_normals).max() <= normal_tolerance):
+                return (candidate_hash, (center, rotation))
+        
+        mesh_hash = hashlib.sha224()
+        mesh_hash.update(b'canonical')
+        mesh_hash.update(key.encode(encoding='UTF-8'))
+        mesh_hash.update(canonical_co)
+        if canonical_normals is not None:
+            mesh_hash.update(canonical_normals)
+        mesh_hash = mesh_hash.hexdigest()
+        
+        candidates.append((canonical_co, canonical_normals, mesh_hash))
+        
+        return (mesh_hash, frame)
+
     def exportMeshElement(self, obj):
         if OBJECT_ANALYSIS: indigo_log('exportMeshElement: %s' % obj)
 
@@ -404,15 +945,33 @@ class GeometryExporter(SceneIterator):
         
             mesh = None
             if not obj.data.indigo_mesh.valid_proxy():
-                # Create mesh with applied modifiers
+                # Create mesh with applied modifiers (subdivision cages have their Subdivision Surface disabled)
                 mesh = obj.to_mesh()
 
             # depsgraph = context.evaluated_depsgraph_get()
             # object_eval = obj.evaluated_get(depsgraph)
             # mesh_from_eval = object_eval.to_mesh()
 
-            # Compute a hash over the mesh data (vertex positions, material names etc..)
-            mesh_hash = self.meshHash(obj, mesh)
+            frame = None
+            frame_matrix = None
+            if self.canonical_instancing and mesh and len(mesh.vertices) >= 3 and not igmesh_writer.will_stream(self.scene, mesh):
+                # Hash the mesh in its own canonical frame, so copies in other poses share one mesh.
+                (mesh_hash, frame) = self.canonicalMeshHash(obj, mesh)
+                (center, rotation) = frame
+                frame_matrix = mathutils.Matrix([
+                    list(rotation[0]) + [center[0]],
+                    list(rotation[1]) + [center[1]],
+                    list(rotation[2]) + [center[2]],
+                    [0.0, 0.0, 0.0, 1.0]
+                ])
+            else:
+                # Compute a hash over the mesh data (vertex positions, material names etc..)
+                mesh_hash = self.meshHash(obj, mesh)
+
+            # The same cage with other subdivision settings needs its own mesh element.
+            subdivision = self.cageSubdivision(obj)
+            if subdivision is not None:
+                mesh_hash = '%s_subd%i%s' % (mesh_hash, subdivision[0], 's' if subdivision[1] else 'f')
 
             # Form a mesh name like "4618cbf0bc13316135d676fffe0a74fc9b0577909246477354da9254"
             # The name cannot contain the objects name, as the name itself is always unique.
@@ -423,6 +982,7 @@ class GeometryExporter(SceneIterator):
             if exported_mesh != None:
                 # Important! If an object is matched to a mesh on disk, add to ExportedMeshes.
                 # Otherwise the mesh checksum will be computed over and over again.
+                exported_mesh = (exported_mesh[0], exported_mesh[1], frame_matrix)
                 self.ExportedMeshes[obj] = exported_mesh
                 if mesh: obj.to_mesh_clear()
                 self.total_mesh_export_time += time.time() - start_time
@@ -436,8 +996,8 @@ class GeometryExporter(SceneIterator):
 
             # pass the full mesh path to write to filesystem if the object is not a proxy
             if hasattr(obj.data, 'indigo_mesh') and not obj.data.indigo_mesh.valid_proxy():
-                if os.path.exists(full_mesh_path) and self.skip_existing_meshes:
-                    # if skipping mesh write, parse faces to gather used mats
+                if (self.skip_existing_meshes and self.mesh_cache.reuse(full_mesh_path)) or not self.mesh_cache.claim(full_mesh_path):
+                    # if skipping mesh write (or another exporter is writing it), parse faces to gather used mats
                     used_mat_indices = set()
                     num_smooth = 0
                     for face in mesh.polygons:
@@ -448,25 +1008,22 @@ class GeometryExporter(SceneIterator):
                     use_shading_normals = num_smooth > 0
                 else:
                     # else let the igmesh_writer do its thing
-                    (used_mat_indices, use_shading_normals) = igmesh_writer.factory(self.scene, obj, full_mesh_path, mesh, debug=OBJECT_ANALYSIS)
+                    (used_mat_indices, use_shading_normals) = igmesh_writer.factory(self.scene, obj, full_mesh_path, mesh, debug=OBJECT_ANALYSIS, write_queue=self.write_queue, frame=frame)
                     self.mesh_uses_shading_normals[full_mesh_path] = use_shading_normals
             else:
-                # Assume igmesh has same number of mats as the proxy object
-                used_mat_indices = range(len(obj.material_slots))
+                (proxy_path, used_mat_indices) = self.proxyMesh(obj)
 
             # Remove mesh.
             if mesh: obj.to_mesh_clear()
             
             # Export materials used by this mesh
-            if len(obj.material_slots) > 0:
-                for mi in used_mat_indices:
-                    mat = obj.material_slots[mi].material
-                    if mat == None or mat.name in self.ExportedMaterials: continue
-                    mat_xmls = mat.indigo_material.factory(obj, mat, self.scene)
-                    self.ExportedMaterials[mat.name] = mat_xmls
+            self.exportMeshMaterials(obj, used_mat_indices)
 
             # .. put the relative path in the mesh element
-            filename = '/'.join([self.rel_mesh_dir, mesh_filename])
+            if mesh:
+                filename = '/'.join([self.rel_mesh_dir, mesh_filename])
+            else:
+                filename = efutil.path_relative_to_export(proxy_path)
 
             #print('MESH FILENAME %s' % filename)
 
@@ -474,11 +1031,14 @@ class GeometryExporter(SceneIterator):
             if full_mesh_path in self.mesh_uses_shading_normals:
                 shading_normals = self.mesh_uses_shading_normals[full_mesh_path]
 
-            xml = obj.data.indigo_mesh.build_xml_element(obj, filename, shading_normals, exported_name=exported_mesh_name)
+            xml = obj.data.indigo_mesh.build_xml_element(obj, filename, shading_normals, exported_name=exported_mesh_name, subdivision=subdivision)
 
             mesh_definition = (exported_mesh_name, xml)
             
             self.MeshesOnDisk[exported_mesh_name] = mesh_definition
+            
+            # The frame maps the exported mesh to this object's space, see exportModelElements.
+            mesh_definition = (exported_mesh_name, xml, frame_matrix)
             self.ExportedMeshes[obj] = mesh_definition
             
             total = time.time() - start_time
@@ -487,6 +1047,18 @@ class GeometryExporter(SceneIterator):
 
             return mesh_definition
 
+    def exportMeshMaterials(self, obj, used_mat_indices):
+        if len(obj.material_slots) > 0:
+            for mi in used_mat_indices:
+                mat = obj.material_slots[mi].material
+                if mat == None: continue
+                self.material_graph.compile(obj, mat, self.scene, self.texture_budget)
+
+    def instanceKey(self, ob_inst, obj):
+        # If this object was instanced by a DupliObject, use the DupliObject's persistent_id.
+        # The key is a tuple rather than its hash, so instances can be sorted the same way on every export.
+        return (*ob_inst.persistent_id, ob_inst.random_id, obj.name, obj.data.name) # the more the merrier. ob_insts can have identical hash and random_id... 
+    
     def exportModelElements(self, ob_inst, mesh_definition, matrix):
         if ob_inst.is_instance:  # Real dupli instance
             obj = ob_inst.instance_object
@@ -494,14 +1066,14 @@ class GeometryExporter(SceneIterator):
             obj = ob_inst.object
 
         if OBJECT_ANALYSIS: indigo_log('exportModelElements: %s, %s' % (obj, mesh_definition))
-        # If this object was instanced by a DupliObject, hash the DupliObject's persistent_id
-        key = hash((*ob_inst.persistent_id, ob_inst.random_id, obj.name, obj.data.name)) # the more the merrier. ob_insts can have identical hash and random_id... 
+        key = self.instanceKey(ob_inst, obj)
         
         # If the model (object) was already exported, only update the keyframe list.
         emodel = self.ExportedObjects.get(key)
         if emodel != None:
             if emodel[0] == 'OBJECT':
                 # Append to list of (time, matrix) tuples.
+                if emodel[5] is not None: matrix = matrix @ emodel[5]
                 emodel[3].append((self.normalised_time, matrix))
             return
 
@@ -516,8 +1088,10 @@ class GeometryExporter(SceneIterator):
             return
 
         # Special handling for sphere primitives
-        if(obj.data != None and obj.data.indigo_mesh.sphere_primitive):
-            xml = SpherePrimitive(matrix, obj).build_xml_element()
+        sphere = self.instanceSphere(obj, matrix)
+        if sphere is not None:
+            xml = SpherePrimitive(matrix, obj, sphere).build_xml_element()
+            if not obj.data.indigo_mesh.sphere_primitive: self.num_auto_spheres += 1
 
             model_definition = ('SPHERE', xml)
 
@@ -527,6 +1101,11 @@ class GeometryExporter(SceneIterator):
 
         mesh_name = mesh_definition[0]
         
+        # Meshes exported in a canonical frame carry the transform from that frame to object space.
+        frame_matrix = mesh_definition[2] if len(mesh_definition) > 2 else None
+        if frame_matrix is not None:
+            matrix = matrix @ frame_matrix
+        
         # Special handling for exit portals
         if obj.type == 'MESH' and obj.data.indigo_mesh.exit_portal:
             xml = exit_portal(self.scene).build_xml_element(obj, mesh_name, [matrix])
@@ -540,7 +1119,7 @@ class GeometryExporter(SceneIterator):
         # Create list of (time, matrix) tuples.
         obj_matrices = [(self.normalised_time, matrix)]
 
-        model_definition = ('OBJECT', obj, mesh_name, obj_matrices, self.scene)
+        model_definition = ('OBJECT', obj, mesh_name, obj_matrices, self.scene, frame_matrix)
 
         self.ExportedObjects[key] = model_definition
         self.object_id += 1
\ No newline at end of file
@@ -1,10 +1,15 @@
-import bpy, bmesh
+import bpy
 
-from .. export import UnexportableObjectException
+from .. export import UnexportableObjectException, InvalidGeometryException
 from .. export._igmesh import igmesh, igmesh_stream
-from .. export import ( indigo_log )
+from .. export.mesh_cache import publishing
+from .. export import ( indigo_log, OBJECT_ANALYSIS )
 import time
 import array
+import os
+import tempfile
+
+import numpy as np
 
 
 ### Some utility methods for writing binary data to a file. ###
@@ -51,14 +56,151 @@ def write_list_of_vec3s(file, vec3_list):
     # Write the list of floats
     a = array.array('f', component_list)
     a.tofile(file)
+
+
+def write_vec_array(file, vec_array, dtype=np.float32):
+    # Write number of vectors (rows), followed by the packed components.
+    write_uint32(file, len(vec_array))
+    file.write(np.ascontiguousarray(vec_array, dtype=dtype).reshape(-1).view(np.uint8))
+
+
+def read_igmesh_materials(filename):
+    '''
+    Read the list of material names from the header of an .igmesh file.
+    '''
+    with open(filename, 'rb') as file:
+        (magic, version, num_uv_mappings, num_materials) = array.array('I', file.read(16))
+        if magic != 5456751:
+            raise Exception('Invalid IGMESH File: %s' % filename)
+        
+        material_names = []
+        for i in range(num_materials):
+            (length,) = array.array('I', file.read(4))
+            material_names.append(file.read(length).decode(encoding='UTF-8'))
+        
+        return material_names
+
+
+class section_buffers(object):
+    '''
+    File-like object that keeps the buffers written to it instead of copying them,
+    so an encoded mesh can be handed to a MeshWriteQueue.
+    '''
+    
+    def __init__(self):
+        self.buffers = []
+    
+    def write(self, b):
+        self.buffers.append(b)
+    
+    
+    
+
+class igmesh_data(object):
+    '''
+    The sections of an .igmesh file held as numpy arrays, ready to be written
+    by write_igmesh_data().
+    '''
+
+    def __init__(self):
+        self.num_uv_mappings = 0
+        self.material_names = []
+        self.vertices = None    # (n, 3) float32
+        self.normals = None     # (n, 3) float32, or (0, 3) when not exporting normals
+        self.uvs = None         # (n, 2) float32, all UVs of layer 0 first (UV_LAYOUT_LAYER_VERTEX)
+        self.triangles = None   # (n, 7) int32: 3 vertex indices, 3 UV indices, material index
+        self.quads = None       # (n, 9) int32: 4 vertex indices, 4 UV indices, material index
+
+
+def write_igmesh_data(file, data):
+    # Write magic number
+    write_uint32(file, 5456751)
+    
+    # Write format version
+    write_uint32(file, 3)
+    
+    # Write num UV mappings
+    write_uint32(file, data.num_uv_mappings)
+    
+    # Write num used materials
+    write_uint32(file, len(data.material_names))
+    
+    for name in data.material_names:
+        # Write material name
+        write_string(file, name)
+    
+    # Write num uv set expositions.  Note that in v2, these aren't actually read, so can just write zero.
+    write_uint32(file, 0)
+    
+    # write vertices
+    write_vec_array(file, data.vertices)
+    
+    # write vertex normals
+    write_vec_array(file, data.normals)
+    
+    # Write UV layout
+    write_uint32(file, 1) # UV_LAYOUT_LAYER_VERTEX = 1;
+    
+    # Write UV data
+    write_vec_array(file, data.uvs)
+    
+    # Write num triangles, followed by 7 uints per triangle.
+    write_vec_array(file, data.triangles, dtype=np.int32)
+    
+    # Write num quads, followed by 9 uints per quad.
+    write_vec_array(file, data.quads, dtype=np.int32)
+
+
+def read_igmesh_data(filename):
+    '''
+    Read an .igmesh file written by write_igmesh_data() into an igmesh_data.
+    '''
+    with open(filename, 'rb') as file:
+        buf = file.read()
+    
+    pos = 0
+    def read_uint32():
+        nonlocal pos
+        (x,) = np.frombuffer(buf, dtype=np.uint32, count=1, offset=pos)
+        pos += 4
+        return int(x)
+    
+    def read_array(dtype, width):
+        nonlocal pos
+        n = read_uint32()
+        a = np.frombuffer(buf, dtype=dtype, count=n * width, offset=pos).reshape(n, width)
+        pos += a.nbytes
+        return a.copy()
+    
+    data = igmesh_data()
+    (magic, version) = (read_uint32(), read_uint32())
+    if magic != 5456751 or version != 3:
+        raise Exception('Invalid IGMESH File: %s' % filename)
     
+    data.num_uv_mappings = read_uint32()
+    for i in range(read_uint32()):
+        length = read_uint32()
+        data.material_names.append(buf[pos:pos + length].decode(encoding='UTF-8'))
+        pos += length
     
+    if read_uint32() != 0:
+        raise Exception('UV set expositions are not supported: %s' % filename)
     
+    data.vertices = read_array(np.float32, 3)
+    data.normals = read_array(np.float32, 3)
+    if read_uint32() != 1:
+        raise Exception('Unsupported UV layout: %s' % filename)
+    data.uvs = read_array(np.float32, 2)
+    data.triangles = read_array(np.int32, 7)
+    data.quads = read_array(np.int32, 9)
+    
+    return data
+
 
 class igmesh_writer(object):
     
     @staticmethod
-    def factory(scene, obj, filename, mesh, debug=False):
+    def factory(scene, obj, filename, mesh, debug=False, write_queue=None, frame=None):
         
         debug = False
         
@@ -71,7 +213,7 @@ class igmesh_writer(object):
             raise Exception("Can only export 'MESH', 'SURFACE', 'FONT', 'CURVE' objects")
         
 
-        (used_mat_indices, use_shading_normals) = igmesh_writer.write_mesh(filename, scene, obj, mesh)
+        (used_mat_indices, use_shading_normals) = igmesh_writer.write_mesh(filename, scene, obj, mesh, write_queue, frame)
 
         if debug:
             end_time = time.time()
@@ -85,281 +227,884 @@ class igmesh_writer(object):
         
     ################################################################################
     @staticmethod
-    def write_mesh(filename, scene, obj, mesh):
+    def write_mesh(filename, scene, obj, mesh, write_queue=None, frame=None):
+        '''
+        frame is an optional (center, rotation) from canonical_frame(); the mesh is
+        then written in that frame instead of in object space. Streamed meshes can't
+        be written in another frame, see will_stream().
+        '''
+        profile = False
+        
+        if profile:
+            total_start_time = time.time()
+        
+        if igmesh_writer.will_stream(scene, mesh):
+            if frame is not None:
+                raise Exception('Streamed meshes are always written in object space')
+            # Huge mesh: write it section by section in fixed size blocks, see stream_mesh().
+            igmesh_writer.skip_validation(obj, scene.indigo_engine.geometry_validation)
+            return igmesh_writer.stream_mesh(filename, obj, mesh, scene.indigo_engine.stream_memory_budget * 1024 * 1024)
+        
+        (data, used_mat_indices, use_shading_normals) = igmesh_writer.build_mesh_data(obj, mesh)
+        
+        if scene is not None:
+            data = igmesh_writer.validate_mesh_data(obj, data, scene.indigo_engine.geometry_validation)
+        
+        if scene is not None and scene.indigo_engine.spatial_reorder:
+            data = spatial_reorder_mesh_data(data)
+        
+        if frame is not None:
+            (center, rotation) = frame
+            data.vertices = ((data.vertices - center) @ rotation).astype(np.float32)
+            data.normals = (data.normals @ rotation).astype(np.float32)
+        
         start_time = time.time()
-        #####################
-        # convert ngons to tris
-        bm = bmesh.new()
-        bm.from_mesh(mesh) # or from_object
-        bm.faces.ensure_lookup_table()
-
-        ngons = tuple(f for f in bm.faces if len(f.verts)>4)
-        bmesh.ops.triangulate(bm, faces=ngons)
-        bm.to_mesh(mesh)
-        #####################
-        mesh.calc_normals_split()
+        
+        igmesh_writer.write_data(filename, data, write_queue)
+        
+        if profile:
+            indigo_log('Writing file: %0.5f sec' % (time.time() - start_time))
+            indigo_log('Total mesh writing time: %0.5f sec' % (time.time() - total_start_time))
+        
+        return (used_mat_indices, use_shading_normals)
+    
+    @staticmethod
+    def will_stream(scene, mesh):
+        return scene is not None and scene.indigo_engine.stream_large_meshes and len(mesh.polygons) >= scene.indigo_engine.stream_min_faces
+    
+    @staticmethod
+    def skip_validation(obj, mode):
+        '''
+        Streamed meshes are never held in memory as a whole, so they can't be
+        validated. Raises InvalidGeometryException if mode is 'fail', otherwise
+        logs that the mesh wasn't checked.
+        '''
+        if mode == 'off':
+            return
+        message = 'Mesh %s is streamed, so it can\'t be checked for invalid faces' % obj.name
+        if mode == 'fail':
+            raise InvalidGeometryException('%s; raise the minimum number of faces of streamed meshes or don\'t check meshes' % message)
+        indigo_log(message, message_type='WARNING')
+    
+    @staticmethod
+    def validate_mesh_data(obj, data, mode):
+        '''
+        Find faces with non-finite coordinates, zero area faces and duplicate faces
+        in data, see find_invalid_faces(), and log them per object. mode is one of
+        'off', 'warn' (write the mesh as it is), 'drop' (leave the faces out) or
+        'fail' (raise InvalidGeometryException).
+        
+        Returns data, or a copy without the invalid faces for 'drop'.
+        '''
+        if mode == 'off':
+            return data
+        
+        (keep_triangles, keep_quads, num_non_finite, num_degenerate, num_duplicate) = find_invalid_faces(data)
+        num_invalid = num_non_finite + num_degenerate + num_duplicate
+        if num_invalid == 0:
+            return data
+        
+        message = 'Mesh %s has %i invalid faces: %i with non-finite coordinates, %i with zero area, %i duplicates' % (
+            obj.name, num_invalid, num_non_finite, num_degenerate, num_duplicate)
+        
+        if mode == 'fail':
+            raise InvalidGeometryException(message)
+        
+        if mode == 'warn':
+            indigo_log(message, message_type='WARNING')
+            return data
+        
+        indigo_log('%s; leaving them out' % message, message_type='WARNING')
+        
+        if not keep_triangles.any() and not keep_quads.any():
+            raise UnexportableObjectException('Object %s has no valid faces!' % obj.name)
+        
+        result = igmesh_data()
+        result.num_uv_mappings = data.num_uv_mappings
+        result.material_names = data.material_names
+        result.vertices = data.vertices
+        result.normals = data.normals
+        result.uvs = data.uvs
+        result.triangles = data.triangles[keep_triangles]
+        result.quads = data.quads[keep_quads]
+        return result
+    
+    @staticmethod
+    def write_data(filename, data, write_queue=None):
+        if write_queue is not None:
+            # Hand the encoded sections to the writer threads and carry on with the next object.
+            buffers = section_buffers()
+            write_igmesh_data(buffers, data)
+            write_queue.submit(filename, buffers.buffers)
+        else:
+            with publishing(filename) as file:
+                write_igmesh_data(file, data)
     
+    @staticmethod
+    def build_mesh_data(obj, mesh):
+        '''
+        Read the mesh in bulk with foreach_get and build its igmesh_data.
+        N-gons are triangulated from the mesh's loop triangles, the mesh itself is not modified.
+        
+        Returns (data, used_mat_indices, use_shading_normals).
+        '''
+        start_time = time.time()
+        
         profile = False
         
         exportDummyUVs = True
         
-        if profile:
-            total_start_time = time.time()
-            
-        if len(mesh.polygons) < 1:
+        num_polys = len(mesh.polygons)
+        num_loops = len(mesh.loops)
+        num_verts = len(mesh.vertices)
+        
+        if num_polys < 1:
             raise UnexportableObjectException('Object %s has no faces!' % obj.name)
         
-        if len(mesh.vertices) < 1:
+        if num_verts < 1:
             raise UnexportableObjectException('Object %s has no verts!' % obj.name)
-
+        
+        data = igmesh_data()
         
         render_uvs = [uvl for uvl in mesh.uv_layers]
         num_uv_sets = len(render_uvs)
         
-
-        # Open file to write to
-        file = open(filename, 'wb')
-        
-        # Write magic number
-        write_uint32(file, 5456751)
-        
-        # Write format version
-        write_uint32(file, 3)
-        
-        # Write num UV mappings
         if num_uv_sets == 0 and exportDummyUVs:
-            write_uint32(file, 1)
+            data.num_uv_mappings = 1
         else:
-            write_uint32(file, num_uv_sets)
+            data.num_uv_mappings = num_uv_sets
         
-        #used_mat_indices = rang(obj.material_slots)
+        (data.material_names, used_mat_indices) = get_used_materials(obj)
         
-        used_mat_indices = set()
-        mats = []
+        # Bulk read polygon data.
+        poly_loop_starts = np.empty(num_polys, dtype=np.int32)
+        mesh.polygons.foreach_get('loop_start', poly_loop_starts)
+        poly_loop_totals = np.empty(num_polys, dtype=np.int32)
+        mesh.polygons.foreach_get('loop_total', poly_loop_totals)
+        poly_mat_indices = np.empty(num_polys, dtype=np.int32)
+        mesh.polygons.foreach_get('material_index', poly_mat_indices)
+        poly_smooth = np.empty(num_polys, dtype=bool)
+        mesh.polygons.foreach_get('use_smooth', poly_smooth)
         
-        num_mats = len(obj.material_slots)
-        for mi in range(num_mats):
-            mats.append(obj.material_slots[mi].material)
-            used_mat_indices.add(mi)
+        loop_vertex_indices = np.empty(num_loops, dtype=np.int32)
+        mesh.loops.foreach_get('vertex_index', loop_vertex_indices)
         
+        co = np.empty(num_verts * 3, dtype=np.float32)
+        mesh.vertices.foreach_get('co', co)
+        co.shape = (num_verts, 3)
         
-        if profile:
-            indigo_log('used_mat_indices: %s' % str(used_mat_indices))
-    
-                
-        if len(mats) == 0:
-            # Write num used materials
-            write_uint32(file, 1)
-            
-            # Write material name
-            write_string(file, 'blendigo_clay')
-        else:
-            # Count number of actual materials.
-            count = 0
-            for m in mats:
-                if m == None: continue
-                count += 1
-                
-            # Write num used materials
-            write_uint32(file, count)
+        (use_loops, use_shading_normals) = get_normal_mode(mesh, poly_smooth)
+        
+        if use_loops:
+            mesh.calc_normals_split()
             
-            for m in mats:
-                if m == None: continue
-                # Write material name
-                write_string(file, m.indigo_material.get_name(m))
-        
-        # Write num uv set expositions.  Note that in v2, these aren't actually read, so can just write zero.
-        write_uint32(file, 0)
-        
-        # Full loop/normal procedure if:
-        # - mesh.has_custom_normals
-        # - has both flat/smooth faces
-        # - sharp edge present
-
-        # vert/normal procedure if:
-        # - all edges are smooth
-        use_loops = use_shading_normals = mesh.has_custom_normals
-        if not mesh.has_custom_normals:
-            has_smooth_faces = False
-            has_flat_faces = False
-            for face in mesh.polygons: # for each face
-                if face.use_smooth:
-                    has_smooth_faces = True
-                else:
-                    has_flat_faces = True
-                
-                if has_smooth_faces and has_flat_faces:
-                    use_shading_normals = True
-                    use_loops = True
-                    break
+            loop_normals = np.empty(num_loops * 3, dtype=np.float32)
+            mesh.loops.foreach_get('normal', loop_normals)
+            loop_normals.shape = (num_loops, 3)
             
-            if has_smooth_faces and not has_flat_faces:
-                use_shading_normals = True
-                for e in bm.edges:
-                    if not e.smooth:
-                        use_loops = True
-                        break
+            # Merge loops sharing a vertex and split normal, instead of writing one vertex per loop.
+            (data.vertices, data.normals, loop_output_indices) = weld_loop_vertices(loop_vertex_indices, loop_normals, co)
+            del loop_normals
             
-            # else: all flat, no normals exported
-        if obj.name == "preview_sphere":
-            print('#####', use_shading_normals, use_loops, has_smooth_faces, has_flat_faces)
-            # True False True False
-        
-        vertices = []
-        normals = []
-
-        populate_vertices(mesh, vertices, use_loops)
-        populate_normals(mesh, normals, use_shading_normals, use_loops)
+            if OBJECT_ANALYSIS: indigo_log('Welded mesh %s: %i loop vertices -> %i vertices (%.1f%% smaller vertex data)' %
+                (obj.name, num_loops, len(data.vertices), 100.0 * (1.0 - len(data.vertices) / max(num_loops, 1))))
+        else:
+            data.vertices = co
+            loop_output_indices = loop_vertex_indices
             
-        # write vertices
-        write_list_of_vec3s(file, vertices)
-
-        # write vertex normals
-        write_list_of_vec3s(file, normals)
-        
-        
-        del vertices
-        del normals
-        
-        if profile:
-            indigo_log('Writing vertices and vertex normals: %0.5f sec' % (time.time() - start_time))
+            if use_shading_normals:
+                data.normals = np.empty(num_verts * 3, dtype=np.float32)
+                mesh.vertices.foreach_get('normal', data.normals)
+                data.normals.shape = (num_verts, 3)
+            else:
+                data.normals = np.zeros((0, 3), dtype=np.float32)
         
         if profile:
-            indigo_log('num_uv_sets : %i' % num_uv_sets)
-            # indigo_log('len(mesh.loop_triangles) : %i' % len(mesh.loop_triangles))
-            indigo_log('len(mesh.polygons) : %i' % len(mesh.polygons))
-            #indigo_log('4*len(mesh.tessfaces)*num_uv_sets : %i sec' % (4*len(mesh.tessfaces)*num_uv_sets))
-            #indigo_log('8*4*len(mesh.tessfaces)*num_uv_sets : %i sec' % (8*4*len(mesh.tessfaces)*num_uv_sets))
+            indigo_log('Building vertices and vertex normals: %0.5f sec' % (time.time() - start_time))
         
         start_time = time.time()
-        uv_start_time = time.time()
         
-        uv_data = []
-
         if num_uv_sets > 0:
-            for layer_uv in render_uvs: # For each UV set
-                for poly in mesh.polygons:
-                    if len(poly.vertices) == 3:
-                        uv_data.extend((*(layer_uv.data[l].uv for l in poly.loop_indices), (0,0)))
-                    else:
-                        uv_data.extend((*(layer_uv.data[l].uv for l in poly.loop_indices),))
+            # Shared UV values are written once and referenced through an index, see index_uv_layers().
+            (data.uvs, loop_uv_indices) = index_uv_layers(mesh, render_uvs)
         elif exportDummyUVs:
-            uv_data.extend([(0,0)])
-
+            data.uvs = np.zeros((1, 2), dtype=np.float32)
+            # All corners reference the single dummy UV.
+            loop_uv_indices = np.zeros(num_loops, dtype=np.int32)
+        else:
+            data.uvs = np.zeros((0, 2), dtype=np.float32)
+            loop_uv_indices = np.zeros(num_loops, dtype=np.int32)
+        
         if profile:
-            indigo_log('    Making UV list time : %0.5f sec' % (time.time() - start_time))
+            indigo_log('Building UVs: %0.5f sec' % (time.time() - start_time))
+        
         start_time = time.time()
         
+        (tri_loops, tri_mat_indices, quad_loops, quad_mat_indices) = triangulate_polygons(mesh, poly_loop_starts, poly_loop_totals, poly_mat_indices)
         
-        # Write UV layout
-        write_uint32(file, 1) # UV_LAYOUT_LAYER_VERTEX = 1;
-
-        # Write UV data
-        write_list_of_vec2s(file, uv_data)
-        del uv_data # Free uv_data mem
+        data.triangles = make_poly_records(loop_output_indices[tri_loops], loop_uv_indices[tri_loops], tri_mat_indices)
+        data.quads = make_poly_records(loop_output_indices[quad_loops], loop_uv_indices[quad_loops], quad_mat_indices)
         
-
         if profile:
-            indigo_log('    Writing UVs: %0.5f sec' % (time.time() - start_time))
-            indigo_log('Total UV time: %0.5f sec' % (time.time() - uv_start_time))
+            indigo_log('Building triangles and quads: %0.5f sec' % (time.time() - start_time))
+        
+        return (data, used_mat_indices, use_shading_normals)
 
+    @staticmethod
+    def stream_mesh(filename, obj, mesh, memory_budget):
+        '''
+        Write a huge mesh section by section, in blocks of a fixed number of elements.
         
-        # Write triangles
+        foreach_get can only read whole attributes, so each attribute is read into a
+        disk backed scratch buffer (see scratch_buffers) and is then encoded and appended
+        to the file block by block. Section counts are computed up front.
+        Loop vertices are not welded and UVs are not indexed in this mode, as both need
+        the whole mesh in memory; each loop gets its own vertex and UV instead.
+        
+        Returns (used_mat_indices, use_shading_normals).
+        '''
         start_time = time.time()
         
-        tri_data = [] # A list of integers
-        quad_data = [] # A list of integers
-
-        populate_poly_data(mesh, tri_data, quad_data, use_loops, num_uv_sets)
-
-    
-        ####### Write triangles #######        
-        # Write num triangles
+        num_polys = len(mesh.polygons)
+        num_loops = len(mesh.loops)
+        num_verts = len(mesh.vertices)
         
-        num_tris = len(tri_data) // 7  # NOTE: // is integer division, which we want.  There are 7 uints per triangle.
-        write_uint32(file, num_tris)
-                    
-        tri_array = array.array('i', tri_data)
-        tri_array.tofile(file)
+        if num_polys < 1:
+            raise UnexportableObjectException('Object %s has no faces!' % obj.name)
         
-        del tri_data # Free tri data
+        if num_verts < 1:
+            raise UnexportableObjectException('Object %s has no verts!' % obj.name)
         
-        if profile:
-            indigo_log('Writing triangle time: %0.5f sec' % (time.time() - start_time))
+        # Number of elements per block; 128 bytes covers a quad record plus the temporaries used to build it.
+        block_size = max(1024, memory_budget // 128)
+        
+        (material_names, used_mat_indices) = get_used_materials(obj)
+        
+        render_uvs = [uvl for uvl in mesh.uv_layers]
+        num_uv_sets = len(render_uvs)
+        
+        with scratch_buffers(os.path.dirname(filename)) as scratch, publishing(filename) as file:
+            poly_smooth = scratch.new(num_polys, bool)
+            mesh.polygons.foreach_get('use_smooth', poly_smooth)
+            (use_loops, use_shading_normals) = get_normal_mode(mesh, poly_smooth)
+            del poly_smooth
+            
+            # Write magic number
+            write_uint32(file, 5456751)
+            
+            # Write format version
+            write_uint32(file, 3)
+            
+            # Write num UV mappings
+            write_uint32(file, max(num_uv_sets, 1))
+            
+            # Write num used materials
+            write_uint32(file, len(material_names))
+            
+            for name in material_names:
+                # Write material name
+                write_string(file, name)
+            
+            # Write num uv set expositions.
+            write_uint32(file, 0)
+            
+            loop_vertex_indices = scratch.new(num_loops, np.int32)
+            mesh.loops.foreach_get('vertex_index', loop_vertex_indices)
+            
+            co = scratch.new(num_verts * 3, np.float32)
+            mesh.vertices.foreach_get('co', co)
+            co = co.reshape(num_verts, 3)
+            
+            # write vertices
+            if use_loops:
+                write_uint32(file, num_loops)
+                for (a, b) in iterate_blocks(num_loops, block_size):
+                    co[loop_vertex_indices[a:b]].tofile(file)
+            else:
+                write_uint32(file, num_verts)
+                for (a, b) in iterate_blocks(num_verts, block_size):
+                    np.asarray(co[a:b]).tofile(file)
+            del co
+            
+            # write vertex normals
+            if use_loops:
+                mesh.calc_normals_split()
+                normals = scratch.new(num_loops * 3, np.float32)
+                mesh.loops.foreach_get('normal', normals)
+            elif use_shading_normals:
+                normals = scratch.new(num_verts * 3, np.float32)
+                mesh.vertices.foreach_get('normal', normals)
+            else:
+                normals = np.zeros(0, dtype=np.float32)
+            normals = normals.reshape(-1, 3)
+            
+            write_uint32(file, len(normals))
+            for (a, b) in iterate_blocks(len(normals), block_size):
+                np.asarray(normals[a:b]).tofile(file)
+            del normals
+            
+            # Write UV layout
+            write_uint32(file, 1) # UV_LAYOUT_LAYER_VERTEX = 1;
+            
+            # Write UV data, one UV per loop and layer.
+            if num_uv_sets > 0:
+                write_uint32(file, num_loops * num_uv_sets)
+                for layer_uv in render_uvs:
+                    uvs = scratch.new(num_loops * 2, np.float32)
+                    layer_uv.data.foreach_get('uv', uvs)
+                    for (a, b) in iterate_blocks(num_loops * 2, block_size * 2):
+                        np.asarray(uvs[a:b]).tofile(file)
+                    del uvs
+            else:
+                write_vec_array(file, np.zeros((1, 2), dtype=np.float32))
+            
+            poly_loop_starts = scratch.new(num_polys, np.int32)
+            mesh.polygons.foreach_get('loop_start', poly_loop_starts)
+            poly_loop_totals = scratch.new(num_polys, np.int32)
+            mesh.polygons.foreach_get('loop_total', poly_loop_totals)
+            poly_mat_indices = scratch.new(num_polys, np.int32)
+            mesh.polygons.foreach_get('material_index', poly_mat_indices)
+            
+            def write_records(poly_loops, mat_indices):
+                corner_vertices = poly_loops if use_loops else loop_vertex_indices[poly_loops]
+                corner_uvs = poly_loops if num_uv_sets > 0 else np.zeros_like(poly_loops)
+                make_poly_records(corner_vertices, corner_uvs, mat_indices).tofile(file)
+            
+            num_direct_tris = 0
+            num_quads = 0
+            has_ngons = False
+            for (a, b) in iterate_blocks(num_polys, block_size):
+                totals = poly_loop_totals[a:b]
+                num_direct_tris += int(np.count_nonzero(totals == 3))
+                num_quads += int(np.count_nonzero(totals == 4))
+                has_ngons |= bool((totals > 4).any())
+            
+            num_ngon_tris = 0
+            if has_ngons:
+                mesh.calc_loop_triangles()
+                # Every triangle and quad is also in loop_triangles, as one and two triangles.
+                num_ngon_tris = len(mesh.loop_triangles) - num_direct_tris - 2 * num_quads
+            
+            ####### Write triangles #######
+            write_uint32(file, num_direct_tris + num_ngon_tris)
+            
+            for (a, b) in iterate_blocks(num_polys, block_size):
+                is_tri = poly_loop_totals[a:b] == 3
+                write_records(poly_loop_starts[a:b][is_tri, np.newaxis] + np.arange(3, dtype=np.int32), poly_mat_indices[a:b][is_tri])
+            
+            if has_ngons:
+                num_loop_tris = len(mesh.loop_triangles)
+                loop_tri_loops = scratch.new(num_loop_tris * 3, np.int32)
+                mesh.loop_triangles.foreach_get('loops', loop_tri_loops)
+                loop_tri_loops = loop_tri_loops.reshape(num_loop_tris, 3)
+                loop_tri_polys = scratch.new(num_loop_tris, np.int32)
+                mesh.loop_triangles.foreach_get('polygon_index', loop_tri_polys)
+                
+                for (a, b) in iterate_blocks(num_loop_tris, block_size):
+                    polys = loop_tri_polys[a:b]
+                    from_ngon = poly_loop_totals[polys] > 4
+                    write_records(np.asarray(loop_tri_loops[a:b][from_ngon]), poly_mat_indices[polys[from_ngon]])
+                
+                del loop_tri_loops
+                del loop_tri_polys
+            
+            ####### Write quads #######
+            write_uint32(file, num_quads)
+            
+            for (a, b) in iterate_blocks(num_polys, block_size):
+                is_quad = poly_loop_totals[a:b] == 4
+                write_records(poly_loop_starts[a:b][is_quad, np.newaxis] + np.arange(4, dtype=np.int32), poly_mat_indices[a:b][is_quad])
+            
+            del poly_loop_starts
+            del poly_loop_totals
+            del poly_mat_indices
+            del loop_vertex_indices
         
-        ####### Write quads #######
-        # Write num quads
-        num_quads = len(quad_data) // 9  # NOTE: // is integer division, which we want.  There are 9 uints per quad.
-        write_uint32(file, num_quads)
+        indigo_log('Streamed mesh %s (%i faces) in blocks of %i: %0.2f sec' % (obj.name, num_polys, block_size, time.time() - start_time))
+        
+        return (used_mat_indices, use_shading_normals)
 
-        quad_array = array.array('i', quad_data)
-        quad_array.tofile(file)
+class scratch_buffers(object):
+    '''
+    Disk backed numpy buffers to foreach_get whole attributes of huge meshes into,
+    so that they don't need to be resident in memory. The files are removed on exit.
+    '''
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.paths = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        for path in self.paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.paths = []
+    
+    def new(self, count, dtype):
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
         
-        # Close the file we have been writing to.
-        file.close()
+        (fd, path) = tempfile.mkstemp(prefix='igmesh_scratch_', dir=self.directory)
+        os.close(fd)
+        self.paths.append(path)
         
-        # use_shading_normals = num_smooth > 0
+        return np.memmap(path, dtype=dtype, mode='w+', shape=(count,))
+
+def iterate_blocks(count, block_size):
+    for a in range(0, count, block_size):
+        yield (a, min(a + block_size, count))
+
+def get_used_materials(obj):
+    '''
+    Returns (material_names, used_mat_indices) for the material section of the mesh.
+    '''
+    #used_mat_indices = rang(obj.material_slots)
+    
+    used_mat_indices = set()
+    mats = []
+    
+    num_mats = len(obj.material_slots)
+    for mi in range(num_mats):
+        mats.append(obj.material_slots[mi].material)
+        used_mat_indices.add(mi)
+    
+    if len(mats) == 0:
+        material_names = ['blendigo_clay']
+    else:
+        material_names = [m.indigo_material.get_name(m) for m in mats if m != None]
+    
+    return (material_names, used_mat_indices)
+
+def get_normal_mode(mesh, poly_smooth):
+    '''
+    Returns (use_loops, use_shading_normals).
+    '''
+    # Full loop/normal procedure if:
+    # - mesh.has_custom_normals
+    # - has both flat/smooth faces
+    # - sharp edge present
+
+    # vert/normal procedure if:
+    # - all edges are smooth
+    use_loops = use_shading_normals = mesh.has_custom_normals
+    if not mesh.has_custom_normals:
+        has_smooth_faces = bool(poly_smooth.any())
+        has_flat_faces = not poly_smooth.all()
         
-        if profile:
-            total_time = time.time() - total_start_time
-            indigo_log('Total mesh writing time: %0.5f sec' % (total_time))
+        if has_smooth_faces and has_flat_faces:
+            use_shading_normals = True
+            use_loops = True
         
-        bm.free()
+        if has_smooth_faces and not has_flat_faces:
+            use_shading_normals = True
+            edge_sharp = np.empty(len(mesh.edges), dtype=bool)
+            mesh.edges.foreach_get('use_edge_sharp', edge_sharp)
+            use_loops = bool(edge_sharp.any())
         
-        return (used_mat_indices, use_shading_normals)
+        # else: all flat, no normals exported
+    
+    return (use_loops, use_shading_normals)
 
-def populate_vertices(mesh, vertices, use_loops):
-    if use_loops:
-        for l in mesh.loops:
-            vertices.append(mesh.vertices[l.vertex_index].co)
-        return
+def triangulate_polygons(mesh, poly_loop_starts, poly_loop_totals, poly_mat_indices):
+    '''
+    Split the polygons into triangles and quads, as loop indices.
+    Triangles and quads are kept as they are, n-gons are replaced by their loop triangles.
+    
+    Returns (tri_loops, tri_mat_indices, quad_loops, quad_mat_indices).
+    '''
+    is_tri = poly_loop_totals == 3
+    is_quad = poly_loop_totals == 4
     
-    for v in mesh.vertices:
-        vertices.append(v.co)
+    tri_loops = poly_loop_starts[is_tri, np.newaxis] + np.arange(3, dtype=np.int32)
+    tri_mat_indices = poly_mat_indices[is_tri]
+    
+    quad_loops = poly_loop_starts[is_quad, np.newaxis] + np.arange(4, dtype=np.int32)
+    quad_mat_indices = poly_mat_indices[is_quad]
+    
+    if (poly_loop_totals > 4).any():
+        mesh.calc_loop_triangles()
+        
+        num_loop_tris = len(mesh.loop_triangles)
+        loop_tri_loops = np.empty(num_loop_tris * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get('loops', loop_tri_loops)
+        loop_tri_loops.shape = (num_loop_tris, 3)
+        loop_tri_polys = np.empty(num_loop_tris, dtype=np.int32)
+        mesh.loop_triangles.foreach_get('polygon_index', loop_tri_polys)
+        
+        from_ngon = poly_loop_totals[loop_tri_polys] > 4
+        
+        tri_loops = np.concatenate((tri_loops, loop_tri_loops[from_ngon]))
+        tri_mat_indices = np.concatenate((tri_mat_indices, poly_mat_indices[loop_tri_polys[from_ngon]]))
+    
+    return (tri_loops, tri_mat_indices, quad_loops, quad_mat_indices)
 
-def populate_normals(mesh, normals, use_shading_normals, use_loops):
-    if use_loops:
-        for l in mesh.loops:
-            normals.append(l.normal)
-        return
+def make_poly_records(corner_vertices, corner_uvs, poly_mat_indices):
+    '''
+    Build the (n, 2*k + 1) int32 triangle or quad records from (n, k) per-corner indices:
+    k vertex indices, k UV indices, material index.
+    '''
+    (num_polys, k) = corner_vertices.shape
     
-    if use_shading_normals:
-        for v in mesh.vertices:
-            normals.append(v.normal)
-        return
+    records = np.empty((num_polys, 2*k + 1), dtype=np.int32)
+    records[:, 0:k] = corner_vertices
+    records[:, k:2*k] = corner_uvs
+    records[:, 2*k] = poly_mat_indices
+    
+    return records
 
-def populate_poly_data(mesh, tri_data, quad_data, use_loops, num_uv_sets):
-    if num_uv_sets > 0:
-        if use_loops:
-            for poly in mesh.polygons:
-                uv_idx = poly.index * 4
-                fv = poly.loop_indices
-
-                if len(poly.vertices) == 3: #tri
-                    tri_data.extend([fv[0], fv[1], fv[2], uv_idx, uv_idx + 1, uv_idx + 2, poly.material_index])
-                else: #quad
-                    quad_data.extend([fv[0], fv[1], fv[2], fv[3], uv_idx, uv_idx + 1, uv_idx + 2, uv_idx + 3, poly.material_index])
-        else:
-            for poly in mesh.polygons:
-                uv_idx = poly.index * 4
-                fv = poly.vertices
-                
-                if len(poly.vertices) == 3: # if this is a triangle
-                    tri_data.extend([fv[0], fv[1], fv[2], uv_idx, uv_idx + 1, uv_idx + 2, poly.material_index])
-                else: # Else if this is a quad
-                    quad_data.extend([fv[0], fv[1], fv[2], fv[3], uv_idx, uv_idx + 1, uv_idx + 2, uv_idx + 3, poly.material_index])
+def weld_loop_vertices(loop_vertex_indices, loop_normals, co):
+    '''
+    Collapse the per-loop vertex stream into unique (vertex index, split normal) pairs.
+
+    Returns (vertices, normals, loop_remap): float32 arrays with one row per welded
+    vertex, and an int array mapping each loop index to its welded vertex index.
+    '''
+    num_loops = len(loop_vertex_indices)
+    
+    loop_normals = loop_normals + 0.0 # Turn -0.0 into 0.0 so both compare equal below.
+
+    # Key each loop on its vertex index and the exact bit pattern of its normal.
+    keys = np.empty((num_loops, 4), dtype=np.int32)
+    keys[:, 0] = loop_vertex_indices
+    keys[:, 1:] = loop_normals.view(np.int32)
+
+    _, first_loops, loop_remap = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+
+    vertices = co[loop_vertex_indices[first_loops]]
+    normals = loop_normals[first_loops]
+
+    return (vertices, normals, loop_remap.reshape(-1))
+
+def index_uv_layers(mesh, uv_layers):
+    '''
+    Build an indexed UV section from the per-loop UVs of all layers.
+
+    With UV_LAYOUT_LAYER_VERTEX a single UV index addresses the same entry in every
+    layer, so loops are deduplicated on their UVs across all layers at once.
+
+    Returns (uv_data, loop_uv_indices): a float32 array of UV pairs, layer by layer,
+    and an int array mapping each loop index to its UV index.
+    '''
+    num_loops = len(mesh.loops)
+    num_layers = len(uv_layers)
+
+    loop_uvs = np.empty((num_loops, num_layers * 2), dtype=np.float32)
+    layer_uvs = np.empty(num_loops * 2, dtype=np.float32)
+    for (i, layer_uv) in enumerate(uv_layers):
+        layer_uv.data.foreach_get('uv', layer_uvs)
+        loop_uvs[:, i*2:i*2+2] = layer_uvs.reshape(num_loops, 2)
+    loop_uvs += 0.0 # Turn -0.0 into 0.0 so both compare equal below.
+
+    unique_uvs, loop_uv_indices = np.unique(loop_uvs.view(np.int32), axis=0, return_inverse=True)
+
+    # (num_uvs, layer, 2) -> (layer, num_uvs, 2), i.e. all UVs of layer 0 first.
+    uv_data = unique_uvs.view(np.float32).reshape(len(unique_uvs), num_layers, 2).transpose(1, 0, 2).reshape(-1, 2)
+
+    return (uv_data, loop_uv_indices.reshape(-1))
+
+def find_invalid_faces(data):
+    '''
+    Test the triangles and quads of data for non-finite vertex coordinates, zero
+    area (relative to the longest edge, so the test doesn't depend on scale) and
+    duplicates, i.e. faces using the same vertices in the same order and the same
+    material as an earlier face. Each face is counted once, under the first test it
+    fails.
+    
+    Returns (keep_triangles, keep_quads, num_non_finite, num_degenerate, num_duplicate),
+    where keep_triangles and keep_quads are boolean masks of the valid faces.
+    '''
+    vertices = data.vertices.astype(np.float64)
+    finite_verts = np.isfinite(vertices).all(axis=1)
+    
+    def area_and_edge(a, b, c):
+        # Twice the triangle area, and the squared length of the longest edge.
+        cross = np.cross(b - a, c - a)
+        area = np.sqrt((cross * cross).sum(axis=1))
+        edges = np.stack((((b - a)**2).sum(axis=1), ((c - b)**2).sum(axis=1), ((a - c)**2).sum(axis=1)), axis=1)
+        return (area, edges.max(axis=1))
+    
+    counts = [0, 0, 0]
+    masks = []
+    for (records, corners) in ((data.triangles, 3), (data.quads, 4)):
+        indices = records[:, 0:corners]
+        
+        finite = finite_verts[indices].all(axis=1)
+        
+        with np.errstate(invalid='ignore', over='ignore'):
+            p = [vertices[indices[:, i]] for i in range(corners)]
+            (area, edge) = area_and_edge(p[0], p[1], p[2])
+            if corners == 4:
+                (area2, edge2) = area_and_edge(p[0], p[2], p[3])
+                area = area + area2
+                edge = np.maximum(edge, edge2)
+            degenerate = finite & ~(area > 1e-7 * edge)
+        
+        # Faces are duplicates if they use the same vertices in the same winding order
+        # (from their lowest vertex index on) and the same material; the first of
+        # them is kept. Back-to-back faces, e.g. of two-sided shells, are valid.
+        start = np.argmin(indices, axis=1)
+        rotated = np.take_along_axis(indices, (start[:, np.newaxis] + np.arange(corners)) % corners, axis=1)
+        keys = np.hstack((rotated, records[:, -1:]))
+        valid = finite & ~degenerate
+        duplicate = np.zeros(len(records), dtype=bool)
+        if valid.any():
+            valid_indices = np.nonzero(valid)[0]
+            (_, first) = np.unique(keys[valid], axis=0, return_index=True)
+            duplicate[valid_indices] = True
+            duplicate[valid_indices[first]] = False
+        
+        counts[0] += int((~finite).sum())
+        counts[1] += int(degenerate.sum())
+        counts[2] += int(duplicate.sum())
+        masks.append(finite & ~degenerate & ~duplicate)
+    
+    return (masks[0], masks[1], counts[0], counts[1], counts[2])
+
+def decimate_mesh_data(data, ratio):
+    '''
+    Make a coarse version of data by vertex clustering: vertices are snapped to a
+    uniform grid sized to keep about ratio of them, and averaged per grid cell.
+    Quads are split into triangles, and triangles which collapse are dropped.
+    UV indices are kept as they are, so the UV section is shared with the original.
+
+    Returns a new igmesh_data.
+    '''
+    vertices = data.vertices.astype(np.float64)
+    num_verts = len(vertices)
+
+    tris = np.concatenate((
+        data.triangles,
+        data.quads[:, [0, 1, 2, 4, 5, 6, 8]],
+        data.quads[:, [0, 2, 3, 4, 6, 7, 8]]
+    ))
+
+    result = igmesh_data()
+    result.num_uv_mappings = data.num_uv_mappings
+    result.material_names = data.material_names
+    result.uvs = data.uvs
+    result.quads = np.zeros((0, 9), dtype=np.int32)
+
+    target = max(4, int(num_verts * ratio))
+    if num_verts <= target:
+        result.vertices = data.vertices
+        result.normals = data.normals
+        result.triangles = tris
+        return result
+
+    lo = vertices.min(axis=0)
+    extent = vertices.max(axis=0) - lo
+    diagonal = max(np.sqrt((extent * extent).sum()), 1e-30)
+
+    # Most meshes are surfaces, so the number of occupied cells grows with the square of
+    # the grid resolution. Start from that guess and correct the cell size a few times.
+    cell = diagonal / np.sqrt(target)
+    for i in range(6):
+        cells = np.floor((vertices - lo) / cell).astype(np.int64)
+        _, cluster = np.unique(cells, axis=0, return_inverse=True)
+        cluster = cluster.reshape(-1)
+        num_clusters = cluster.max() + 1
+        if abs(num_clusters - target) <= target * 0.1:
+            break
+        cell *= np.sqrt(num_clusters / target)
+
+    counts = np.bincount(cluster, minlength=num_clusters).astype(np.float64)
+    clustered = np.empty((num_clusters, 3), dtype=np.float64)
+    for k in range(3):
+        clustered[:, k] = np.bincount(cluster, weights=vertices[:, k], minlength=num_clusters) / counts
+    result.vertices = clustered.astype(np.float32)
+
+    if len(data.normals) > 0:
+        normals = np.empty((num_clusters, 3), dtype=np.float64)
+        for k in range(3):
+            normals[:, k] = np.bincount(cluster, weights=data.normals[:, k], minlength=num_clusters)
+        lengths = np.sqrt((normals * normals).sum(axis=1))
+        lengths[lengths == 0.0] = 1.0
+        result.normals = (normals / lengths[:, np.newaxis]).astype(np.float32)
     else:
-        if use_loops:
-            for poly in mesh.polygons:
-                fv = poly.loop_indices
-                if len(poly.vertices) == 3: # if this is a triangle
-                    tri_data.extend([fv[0], fv[1], fv[2], 0, 0, 0, poly.material_index])
-                else: # Else if this is a quad
-                    quad_data.extend([fv[0], fv[1], fv[2], fv[3], 0, 0, 0, 0, poly.material_index])
+        result.normals = data.normals
+
+    tris = tris.copy()
+    tris[:, 0:3] = cluster[tris[:, 0:3]]
+
+    # Drop triangles which collapsed to a line or a point, and duplicates of the same
+    # cluster triangle with the same material.
+    keep = (tris[:, 0] != tris[:, 1]) & (tris[:, 1] != tris[:, 2]) & (tris[:, 2] != tris[:, 0])
+    tris = tris[keep]
+
+    keys = np.sort(tris[:, 0:3], axis=1)
+    keys = np.concatenate((keys, tris[:, 6:7]), axis=1)
+    _, first = np.unique(keys, axis=0, return_index=True)
+    result.triangles = tris[np.sort(first)]
+
+    return result
+
+def decimate_lod_data(data, lod_ratio, lod_level):
+    '''
+    Decimate data for a level of detail, keeping lod_ratio ** lod_level of its vertices.
+    Clustering can collapse small or flat meshes completely; the next finer level is
+    used then, down to the full mesh (level 0, which keeps all triangles).
+
+    Returns (data, level), level being the level actually used.
+    '''
+    level = lod_level
+    decimated = decimate_mesh_data(data, lod_ratio ** level)
+    while len(decimated.triangles) == 0 and level > 0:
+        level -= 1
+        decimated = decimate_mesh_data(data, lod_ratio ** level)
+    return (decimated, level)
+
+def morton_codes(points, lo, extent):
+    '''
+    63 bit Morton (Z-order) codes of points inside the box lo, lo + extent, with
+    21 bits per axis.
+    '''
+    scale = (2**21 - 1) / np.maximum(extent, 1e-30)
+    q = np.clip((points - lo) * scale, 0, 2**21 - 1).astype(np.uint64)
+
+    codes = np.zeros(len(points), dtype=np.uint64)
+    for axis in range(3):
+        # Spread the bits of x out so there are two zero bits between each of them.
+        x = q[:, axis]
+        x = (x | (x << np.uint64(32))) & np.uint64(0x1f00000000ffff)
+        x = (x | (x << np.uint64(16))) & np.uint64(0x1f0000ff0000ff)
+        x = (x | (x << np.uint64(8))) & np.uint64(0x100f00f00f00f00f)
+        x = (x | (x << np.uint64(4))) & np.uint64(0x10c30c30c30c30c3)
+        x = (x | (x << np.uint64(2))) & np.uint64(0x1249249249249249)
+        codes |= x << np.uint64(axis)
+    return codes
+
+def spatial_reorder_mesh_data(data):
+    '''
+    Reorder the triangles and quads of data along a Morton curve through their
+    centroids, and renumber the vertices in order of first use, so that elements
+    close in space are close in the file. Geometry, UVs and materials are unchanged.
+    Vertices which no element uses are kept, after the used ones.
+
+    Returns a new igmesh_data.
+    '''
+    result = igmesh_data()
+    result.num_uv_mappings = data.num_uv_mappings
+    result.material_names = data.material_names
+    result.uvs = data.uvs
+
+    num_verts = len(data.vertices)
+    if num_verts == 0 or len(data.triangles) + len(data.quads) == 0:
+        result.vertices = data.vertices
+        result.normals = data.normals
+        result.triangles = data.triangles
+        result.quads = data.quads
+        return result
+
+    vertices = data.vertices.astype(np.float64)
+    lo = vertices.min(axis=0)
+    extent = vertices.max(axis=0) - lo
+
+    def sort_records(records, corners):
+        if len(records) == 0:
+            return records
+        centroids = vertices[records[:, 0:corners]].mean(axis=1)
+        order = np.argsort(morton_codes(centroids, lo, extent), kind='stable')
+        return records[order]
+
+    triangles = sort_records(data.triangles, 3)
+    quads = sort_records(data.quads, 4)
+
+    # Vertex indices in the order the elements use them; np.unique gives the first use of each.
+    used = np.concatenate((triangles[:, 0:3].reshape(-1), quads[:, 0:4].reshape(-1)))
+    (unique_used, first_use) = np.unique(used, return_index=True)
+    old_indices = unique_used[np.argsort(first_use)]
+    unused = np.setdiff1d(np.arange(num_verts), old_indices)
+    old_indices = np.concatenate((old_indices, unused))
+
+    new_indices = np.empty(num_verts, dtype=np.int32)
+    new_indices[old_indices] = np.arange(num_verts, dtype=np.int32)
+
+    result.vertices = data.vertices[old_indices]
+    result.normals = data.normals[old_indices] if len(data.normals) > 0 else data.normals
+
+    result.triangles = triangles.copy()
+    result.triangles[:, 0:3] = new_indices[triangles[:, 0:3]]
+    result.quads = quads.copy()
+    result.quads[:, 0:4] = new_indices[quads[:, 0:4]]
+
+    return result
+
+def canonical_frame(co):
+    '''
+    Pose-invariant frame of a set of vertex positions: the centroid and the principal
+    axes, ordered by decreasing variance. The sign of each axis is chosen so that
+    the third moment of the positions along it (the sum of cubed projections) is
+    positive. The third axis is the cross product of the first two, so the frame is
+    a rigid transform. When principal axes are not well defined (e.g. for cubes and
+    cylinders) only the centroid is used.
+
+    The frame is only the same for copies of a mesh if its shape is asymmetric
+    enough; symmetric meshes (boxes, plates) have third moments of zero and an
+    arbitrary sign. Copies are matched with rigid_alignment() in that case.
+
+    Returns (center, rotation): positions in the frame are (co - center) @ rotation.
+    '''
+    co = co.astype(np.float64)
+    center = co.mean(axis=0)
+    d = co - center
+
+    (w, v) = np.linalg.eigh(d.T @ d / len(co))
+    w = w[::-1]
+    v = v[:, ::-1]
+
+    if w[0] <= 0.0 or (w[0] - w[1]) < 1e-4 * w[0] or (w[1] - w[2]) < 1e-4 * w[0]:
+        return (center, np.identity(3))
+
+    axes = []
+    for i in range(2):
+        axis = v[:, i]
+        proj = d @ axis
+        moment = (proj ** 3).sum()
+        if abs(moment) > 1e-6 * (np.abs(proj) ** 3).sum():
+            flip = moment < 0.0
         else:
-            for poly in mesh.polygons:
-                fv = poly.vertices
-                if len(poly.vertices) == 3: # if this is a triangle
-                    tri_data.extend([fv[0], fv[1], fv[2], 0, 0, 0, poly.material_index])
-                else: # Else if this is a quad
-                    quad_data.extend([fv[0], fv[1], fv[2], fv[3], 0, 0, 0, 0, poly.material_index])
\ No newline at end of file
+            # Symmetric along this axis: make the first vertex off the plane through the centroid positive.
+            off_plane = np.nonzero(np.abs(proj) > 1e-6 * np.abs(proj).max())[0]
+            flip = len(off_plane) > 0 and proj[off_plane[0]] < 0.0
+        axes.append(-axis if flip else axis)
+    axes.append(np.cross(axes[0], axes[1]))
+
+    return (center, np.stack(axes, axis=1))
+
+def rigid_alignment(d, target):
+    '''
+    Rotation which best maps positions d onto target, vertex by vertex (Kabsch):
+    d @ rotation is as close to target as possible. Both must be centered. Never
+    a reflection, so the result is a rigid transform.
+
+    Returns (rotation, largest distance of a vertex to its target).
+    '''
+    (u, s, vt) = np.linalg.svd(d.T @ target)
+    correction = np.identity(3)
+    correction[2, 2] = np.sign(np.linalg.det(u @ vt)) or 1.0
+    rotation = u @ correction @ vt
+    error = np.abs(d @ rotation - target).max()
+    return (rotation, error)
+
+def shape_signature(co, center):
+    '''
+    Rigid transform invariant summary of a set of vertex positions around center:
+    the variances along the principal axes and the mean distance to the center,
+    quantized so that copies differing by rounding errors almost always get the same
+    string. Meshes with different signatures can't be rigid copies of each other.
+    '''
+    d = co.astype(np.float64) - center
+    w = np.linalg.eigvalsh(d.T @ d / len(co))[::-1]
+    if w[0] <= 0.0:
+        return '0'
+    # Relative to the largest variance, so that thin meshes don't quantize their small variances at random.
+    scale = float(w[0])
+    mean_distance = float(np.linalg.norm(d, axis=1).mean()) / np.sqrt(scale)
+    values = (np.log2(scale), w[1] / scale, w[2] / scale, mean_distance)
+    # The steps are offset, as simple shapes have ratios like 1/4 or 1/16 which would lie right on a step.
+    return '|'.join('%i' % np.floor(v * 1000.0 + 0.381966) for v in values)
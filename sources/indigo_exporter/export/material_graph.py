@@ -0,0 +1,75 @@
+import bpy
+
+from .. export import indigo_log
+
+class MaterialGraph(object):
+    '''
+    Builds materials together with the materials they are made of (blend, coating
+    and double-sided thin materials refer to other materials by name, see
+    Indigo_Material_Properties.dependencies()).
+
+    Each material is built once, the first time it is used, and stored in
+    compiled under its name. A material is always stored after the materials it
+    depends on, so writing compiled in order gives a valid scene. A material
+    which depends on itself, directly or through others, raises an Exception
+    naming the cycle.
+
+    Example usage:
+    graph = MaterialGraph(exported_materials)
+    graph.compile(obj, blender_material, scene, texture_budget)
+    '''
+
+    def __init__(self, compiled):
+        self.compiled = compiled # Map from material name to list of xml elements, in topological order
+        self.dependencies = {} # Map from material name to the names of the materials it depends on
+        self.num_shared = 0 # Number of times a material was used again as a dependency
+
+    def compile(self, obj, mat, scene, texture_budget=None):
+        # Depth first, with the materials being built on the stack to detect cycles.
+        stack = []
+        self.visit(obj, mat, scene, texture_budget, stack)
+
+    def visit(self, obj, mat, scene, texture_budget, stack):
+        if mat.name in self.compiled:
+            if len(stack) > 0:
+                self.num_shared += 1
+            return
+
+        if mat.name in stack:
+            cycle = stack[stack.index(mat.name):] + [mat.name]
+            raise Exception('Material "%s" refers to itself: %s' % (mat.name, ' -> '.join(cycle)))
+
+        self.dependencies[mat.name] = mat.indigo_material.dependencies()
+
+        stack.append(mat.name)
+        for name in self.dependencies[mat.name]:
+            self.visit(obj, bpy.data.materials[name], scene, texture_budget, stack)
+        stack.pop()
+
+        self.compiled[mat.name] = mat.indigo_material.factory(obj, mat, scene, texture_budget)
+
+    def sort(self):
+        '''
+        Reorder compiled so that it doesn't depend on the order materials were used
+        in: by name, except that materials still come after their dependencies.
+        '''
+        ordered = []
+        placed = set()
+
+        def place(name):
+            if name in placed: return
+            placed.add(name)
+            for dependency in self.dependencies.get(name, []):
+                place(dependency)
+            ordered.append(name)
+
+        for name in sorted(self.compiled.keys()):
+            place(name)
+
+        items = [(name, self.compiled[name]) for name in ordered]
+        self.compiled.clear()
+        self.compiled.update(items)
+
+    def log_stats(self):
+        if self.num_shared > 0:
+            indigo_log('Material graph: %i materials, %i shared uses of already built materials' % (len(self.compiled), self.num_shared))
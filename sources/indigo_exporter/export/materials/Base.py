@@ -6,13 +6,16 @@ from ...extensions_framework import util as efutil
 
 from .. import xml_builder, xml_cdata
 from .. materials.spectra import blackbody, rgb, uniform
+from .. texture_budget import budget_texture_path
 
 class MaterialBase(xml_builder):
     
     scene = None
+    texture_budget = None # Optional TextureBudget, see budget_texture_path()
     
-    def build_xml_element(self, context, scene=None):
+    def build_xml_element(self, context, scene=None, texture_budget=None):
         if scene: self.scene = scene
+        self.texture_budget = texture_budget
         xml = self.Element('material')
         self.build_subelements(context, self.get_format(), xml)
         return xml
@@ -97,7 +100,7 @@ class MaterialBase(xml_builder):
                     
                     if tex_property_group.image_ref == 'file':
                         relative_texture_path = efutil.path_relative_to_export(
-                            getattr(tex_property_group, 'path')
+                            budget_texture_path(self.texture_budget, efutil.filesystem_path(getattr(tex_property_group, 'path')), self.material_name)
                         )
                     elif tex_property_group.image_ref == 'blender':
                         if not tex_property_group.image in bpy.data.images:
@@ -122,7 +125,9 @@ class MaterialBase(xml_builder):
                             )
                             img.save_render(bl_img_path, scene=self.scene)
                         
-                        relative_texture_path = efutil.path_relative_to_export(bl_img_path)
+                        relative_texture_path = efutil.path_relative_to_export(
+                            budget_texture_path(self.texture_budget, efutil.filesystem_path(bl_img_path), self.material_name)
+                        )
                     
                     if not getattr(property_group, channel_prop_name + '_TX_abc_from_tex'):
                         abc_property_group = property_group
@@ -0,0 +1,444 @@
+'''
+Mesh files shared by several exporters, e.g. Blender processes exporting the frames
+of an animation into the same mesh directory.
+
+Mesh files are named by the hash of their content, so two exporters writing the
+same name write the same data. Writers never write the final path directly: they
+write a temporary file in the same directory and publish it with an atomic rename
+(see publishing()), so a file at the final path is always complete. A writer first
+claims the path with a lock file (see MeshCache.claim()); an exporter which finds
+the path claimed by another one leaves the writing to it and waits for the file
+before the scene is rendered (see MeshCache.wait()).
+
+Lock files are <path>.lock and hold the host and process id of their owner. A lock
+whose owner is no longer running, or which is older than MeshCache.stale_time,
+is broken.
+
+As every edit of a mesh gives it a new name, old mesh files are never overwritten.
+Each export touches the files it refers to, and collect_garbage() evicts the least
+recently referenced ones. While an export runs, it holds an export lock in the mesh
+directory (see MeshCache.begin()), and collect_garbage() evicts nothing while
+another export holds one: that export may have decided to reuse a mesh file
+without having written the scene referring to it yet.
+'''
+
+import os, socket, tempfile, time
+import xml.etree.cElementTree as ET
+from contextlib import contextmanager
+
+from .. export import indigo_log, ExportCancelledException
+
+OWNER = '%s %i' % (socket.gethostname(), os.getpid())
+
+def process_alive(pid):
+    '''
+    Returns False if no process with id pid runs on this host.
+    '''
+    if os.name == 'nt':
+        # os.kill() terminates the process on Windows, whatever the signal.
+        import ctypes
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        STILL_ACTIVE = 259
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            # Access denied means the process exists.
+            return ctypes.get_last_error() == 5 # ERROR_ACCESS_DENIED
+        try:
+            exit_code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+                return True
+            return exit_code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass # E.g. owned by another user
+    return True
+
+def lock_path(path):
+    return path + '.lock'
+
+def is_published(path):
+    # Only published files exist at their final path.
+    return os.path.isfile(path)
+
+def read_lock(path):
+    '''
+    Returns the owner written in the lock of path, or None if path is not locked.
+    '''
+    try:
+        with open(lock_path(path), 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+    except OSError:
+        return ''
+
+def release_lock(path):
+    '''
+    Remove the lock of path if this process owns it.
+    '''
+    if read_lock(path) == OWNER:
+        try:
+            os.remove(lock_path(path))
+        except FileNotFoundError:
+            pass
+
+@contextmanager
+def publishing(path):
+    '''
+    Open a temporary file for writing, and publish it at path if the block
+    finishes without an exception. The lock of path is released either way.
+
+    Example usage:
+    with publishing('/path/to/mesh.igmesh') as f:
+        f.write(data)
+    '''
+    (fd, temp_path) = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        # mkstemp creates the file readable by its owner only; other exporters and Indigo need to read it too.
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+    finally:
+        release_lock(path)
+
+def publish_buffers(path, buffers):
+    with publishing(path) as f:
+        for b in buffers:
+            f.write(b)
+
+class MeshCache(object):
+    '''
+    Coordinates the mesh files written by one export with other exporters.
+
+    Example usage:
+    cache = MeshCache()
+    cache.begin(mesh_dir)
+    if not cache.reuse(path) and cache.claim(path):
+        with publishing(path) as f:
+            ...
+    cache.wait()          # Files claimed by other exporters are published now
+    cache.release_all()   # In a finally block, for claims which were never written
+    '''
+
+    stale_time = 3600 # Seconds after which a lock is broken even if its owner still runs
+    poll_interval = 0.2
+    refresh_interval = 60 # Seconds between updates of the time of the export lock
+
+    def __init__(self):
+        self.claimed = set() # Paths this exporter claimed
+        self.waiting = set() # Paths claimed by other exporters, which this export refers to
+        self.reused = set() # Published paths this export refers to without writing them
+        self.export_lock = None # See begin()
+        self.export_lock_time = 0.0
+
+        # Stats
+        self.num_shared = 0
+
+    def owner_alive(self, owner):
+        try:
+            (host, pid) = owner.rsplit(' ', 1)
+            pid = int(pid)
+        except ValueError:
+            return False
+        if host != socket.gethostname():
+            return True # Can't tell, rely on stale_time
+        return process_alive(pid)
+
+    def is_stale(self, path):
+        owner = read_lock(path)
+        if owner is None:
+            return False
+        try:
+            age = time.time() - os.path.getmtime(lock_path(path))
+        except FileNotFoundError:
+            return False
+        return age > self.stale_time or (owner != '' and not self.owner_alive(owner))
+
+    def begin(self, mesh_dir):
+        '''
+        Hold the export lock of this exporter in mesh_dir until release_all().
+        '''
+        self.export_lock = os.path.join(mesh_dir, export_lock_name(OWNER))
+        with open(lock_path(self.export_lock), 'w') as f:
+            f.write(OWNER)
+        self.export_lock_time = time.time()
+
+    def refresh(self):
+        # Locks older than stale_time are broken, so a long export updates the time of its lock.
+        if self.export_lock is not None and time.time() - self.export_lock_time > self.refresh_interval:
+            try:
+                os.utime(lock_path(self.export_lock), None)
+            except OSError:
+                pass
+            self.export_lock_time = time.time()
+
+    def reuse(self, path):
+        '''
+        Returns True if path is published already, in which case this export refers
+        to it without writing it. See wait().
+        '''
+        self.refresh()
+        if is_published(path):
+            self.reused.add(path)
+            return True
+        return False
+
+    def claim(self, path):
+        '''
+        Try to become the writer of path. Returns True if this exporter has to write
+        it (and then must publish it with publishing()), False if another exporter
+        is writing it already.
+        '''
+        self.refresh()
+        for attempt in range(2):
+            try:
+                fd = os.open(lock_path(path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if read_lock(path) == OWNER:
+                    return True
+                if attempt == 0 and self.is_stale(path):
+                    indigo_log('Breaking stale mesh lock %s (%s)' % (lock_path(path), read_lock(path)), message_type='WARNING')
+                    try:
+                        os.remove(lock_path(path))
+                    except FileNotFoundError:
+                        pass
+                    continue
+                self.waiting.add(path)
+                self.num_shared += 1
+                return False
+            with os.fdopen(fd, 'w') as f:
+                f.write(OWNER)
+            self.claimed.add(path)
+            return True
+        return False
+
+    def wait(self, should_abort=None):
+        '''
+        Wait until the files claimed by other exporters are published. Raises an
+        exception if one of them gave up without publishing its file, if a reused
+        file was deleted meanwhile, or if the optional should_abort() becomes true.
+        '''
+        self.refresh()
+        for path in sorted(self.waiting):
+            self.wait_for(path, should_abort)
+        self.waiting.clear()
+
+        # Only an export which started before this one could have deleted a reused file.
+        for path in sorted(self.reused):
+            if not is_published(path):
+                raise Exception('Mesh %s was deleted by a mesh cache cleanup during the export' % path)
+        self.reused.clear()
+
+    def wait_for(self, path, should_abort=None):
+        '''
+        Wait until path, claimed by another exporter, is published. See wait().
+        '''
+        while not is_published(path):
+            if should_abort is not None and should_abort():
+                raise ExportCancelledException('Export cancelled while waiting for %s' % path)
+            if read_lock(path) is None or self.is_stale(path):
+                # Check once more, the file is published before the lock is removed.
+                if is_published(path):
+                    break
+                raise Exception('Mesh %s was claimed by another exporter which stopped without writing it' % path)
+            time.sleep(self.poll_interval)
+        self.waiting.discard(path)
+
+    def release_all(self):
+        for path in self.claimed:
+            release_lock(path)
+        self.claimed.clear()
+        if self.export_lock is not None:
+            release_lock(self.export_lock)
+            self.export_lock = None
+
+def export_lock_name(owner):
+    return 'export.%s' % owner.replace(' ', '.')
+
+def other_exports(mesh_dir):
+    '''
+    Returns the owners of the export locks in mesh_dir which are held by other
+    exporters which still run.
+    '''
+    cache = MeshCache()
+    owners = []
+    for f in sorted(os.listdir(mesh_dir)):
+        if not (f.startswith('export.') and f.endswith('.lock')):
+            continue
+        path = os.path.join(mesh_dir, f[:-len('.lock')])
+        owner = read_lock(path)
+        if owner is None or owner == OWNER or cache.is_stale(path):
+            continue
+        owners.append(owner)
+    return owners
+
+def touch(paths, mesh_dir):
+    '''
+    Record that paths were referenced by an export now. The modification time of a
+    mesh file is its last reference time, see collect_garbage().
+
+    Only files in mesh_dir are touched: the others, e.g. OBJ proxies, belong to
+    the user, and tools like make, rsync or backups rely on their times.
+    '''
+    mesh_dir = os.path.join(os.path.normpath(mesh_dir), '')
+    for path in paths:
+        if not os.path.normpath(path).startswith(mesh_dir):
+            continue
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass # Deleted meanwhile, or read-only; the file is kept by this export anyway
+
+def scene_files(mesh_dir):
+    '''
+    Yields the scene files which may refer to files in mesh_dir: the .igs of each
+    exported frame, in the export directory (the parent of mesh_dir), and the
+    files they include (objects.igs) in mesh_dir.
+    '''
+    export_dir = os.path.dirname(os.path.normpath(mesh_dir))
+    for f in sorted(os.listdir(export_dir)):
+        if f.lower().endswith('.igs') and os.path.isfile(os.path.join(export_dir, f)):
+            yield os.path.join(export_dir, f)
+    for (dir_path, dir_names, file_names) in os.walk(mesh_dir):
+        for f in file_names:
+            if f.lower().endswith('.igs'):
+                yield os.path.join(dir_path, f)
+
+# Map from scene file path to ((modification time, size), referenced paths), so that
+# an animation export doesn't parse the scenes of all earlier frames again at each frame.
+SCENE_REFERENCES = {}
+
+def scene_references(filename, export_dir):
+    '''
+    Returns the real paths referenced by the <path> elements of a scene file, or
+    an empty set if it can't be parsed.
+    '''
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return set()
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = SCENE_REFERENCES.get(filename)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    paths = set()
+    try:
+        root = ET.parse(filename).getroot()
+    except (ET.ParseError, OSError):
+        return paths # Being written by an export right now, so not cached
+    for el in root.iter('path'):
+        if el.text and el.text.strip():
+            paths.add(os.path.normpath(os.path.join(export_dir, el.text.strip())))
+    SCENE_REFERENCES[filename] = (version, paths)
+    return paths
+
+def referenced_by_scenes(mesh_dir):
+    '''
+    Returns the real paths of the files referenced by the scene files of the
+    exported frames, see scene_files(). Relative paths in them are relative to
+    the export directory, the parent of mesh_dir.
+    '''
+    export_dir = os.path.dirname(os.path.normpath(mesh_dir))
+    paths = set()
+    for filename in scene_files(mesh_dir):
+        paths |= scene_references(filename, export_dir)
+    return paths
+
+class GarbageCollection(object):
+    '''
+    Result of collect_garbage(): the files kept and the files evicted (or which
+    would be evicted, in a dry run), as lists of (path, size, last reference time).
+    '''
+
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.kept = []
+        self.evicted = []
+        self.other_exports = [] # Owners of the export locks which kept all files
+
+    def report(self):
+        '''
+        Returns the report as a list of lines.
+        '''
+        kept_bytes = sum(size for (path, size, mtime) in self.kept)
+        evicted_bytes = sum(size for (path, size, mtime) in self.evicted)
+        lines = ['Mesh cache: %s %i files (%.1f MB), keeping %i files (%.1f MB)' % (
+            'would evict' if self.dry_run else 'evicted', len(self.evicted), evicted_bytes / 1048576.0, len(self.kept), kept_bytes / 1048576.0)]
+        if len(self.other_exports) > 0:
+            lines.append('Mesh cache: nothing evicted while other exports run (%s)' % ', '.join(self.other_exports))
+        now = time.time()
+        for (path, size, mtime) in self.evicted:
+            lines.append('Mesh cache: %s: %.1f MB, last used %.1f days ago' % (os.path.basename(path), size / 1048576.0, (now - mtime) / 86400.0))
+        return lines
+
+def collect_garbage(mesh_dir, max_bytes=0, max_age=0, keep=(), dry_run=True):
+    '''
+    Evict mesh files from mesh_dir (and its subdirectories, e.g. converted proxies),
+    least recently referenced first: all files not referenced for more than max_age
+    seconds, then more until the rest fit in max_bytes. 0 means no limit.
+
+    Files in keep (e.g. the meshes of the current export) and files being written
+    by an exporter are never evicted, nor is any mesh file while another export
+    holds its export lock. Temporary files left by interrupted writes are evicted
+    once they are older than MeshCache.stale_time.
+    '''
+    result = GarbageCollection(dry_run)
+    result.other_exports = other_exports(mesh_dir)
+    now = time.time()
+    keep = set(os.path.normpath(p) for p in keep)
+
+    candidates = []
+    for (dir_path, dir_names, file_names) in os.walk(mesh_dir):
+        for f in file_names:
+            path = os.path.normpath(os.path.join(dir_path, f))
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entry = (path, stat.st_size, stat.st_mtime)
+
+            if f.endswith('.tmp'):
+                if now - stat.st_mtime > MeshCache.stale_time:
+                    result.evicted.append(entry)
+                continue
+
+            if not f.lower().endswith('.igmesh'):
+                continue
+
+            if path in keep or read_lock(path) is not None or len(result.other_exports) > 0:
+                result.kept.append(entry)
+            else:
+                candidates.append(entry)
+
+    # Most recently referenced first, so the files beyond the budget are the least recently used.
+    candidates.sort(key=lambda e: e[2], reverse=True)
+    total = sum(size for (path, size, mtime) in result.kept)
+    over_budget = False
+    for entry in candidates:
+        (path, size, mtime) = entry
+        over_budget = over_budget or (max_bytes > 0 and total + size > max_bytes)
+        if over_budget or (max_age > 0 and now - mtime > max_age):
+            result.evicted.append(entry)
+        else:
+            result.kept.append(entry)
+            total += size
+
+    if not dry_run:
+        for (path, size, mtime) in result.evicted:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    return result
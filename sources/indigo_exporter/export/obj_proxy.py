@@ -0,0 +1,282 @@
+import os
+import hashlib
+
+import numpy as np
+
+from .. export import indigo_log, InvalidGeometryException
+from .. export.igmesh import write_uint32, write_string, write_vec_array, scratch_buffers, read_igmesh_materials
+from .. export.mesh_cache import MeshCache, publishing
+
+class obj_proxy_converter(object):
+    '''
+    Converts OBJ proxy meshes to .igmesh files, so that Indigo doesn't have to
+    parse the OBJ text on every render.
+
+    The OBJ file is read twice, line by line: once to count the elements of each
+    section, and once to fill disk backed buffers (see scratch_buffers), so memory
+    use doesn't grow with the size of the file. Polygons with more than four
+    corners are fan triangulated.
+
+    OBJ normals are per corner and igmesh normals are per vertex, so a vertex is
+    split for each distinct normal its corners use. The split needs the corners
+    of all faces in memory at once. When only some corners have normals, none are
+    converted and Indigo computes smooth normals.
+
+    Converted files are named after the OBJ path, size and modification time, so
+    a file is converted again only when it changes. They are claimed and
+    published through a MeshCache, like exported meshes, so several exporters
+    sharing the cache directory convert each file once.
+
+    Example usage:
+    converter = obj_proxy_converter('/path/to/cache', mesh_cache)
+    (igmesh_path, material_names) = converter.convert('/path/to/proxy.obj')
+    '''
+
+    # Number of elements per block written to the scratch buffers.
+    block_size = 65536
+
+    def __init__(self, cache_dir, mesh_cache=None):
+        self.cache_dir = cache_dir
+        self.mesh_cache = mesh_cache if mesh_cache is not None else MeshCache()
+
+    def cache_path(self, obj_path):
+        stat = os.stat(obj_path)
+        key = hashlib.sha224(('%s|%i|%i' % (os.path.abspath(obj_path), stat.st_size, stat.st_mtime_ns)).encode(encoding='UTF-8'))
+        return os.path.join(self.cache_dir, 'proxy_%s.igmesh' % key.hexdigest())
+
+    def convert(self, obj_path):
+        '''
+        Returns (igmesh_path, material_names) for the OBJ file, converting it if
+        there is no up to date converted file.
+        '''
+        igmesh_path = self.cache_path(obj_path)
+
+        if not self.mesh_cache.reuse(igmesh_path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+            if self.mesh_cache.claim(igmesh_path):
+                with publishing(igmesh_path) as file:
+                    self.write_igmesh(obj_path, file)
+                indigo_log('Converted OBJ proxy %s to %s' % (obj_path, igmesh_path))
+            else:
+                # The material names are needed now, so wait for the other exporter.
+                self.mesh_cache.wait_for(igmesh_path)
+
+        return (igmesh_path, read_igmesh_materials(igmesh_path))
+
+    @staticmethod
+    def face_corners(tokens, num_verts, num_uvs, num_normals):
+        # Each corner is v, v/vt, v//vn or v/vt/vn; indices are 1-based, negative ones count from the end.
+        # Returns (v, vt, vn) per corner, with vn = -1 for corners without a normal.
+        corners = []
+        for t in tokens:
+            parts = t.split('/')
+            v = int(parts[0])
+            v = v - 1 if v > 0 else num_verts + v
+            if len(parts) > 1 and parts[1] != '':
+                vt = int(parts[1])
+                vt = vt - 1 if vt > 0 else num_uvs + vt
+            else:
+                vt = 0
+            if len(parts) > 2 and parts[2] != '':
+                vn = int(parts[2])
+                vn = vn - 1 if vn > 0 else num_normals + vn
+            else:
+                vn = -1
+            corners.append((v, vt, vn))
+        return corners
+
+    def count(self, obj_path):
+        num_verts = 0
+        num_uvs = 0
+        num_normals = 0
+        num_tris = 0
+        num_quads = 0
+        material_names = []
+
+        with open(obj_path, 'r', errors='replace') as f:
+            for line in f:
+                if line.startswith('v '):
+                    num_verts += 1
+                elif line.startswith('vt '):
+                    num_uvs += 1
+                elif line.startswith('vn '):
+                    num_normals += 1
+                elif line.startswith('f '):
+                    n = len(line.split()) - 1
+                    if n == 4:
+                        num_quads += 1
+                    elif n >= 3:
+                        num_tris += n - 2
+                elif line.startswith('usemtl '):
+                    name = line[7:].strip()
+                    if name not in material_names:
+                        material_names.append(name)
+
+        return (num_verts, num_uvs, num_normals, num_tris, num_quads, material_names)
+
+    def write_igmesh(self, obj_path, file):
+        (num_verts, num_uvs, num_normals, num_tris, num_quads, material_names) = self.count(obj_path)
+
+        if num_verts == 0 or num_tris + num_quads == 0:
+            raise InvalidGeometryException('OBJ proxy %s has no faces' % obj_path)
+
+        if len(material_names) == 0:
+            material_names = ['blendigo_clay']
+
+        # Always export at least one UV set, like the mesh writer does.
+        dummy_uvs = num_uvs == 0
+        if dummy_uvs:
+            num_uvs = 1
+
+        with scratch_buffers(self.cache_dir) as scratch:
+            vertices = scratch.new(num_verts * 3, np.float32).reshape(-1, 3)
+            uvs = scratch.new(num_uvs * 2, np.float32).reshape(-1, 2)
+            tris = scratch.new(num_tris * 7, np.int32).reshape(-1, 7)
+            quads = scratch.new(num_quads * 9, np.int32).reshape(-1, 9)
+            # The normal index of each face corner, next to the vertex indices in tris and quads.
+            normals = scratch.new(num_normals * 3, np.float32).reshape(-1, 3)
+            tri_normals = scratch.new(num_tris * 3 if num_normals > 0 else 0, np.int32).reshape(-1, 3)
+            quad_normals = scratch.new(num_quads * 4 if num_normals > 0 else 0, np.int32).reshape(-1, 4)
+
+            if dummy_uvs:
+                uvs[0] = (0.0, 0.0)
+
+            self.fill(obj_path, material_names, vertices, uvs, normals, tris, quads, tri_normals, quad_normals, dummy_uvs)
+
+            vertex_normals = np.zeros((0, 3), dtype=np.float32)
+            if num_normals > 0:
+                if min(tri_normals.min(initial=0), quad_normals.min(initial=0)) < 0:
+                    indigo_log('Some faces of OBJ proxy %s have no normals, so none are converted; Indigo will compute smooth normals instead' % obj_path, message_type='WARNING')
+                else:
+                    (vertices, vertex_normals) = self.split_vertices(vertices, normals, tris, quads, tri_normals, quad_normals)
+
+            # Write magic number, format version and number of UV mappings
+            write_uint32(file, 5456751)
+            write_uint32(file, 3)
+            write_uint32(file, 1)
+
+            write_uint32(file, len(material_names))
+            for name in material_names:
+                write_string(file, name)
+
+            # No UV set expositions
+            write_uint32(file, 0)
+
+            write_vec_array(file, vertices)
+            write_vec_array(file, vertex_normals)
+
+            write_uint32(file, 1) # UV layout
+            write_vec_array(file, uvs)
+
+            write_vec_array(file, tris, dtype=np.int32)
+            write_vec_array(file, quads, dtype=np.int32)
+
+    @staticmethod
+    def split_vertices(vertices, normals, tris, quads, tri_normals, quad_normals):
+        '''
+        Make one vertex per distinct (vertex, normal) pair of the face corners, and
+        point the vertex columns of tris and quads at them. Vertices no face uses
+        are dropped. Returns (vertices, vertex_normals).
+        '''
+        num_tri_corners = len(tris) * 3
+        keys = np.empty(num_tri_corners + len(quads) * 4, dtype=np.int64)
+        keys[:num_tri_corners] = tris[:, :3].reshape(-1).astype(np.int64) * len(normals) + tri_normals.reshape(-1)
+        keys[num_tri_corners:] = quads[:, :4].reshape(-1).astype(np.int64) * len(normals) + quad_normals.reshape(-1)
+
+        (pairs, corner_vertices) = np.unique(keys, return_inverse=True)
+        del keys
+        corner_vertices = corner_vertices.reshape(-1).astype(np.int32)
+        tris[:, :3] = corner_vertices[:num_tri_corners].reshape(-1, 3)
+        quads[:, :4] = corner_vertices[num_tri_corners:].reshape(-1, 4)
+
+        vertex_normals = normals[pairs % len(normals)]
+        lengths = np.linalg.norm(vertex_normals, axis=1, keepdims=True)
+        vertex_normals = (vertex_normals / np.where(lengths > 0.0, lengths, 1.0)).astype(np.float32)
+
+        return (vertices[pairs // len(normals)], vertex_normals)
+
+    def fill(self, obj_path, material_names, vertices, uvs, normals, tris, quads, tri_normals, quad_normals, dummy_uvs):
+        num_verts = 0
+        num_uvs = 0
+        num_normals = 0
+        num_tris = 0
+        num_quads = 0
+        mat_index = 0
+        material_indices = {name: i for (i, name) in enumerate(material_names)}
+
+        # Rows are collected in lists and copied to the scratch buffers a block at a time.
+        vert_block = []
+        uv_block = []
+        normal_block = []
+        tri_block = []
+        quad_block = []
+        tri_normal_block = []
+        quad_normal_block = []
+        keep_normals = len(tri_normals) + len(quad_normals) > 0
+
+        def flush(block, target, end):
+            # Copy the block to the rows ending at end.
+            if len(block) > 0:
+                target[end - len(block):end] = block
+                del block[:]
+
+        with open(obj_path, 'r', errors='replace') as f:
+            for (line_num, line) in enumerate(f):
+                try:
+                    if line.startswith('v '):
+                        vert_block.append([float(x) for x in line.split()[1:4]])
+                        num_verts += 1
+                        if len(vert_block) == self.block_size:
+                            flush(vert_block, vertices, num_verts)
+
+                    elif line.startswith('vt ') and not dummy_uvs:
+                        uv_block.append([float(x) for x in (line.split()[1:3] + ['0'])[:2]])
+                        num_uvs += 1
+                        if len(uv_block) == self.block_size:
+                            flush(uv_block, uvs, num_uvs)
+
+                    elif line.startswith('vn '):
+                        normal_block.append([float(x) for x in line.split()[1:4]])
+                        num_normals += 1
+                        if len(normal_block) == self.block_size:
+                            flush(normal_block, normals, num_normals)
+
+                    elif line.startswith('usemtl '):
+                        mat_index = material_indices[line[7:].strip()]
+
+                    elif line.startswith('f '):
+                        corners = self.face_corners(line.split()[1:], num_verts, num_uvs, num_normals)
+                        for (v, vt, vn) in corners:
+                            if v < 0 or v >= len(vertices) or vt < 0 or vt >= len(uvs) or vn >= len(normals):
+                                raise InvalidGeometryException('index out of range')
+
+                        if len(corners) == 4:
+                            quad_block.append([c[0] for c in corners] + [c[1] for c in corners] + [mat_index])
+                            if keep_normals:
+                                quad_normal_block.append([c[2] for c in corners])
+                            num_quads += 1
+                            if len(quad_block) == self.block_size:
+                                flush(quad_block, quads, num_quads)
+                                flush(quad_normal_block, quad_normals, num_quads)
+                        else:
+                            for i in range(1, len(corners) - 1):
+                                tri = (corners[0], corners[i], corners[i + 1])
+                                tri_block.append([c[0] for c in tri] + [c[1] for c in tri] + [mat_index])
+                                if keep_normals:
+                                    tri_normal_block.append([c[2] for c in tri])
+                                num_tris += 1
+                                if len(tri_block) == self.block_size:
+                                    flush(tri_block, tris, num_tris)
+                                    flush(tri_normal_block, tri_normals, num_tris)
+
+                except (ValueError, InvalidGeometryException) as err:
+                    raise InvalidGeometryException('%s line %i: %s' % (obj_path, line_num + 1, err))
+
+        flush(vert_block, vertices, num_verts)
+        flush(uv_block, uvs, num_uvs)
+        flush(normal_block, normals, num_normals)
+        flush(tri_block, tris, num_tris)
+        flush(quad_block, quads, num_quads)
+        flush(tri_normal_block, tri_normals, num_tris)
+        flush(quad_normal_block, quad_normals, num_quads)
@@ -0,0 +1,192 @@
+import numpy as np
+
+import bpy
+
+from .. export import SceneIterator, OBJECT_ANALYSIS, indigo_log
+from .. export.culling import has_emission
+
+# Rough Indigo memory use per triangle (vertex data, UVs and acceleration structure) and per instance.
+BYTES_PER_TRIANGLE = 100
+BYTES_PER_INSTANCE = 200
+
+def subdivision_factor(obj):
+    '''
+    Factor from the number of faces of the viewport evaluated mesh of obj to the
+    number at render time, from the levels of its subdivision modifiers.
+    '''
+    factor = 1.0
+    for modifier in obj.modifiers:
+        if modifier.type in ('SUBSURF', 'MULTIRES'):
+            viewport_levels = modifier.levels if modifier.show_viewport else 0
+            render_levels = modifier.render_levels if modifier.show_render else 0
+            factor *= 4.0 ** (render_levels - viewport_levels)
+    return factor
+
+def indigo_subdivision_factor(obj, subdivision):
+    '''
+    Factor from the number of triangles of the exported mesh of obj to the number
+    after Indigo's subdivision: its own setting, or else the levels of a
+    subdivision cage (see GeometryExporter.cageSubdivision()). Each level splits
+    every face into four.
+    '''
+    levels = obj.data.indigo_mesh.max_num_subdivisions
+    if levels == 0 and subdivision is not None:
+        levels = subdivision[0]
+    return 4.0 ** levels
+
+def count_triangles(obj):
+    mesh = obj.to_mesh()
+    try:
+        loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get('loop_total', loop_totals)
+        return int(np.maximum(loop_totals - 2, 0).sum())
+    finally:
+        obj.to_mesh_clear()
+
+def image_bytes(img):
+    return img.size[0] * img.size[1] * img.channels * (4 if img.is_float else 1)
+
+class PreflightEstimator(SceneIterator):
+    '''
+    Walks the scene like GeometryExporter does, with the same SceneIterator, but
+    only counts what the export would write: meshes, instances, triangles,
+    emitters and texture memory. Nothing is written.
+
+    Which instances become sphere primitives, subdivision cages or levels of
+    detail is decided by exporter, a GeometryExporter set up with the options of
+    the export, so the estimate follows the same rules. Nothing is exported with it.
+
+    The depsgraph of an operator is evaluated with viewport settings, so triangle
+    counts are scaled to the render levels of subdivision modifiers, see
+    subdivision_factor(), and to Indigo's own subdivision, see
+    indigo_subdivision_factor(). Proxies and sphere primitives are counted as
+    instances without triangles. If a culler is set, culled instances are left out
+    as in the export.
+    '''
+
+    culler = None # Optional FrustumCuller
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+        self.mesh_triangles = {} # Map from mesh key (see meshKey) to estimated triangles
+        self.mesh_instances = {} # Map from mesh key to number of instances
+        self.lod_counts = [0, 0, 0]
+        self.num_culled = 0
+        self.num_proxies = 0
+        self.num_spheres = 0
+        self.num_emitting_instances = 0
+        self.num_lamps = 0
+
+    def handleLamp(self, obj):
+        if obj.data.type == 'SUN':
+            self.num_lamps += 1
+
+    def handleMesh(self, ob_inst):
+        if ob_inst.is_instance:  # Real dupli instance
+            obj = ob_inst.instance_object
+        else:  # Usual object
+            obj = ob_inst.object
+
+        if self.culler is not None and self.culler.is_culled(obj, ob_inst.matrix_world):
+            self.num_culled += 1
+            return
+
+        exporter = self.exporter
+        exporter.scene = self.scene
+        exporter.depsgraph = self.depsgraph
+
+        # Sphere primitives don't need a mesh.
+        if exporter.instanceSphere(obj, ob_inst.matrix_world) is not None:
+            self.num_spheres += 1
+            return
+
+        lod_level = exporter.lodLevel(obj, ob_inst.matrix_world)
+        self.lod_counts[lod_level] += 1
+
+        im = obj.data.indigo_mesh if hasattr(obj.data, 'indigo_mesh') else None
+        source = obj
+        ratio = 1.0
+        key = self.meshKey(obj)
+        if lod_level > 0 and im.lod_mode == 'objects':
+            # Like exportLODMeshElement(): the next finer level that has an object, or the full mesh.
+            lod_objects = [im.lod_object_1, im.lod_object_2][:lod_level]
+            lod_objects = [o for o in lod_objects if o is not None and o.type in ('MESH', 'CURVE', 'SURFACE', 'FONT')]
+            if len(lod_objects) > 0:
+                source = lod_objects[-1].evaluated_get(self.depsgraph)
+                key = self.meshKey(source)
+        elif lod_level > 0:
+            ratio = im.lod_ratio ** lod_level
+            key = '%s (LOD %i)' % (key, lod_level)
+
+        self.mesh_instances[key] = self.mesh_instances.get(key, 0) + 1
+        if has_emission(obj):
+            self.num_emitting_instances += 1
+
+        if key in self.mesh_triangles:
+            return
+
+        if im is not None and im.valid_proxy():
+            self.num_proxies += 1
+            self.mesh_triangles[key] = 0
+            return
+
+        subdivision = exporter.cageSubdivision(source)
+        triangles = count_triangles(source) * subdivision_factor(source) * ratio
+        if subdivision is not None:
+            # The export writes the cage, without the render levels of its Subdivision Surface.
+            triangles /= 4.0 ** subdivision[0]
+        if hasattr(source.data, 'indigo_mesh'):
+            triangles *= indigo_subdivision_factor(source, subdivision)
+
+        self.mesh_triangles[key] = int(triangles)
+        if OBJECT_ANALYSIS: indigo_log(' -> preflight: %s: %i triangles' % (key, self.mesh_triangles[key]))
+
+    def meshKey(self, obj):
+        # Objects without modifiers sharing a datablock export the same mesh.
+        if len(obj.modifiers) == 0:
+            return obj.data.name
+        return obj.name
+
+    def texture_usage(self):
+        '''
+        Returns a list of (image name, bytes) for the images in use, largest first.
+        '''
+        usage = []
+        for img in bpy.data.images:
+            if img.users == 0 or img.type not in ('IMAGE', 'MULTILAYER'):
+                continue
+            usage.append((img.name, image_bytes(img)))
+        usage.sort(key=lambda x: x[1], reverse=True)
+        return usage
+
+    def report(self, top_n=10):
+        '''
+        Returns the report as a list of lines.
+        '''
+        num_instances = sum(self.mesh_instances.values()) + self.num_spheres
+        num_triangles = sum(self.mesh_triangles.values())
+        num_instanced_triangles = sum(self.mesh_triangles[name] * n for (name, n) in self.mesh_instances.items())
+        geometry_bytes = num_triangles * BYTES_PER_TRIANGLE + num_instances * BYTES_PER_INSTANCE
+
+        textures = self.texture_usage()
+        texture_bytes = sum(b for (name, b) in textures)
+
+        lines = [
+            'Pre-flight: %i meshes, %i instances (%i culled), %i proxies, %i sphere primitives' % (
+                len(self.mesh_triangles), num_instances, self.num_culled, self.num_proxies, self.num_spheres),
+            'Pre-flight: %i instances at full detail, %i at LOD 1, %i at LOD 2' % tuple(self.lod_counts),
+            'Pre-flight: %i unique triangles, %i triangles including instances' % (num_triangles, num_instanced_triangles),
+            'Pre-flight: %i emitting instances, %i sun and sky lights, %i light layers' % (
+                self.num_emitting_instances, self.num_lamps, len(self.scene.indigo_lightlayers.enumerate())),
+            'Pre-flight: estimated memory: %.1f MB geometry, %.1f MB textures (%i images)' % (
+                geometry_bytes / 1048576.0, texture_bytes / 1048576.0, len(textures)),
+        ]
+
+        heaviest = sorted(self.mesh_triangles.items(), key=lambda x: x[1], reverse=True)[:top_n]
+        for (name, triangles) in heaviest:
+            lines.append('Pre-flight: mesh %s: %i triangles, %i instances' % (name, triangles, self.mesh_instances[name]))
+
+        for (name, b) in textures[:top_n]:
+            lines.append('Pre-flight: image %s: %.1f MB' % (name, b / 1048576.0))
+
+        return lines
@@ -0,0 +1,184 @@
+import os
+import json
+import math
+import hashlib
+
+import bpy
+
+from .. export import indigo_log
+
+# Footprint key of the environment map.
+ENVIRONMENT = '<environment>'
+
+def budget_texture_path(budget, path, footprint_key):
+    '''
+    Returns the path to export for the texture at path, used by the material named
+    footprint_key (or ENVIRONMENT). Without a budget (None) this is path itself.
+    '''
+    if budget is None:
+        return path
+    return budget.texture_path(path, budget.footprints.get(footprint_key))
+
+class TextureBudget(object):
+    '''
+    Limits texture resolution to what the render can show.
+
+    measure() estimates the largest size in pixels at which each material can appear
+    on the rendered image, from the bounding boxes of the objects using it. Textures
+    of a material are then downscaled (keeping their aspect ratio) to the next power
+    of two above that size times the oversampling factor. Textures on materials
+    which are not measured, e.g. ones only used inside other materials, are kept.
+
+    Downscaled copies are made with Blender's image API and stored in cache_dir,
+    named after the source path, size and modification time and the target size,
+    so they are made again only when the source changes. The source is not hashed:
+    that would read every texture on every export, which is what the cache avoids.
+    Saving a file updates its modification time, in nanoseconds where the file
+    system has them, so a stale copy is only used if a tool writes other content of
+    the same size and then sets the old time back. Clear cache_dir after that.
+    '''
+
+    image_formats = {
+        '.png': 'PNG',
+        '.jpg': 'JPEG',
+        '.jpeg': 'JPEG',
+        '.exr': 'OPEN_EXR',
+        '.hdr': 'HDR',
+        '.tif': 'TIFF',
+        '.tiff': 'TIFF',
+        '.tga': 'TARGA',
+        '.bmp': 'BMP',
+    }
+
+    def __init__(self, cache_dir, oversampling=2.0, min_size=256):
+        self.cache_dir = cache_dir
+        self.oversampling = oversampling
+        self.min_size = min_size
+
+        self.footprints = {} # Map from material name (or ENVIRONMENT) to size in pixels
+
+        # Map from source key to [width, height, bytes per pixel], kept in the cache
+        # so that source images don't have to be loaded to find their size.
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.index = {}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r') as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError):
+                self.index = {}
+        self.index_changed = False
+
+        # Stats: estimated memory of the textures as referenced, and as exported.
+        self.source_bytes = {} # Map from source path to bytes
+        self.exported_bytes = {} # Map from exported path to bytes
+        self.num_downscaled = 0
+
+    def measure(self, depsgraph, view):
+        for ob_inst in depsgraph.object_instances:
+            obj = ob_inst.instance_object if ob_inst.is_instance else ob_inst.object
+            if obj.type not in ('MESH', 'CURVE', 'SURFACE', 'FONT'):
+                continue
+
+            corners = view.camera_space_corners(obj, ob_inst.matrix_world)
+            lo = [min(c[i] for c in corners) for i in range(3)]
+            hi = [max(c[i] for c in corners) for i in range(3)]
+            radius = math.sqrt(sum(((hi[i] - lo[i]) / 2.0) ** 2 for i in range(3)))
+
+            # Use the distance to the nearest point instead of the depth, so that objects
+            # seen in reflections behind the camera get a sensible size too.
+            if view.ortho:
+                size = radius / view.half_x * view.resolution[0]
+            else:
+                size = radius / (max(view.distance(corners), 1e-6) * view.half_x) * view.resolution[0]
+
+            for ms in obj.material_slots:
+                if ms.material == None: continue
+                self.footprints[ms.material.name] = max(self.footprints.get(ms.material.name, 0.0), size)
+
+        # A spherical environment map covers 360 degrees, of which the view shows its field of view.
+        if not view.ortho:
+            self.footprints[ENVIRONMENT] = view.resolution[0] * math.pi / math.atan(view.half_x)
+
+    def source_key(self, path):
+        stat = os.stat(path)
+        return hashlib.sha224(('%s|%i|%i' % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)).encode(encoding='UTF-8')).hexdigest()
+
+    def source_info(self, path, key):
+        info = self.index.get(key)
+        if info is None:
+            img = bpy.data.images.load(path, check_existing=False)
+            try:
+                info = [img.size[0], img.size[1], img.channels * (4 if img.is_float else 1)]
+            finally:
+                bpy.data.images.remove(img)
+            self.index[key] = info
+            self.index_changed = True
+        return info
+
+    def texture_path(self, path, footprint):
+        if not os.path.exists(path):
+            return path
+
+        key = self.source_key(path)
+        (width, height, pixel_bytes) = self.source_info(path, key)
+        self.source_bytes[path] = width * height * pixel_bytes
+
+        longest = max(width, height)
+        target = longest
+        if footprint is not None and footprint != float('inf'):
+            target = max(self.min_size, 2 ** int(math.ceil(math.log2(max(footprint * self.oversampling, 1.0)))))
+
+        if target >= longest:
+            self.exported_bytes[path] = width * height * pixel_bytes
+            return path
+
+        scale = target / longest
+        new_width = max(1, int(round(width * scale)))
+        new_height = max(1, int(round(height * scale)))
+
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in self.image_formats:
+            ext = '.png'
+        out_path = os.path.join(self.cache_dir, '%s_%i%s' % (key, target, ext))
+
+        if not os.path.exists(out_path):
+            self.downscale(path, out_path, new_width, new_height, self.image_formats[ext])
+            self.num_downscaled += 1
+
+        self.exported_bytes[out_path] = new_width * new_height * pixel_bytes
+        return out_path
+
+    def downscale(self, path, out_path, width, height, file_format):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # Save under a temporary name first, so an interrupted export never leaves a partial image in the cache.
+        temp_path = os.path.join(self.cache_dir, 'tmp_%i_%s' % (os.getpid(), os.path.basename(out_path)))
+
+        img = bpy.data.images.load(path, check_existing=False)
+        try:
+            img.scale(width, height)
+            img.filepath_raw = temp_path
+            img.file_format = file_format
+            img.save()
+        finally:
+            bpy.data.images.remove(img)
+
+        os.replace(temp_path, out_path)
+
+    def finish(self):
+        '''
+        Save the cache index and report the estimated texture memory saved.
+        '''
+        if self.index_changed:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(self.index_path, 'w') as f:
+                json.dump(self.index, f)
+            self.index_changed = False
+
+        before = sum(self.source_bytes.values())
+        after = sum(self.exported_bytes.values())
+        indigo_log('Texture budget: %i textures, %.1f MB at full resolution, %.1f MB exported, %.1f MB saved (%i new downscaled copies)' % (
+            len(self.source_bytes), before / 1048576.0, after / 1048576.0, (before - after) / 1048576.0, self.num_downscaled))
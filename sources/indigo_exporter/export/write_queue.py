@@ -0,0 +1,130 @@
+import collections
+import threading
+
+from .. export.mesh_cache import publish_buffers
+
+class MeshWriteQueue(object):
+    '''
+    Writes files on background threads, so that the exporter can evaluate the
+    next object while the meshes of the previous ones are still being written.
+
+    submit() blocks while more than max_bytes of data is waiting to be written.
+    flush() waits for all submitted files and raises if any of them failed.
+    Files are published atomically, see mesh_cache.publishing().
+
+    Example usage:
+    queue = MeshWriteQueue(num_threads=2, max_bytes=512*1024*1024)
+    queue.submit('mesh.igmesh', [header_bytes, vertex_array])
+    queue.flush()  # All files are on disk now
+    queue.close()
+    '''
+
+    def __init__(self, num_threads=2, max_bytes=512*1024*1024):
+        self.max_bytes = max_bytes
+
+        self.condition = threading.Condition()
+        self.pending = collections.deque()
+        self.pending_bytes = 0
+        self.num_unfinished = 0
+        self.errors = []
+        self.closed = False
+
+        # Stats
+        self.bytes_written = 0
+        self.files_written = 0
+
+        self.threads = []
+        for i in range(max(1, num_threads)):
+            t = threading.Thread(target=self.run, name='MeshWriteQueue-%i' % i, daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, filename, buffers):
+        '''
+        Queue writing the bytes-like objects in buffers, in order, to filename.
+        The buffers must not be modified until the file has been written.
+        '''
+        nbytes = sum(memoryview(b).nbytes for b in buffers)
+
+        with self.condition:
+            # Backpressure: wait until there is room, but always accept a file when nothing is pending.
+            while self.pending_bytes > 0 and self.pending_bytes + nbytes > self.max_bytes and not self.errors:
+                self.condition.wait()
+
+            self.raise_errors()
+
+            if self.closed:
+                raise Exception('Mesh write queue is closed')
+
+            self.pending.append((filename, buffers, nbytes))
+            self.pending_bytes += nbytes
+            self.num_unfinished += 1
+            self.condition.notify_all()
+
+    def flush(self):
+        '''
+        Wait until all submitted files have been written.
+        Raises an exception if writing any of them failed.
+        '''
+        with self.condition:
+            while self.num_unfinished > 0:
+                self.condition.wait()
+
+            self.raise_errors()
+
+    def cancel(self):
+        '''
+        Drop the files which haven't started being written. Files being written are
+        finished, so no file is left half written.
+        '''
+        with self.condition:
+            while len(self.pending) > 0:
+                filename, buffers, nbytes = self.pending.popleft()
+                self.pending_bytes -= nbytes
+                self.num_unfinished -= 1
+            self.condition.notify_all()
+
+    def close(self):
+        '''
+        Stop the writer threads once the queued files are written. Does not raise.
+        '''
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+        for t in self.threads:
+            t.join()
+
+    def raise_errors(self):
+        # Must be called with self.condition held.
+        if len(self.errors) > 0:
+            filename, err = self.errors[0]
+            raise Exception('Failed to write %s: %s' % (filename, err))
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.pending) == 0 and not self.closed:
+                    self.condition.wait()
+
+                if len(self.pending) == 0:
+                    return
+
+                filename, buffers, nbytes = self.pending.popleft()
+
+            error = None
+            try:
+                publish_buffers(filename, buffers)
+            except Exception as err:
+                error = err
+
+            with self.condition:
+                if error is None:
+                    self.bytes_written += nbytes
+                    self.files_written += 1
+                else:
+                    self.errors.append((filename, error))
+
+                self.pending_bytes -= nbytes
+                self.num_unfinished -= 1
+                self.condition.notify_all()
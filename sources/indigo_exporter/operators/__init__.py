@@ -1,4 +1,4 @@
-import os, time
+import os, io, time
 import math
 import xml.etree.cElementTree as ET
 import xml.dom.minidom as MD
@@ -10,10 +10,17 @@ from ..extensions_framework import util as efutil
 from .. import export
 from .. export import (
     indigo_log, geometry, include, xml_multichild, xml_builder,
-    SceneIterator, ExportCache, exportutil
+    SceneIterator, ExportCache, exportutil, ExportCancelledException, format_floats
 )
 from .. export.igmesh import igmesh_writer
 from .. export.geometry import model_object
+from .. export.write_queue import MeshWriteQueue
+from .. export.culling import CameraView, FrustumCuller
+from .. export.obj_proxy import obj_proxy_converter
+from .. export import texture_budget
+from .. export.preflight import PreflightEstimator
+from .. export.bundle import make_bundle
+from .. export.mesh_cache import collect_garbage, referenced_by_scenes, touch, publishing
 
 from .. import eprofiler as ep
 
@@ -142,10 +149,8 @@ class _Impl_OT_indigo(_Impl_operator):
         if efutil.export_path[-1] not in ('/', '\\'):
             efutil.export_path += '/'
         
-        try:
-            out_file = open(igs_filename, 'w')
-            out_file.close()
-        except:
+        # Don't create or truncate the file yet, so a cancelled export doesn't leave an empty scene behind.
+        if os.path.exists(igs_filename) and not os.access(igs_filename, os.W_OK):
             indigo_log('Failed to open output file "%s" for writing: check output path setting' % igs_filename)
             raise Exception('Failed to open output file for writing: check output path setting')
         
@@ -204,6 +209,9 @@ class _Impl_OT_indigo(_Impl_operator):
     def execute(self, render_engine, depsgraph):
         master_scene = depsgraph.scene_eval
         # master_scene = depsgraph.scene
+        write_queue = None
+        mesh_cache = None
+        geometry_exporter = None
         try:
             if master_scene is None:
                 #indigo_log('Scene context is invalid')
@@ -220,6 +228,10 @@ class _Impl_OT_indigo(_Impl_operator):
             
             if self.verbose: indigo_log('Export render settings')
             
+            # Fixed float formatting, so that a deterministic export doesn't depend on float repr details.
+            # Applied to the XML trees just before they are written, see format_floats().
+            float_format = '%.9g' if master_scene.indigo_engine.deterministic_export else None
+            
             #------------------------------------------------------------------------------
             # Start with render settings, this also creates the root <scene>
             self.scene_xml = master_scene.indigo_engine.build_xml_element(master_scene)
@@ -249,12 +261,41 @@ class _Impl_OT_indigo(_Impl_operator):
             geometry_exporter.mesh_dir = mesh_dir
             geometry_exporter.rel_mesh_dir = rel_mesh_dir
             geometry_exporter.skip_existing_meshes = master_scene.indigo_engine.skip_existing_meshes
+            mesh_cache = geometry_exporter.mesh_cache
             geometry_exporter.verbose = self.verbose
+            geometry_exporter.render_engine = render_engine
+            geometry_exporter.progress_range = getattr(render_engine, 'progress_range', (0.0, 1.0))
+            geometry_exporter.canonical_instancing = master_scene.indigo_engine.canonical_instancing
+            if master_scene.indigo_engine.convert_obj_proxies:
+                geometry_exporter.proxy_converter = obj_proxy_converter(efutil.filesystem_path('/'.join([mesh_dir, 'proxies'])), mesh_cache)
+            geometry_exporter.auto_spheres = master_scene.indigo_engine.auto_sphere_primitives
+            geometry_exporter.sphere_tolerance = master_scene.indigo_engine.sphere_tolerance
+            
+            if master_scene.indigo_engine.texture_budget:
+                geometry_exporter.texture_budget = texture_budget.TextureBudget(
+                    efutil.filesystem_path('/'.join([efutil.export_path, 'texture_cache'])),
+                    oversampling=master_scene.indigo_engine.texture_oversampling,
+                    min_size=master_scene.indigo_engine.texture_min_size
+                )
+            
+            if master_scene.indigo_engine.background_mesh_writes:
+                write_queue = MeshWriteQueue(
+                    num_threads=master_scene.indigo_engine.mesh_writer_threads,
+                    max_bytes=master_scene.indigo_engine.mesh_writer_memory * 1024 * 1024
+                )
+                geometry_exporter.write_queue = write_queue
+            
+            geometry_exporter.use_subdivision_cages = master_scene.indigo_engine.subdivision_cages
+            # The depsgraph is updated at each frame below, which evaluates the cages.
+            geometry_exporter.prepareSubdivisionCages(set(ob.original for ob in depsgraph.objects))
             
             # Make frame_dir directory if it does not exist yet.
             if not os.path.exists(frame_dir):
                 os.makedirs(frame_dir)
             
+            # Keeps mesh cache cleanups of other exports from deleting meshes this one reuses.
+            mesh_cache.begin(efutil.filesystem_path(mesh_dir))
+            
             if master_scene.indigo_engine.motionblur:
                 # When motion blur is on, calculate the number of frames covered by the exposure time
                 start_time = start_frame / fps
@@ -268,6 +309,9 @@ class _Impl_OT_indigo(_Impl_operator):
                 
             #indigo_log('frame_list: %s'%frame_list)
             
+            if master_scene.indigo_engine.camera_culling and len(frame_list) > 1:
+                indigo_log('Camera culling is not used with motion blur', message_type='WARNING')
+            
             #------------------------------------------------------------------------------
             # Process all objects in all frames in all scenes.
             print( '\n\n\n\n*******', master_scene.frame_current)
@@ -280,12 +324,75 @@ class _Impl_OT_indigo(_Impl_operator):
                 
                 render_engine.frame_set(cur_frame, subframe=0.0)
                 depsgraph.update()
+                
+                geometry_exporter.camera_view = CameraView(master_scene)
+                
+                # Textures are exported once, so their sizes are measured at the first frame.
+                if geometry_exporter.texture_budget is not None and cur_frame == frame_list[0]:
+                    geometry_exporter.texture_budget.measure(depsgraph, geometry_exporter.camera_view)
+                
+                # Culling tests against a single camera position, so it is skipped for motion blur.
+                if master_scene.indigo_engine.camera_culling and len(frame_list) == 1:
+                    geometry_exporter.culler = FrustumCuller(
+                        geometry_exporter.camera_view,
+                        margin=master_scene.indigo_engine.culling_margin,
+                        max_distance=master_scene.indigo_engine.culling_distance
+                    )
 
                 # Add Camera matrix.
                 camera[1].append((normalised_time, camera[0].matrix_world.copy()))
 
                 geometry_exporter.iterateScene(depsgraph)
                 
+                # Stop before writing anything else; meshes are only ever published complete.
+                if geometry_exporter.canAbort():
+                    raise ExportCancelledException('Export cancelled')
+                
+                culler = geometry_exporter.culler
+                if culler is not None:
+                    indigo_log('Camera culling: left out %i of %i tested instances (%i outside view, %i beyond max distance)' % (
+                        culler.num_culled(), culler.num_tested, culler.num_outside_view, culler.num_too_far))
+            
+            if master_scene.indigo_engine.deterministic_export:
+                geometry_exporter.sortExports()
+            
+            if geometry_exporter.lod_counts[1] + geometry_exporter.lod_counts[2] > 0:
+                indigo_log('Level of detail: %i instances at full detail, %i at LOD 1, %i at LOD 2' % tuple(geometry_exporter.lod_counts))
+            
+            num_cages = len(geometry_exporter.subdivision_cages)
+            if num_cages > 0 and self.verbose:
+                indigo_log('Left subdivision of %i objects to Indigo' % num_cages)
+            
+            if geometry_exporter.num_auto_spheres > 0:
+                indigo_log('Exported %i instances as sphere primitives' % geometry_exporter.num_auto_spheres)
+            
+            # Lamps are built in the frame loop too, so all texture paths have been exported by now.
+            if geometry_exporter.texture_budget is not None:
+                geometry_exporter.texture_budget.finish()
+                
+            
+            # Wait for the meshes still being written; this raises if any of them failed.
+            if write_queue is not None:
+                write_queue.flush()
+                if self.verbose: indigo_log('Background writes: %i meshes, %i bytes' % (write_queue.files_written, write_queue.bytes_written))
+            
+            # Meshes which other exporters were writing at the same time must be complete before rendering.
+            if mesh_cache.num_shared > 0:
+                if self.verbose: indigo_log('Waiting for %i meshes written by other exporters' % len(mesh_cache.waiting))
+            mesh_cache.wait(should_abort=geometry_exporter.canAbort)
+            
+            if master_scene.indigo_engine.mesh_cache_gc:
+                # The modification time of a mesh file is its last reference, see mesh_cache.collect_garbage().
+                meshes_on_disk = geometry_exporter.meshFilesOnDisk()
+                touch(meshes_on_disk, efutil.filesystem_path(mesh_dir))
+                gc = collect_garbage(
+                    efutil.filesystem_path(mesh_dir),
+                    max_bytes=int(master_scene.indigo_engine.mesh_cache_budget * 1024 ** 3),
+                    max_age=master_scene.indigo_engine.mesh_cache_max_age * 86400,
+                    keep=meshes_on_disk | referenced_by_scenes(efutil.filesystem_path(mesh_dir)),
+                    dry_run=False
+                )
+                if self.verbose: indigo_log(gc.report()[0])
             
             # Export background light if no light exists.
             self.export_default_background_light(geometry_exporter.isLightingValid())
@@ -419,6 +526,7 @@ class _Impl_OT_indigo(_Impl_operator):
                     self.scene_xml.append(xml)
                 material_count += 1
             if self.verbose: indigo_log('Exported %i materials' % material_count)
+            geometry_exporter.material_graph.log_stats()
             
             # Export used meshes.
             if self.verbose: indigo_log('Exporting meshes')
@@ -428,11 +536,14 @@ class _Impl_OT_indigo(_Impl_operator):
                 self.scene_xml.append(xml)
                 mesh_count += 1
             if self.verbose: indigo_log('Exported %i meshes' % mesh_count)
+            if master_scene.indigo_engine.canonical_instancing:
+                indigo_log('Copied mesh detection: %i mesh objects share %i meshes' % (len(geometry_exporter.ExportedMeshes), mesh_count))
             
             #------------------------------------------------------------------------------
             # We write object instances to a separate file
             oc = 0
             scene_data_xml = ET.Element('scenedata')
+            model_builder = None # One model_object per scene, so its per object templates are shared by all instances
             for ck, ci in geometry_exporter.ExportedObjects.items():
                 obj_type = ci[0]
                 
@@ -442,7 +553,9 @@ class _Impl_OT_indigo(_Impl_operator):
                     obj_matrices = ci[3]
                     scene = ci[4]
                     
-                    xml = geometry.model_object(scene).build_xml_element(obj, mesh_name, obj_matrices)
+                    if model_builder is None or model_builder.scene != scene:
+                        model_builder = geometry.model_object(scene)
+                    xml = model_builder.build_xml_element(obj, mesh_name, obj_matrices)
                 else:
                     xml = ci[1]
                 scene_data_xml.append(xml)
@@ -451,16 +564,18 @@ class _Impl_OT_indigo(_Impl_operator):
             objects_file_name = '%s/objects.igs' % (
                 frame_dir
             )
-            objects_file = open(objects_file_name, 'wb')
-            ET.ElementTree(element=scene_data_xml).write(objects_file, encoding='utf-8')
-            objects_file.close()
+            if float_format is not None:
+                format_floats(scene_data_xml, float_format)
+            with publishing(objects_file_name) as objects_file:
+                ET.ElementTree(element=scene_data_xml).write(objects_file, encoding='utf-8')
             # indigo_log('Exported %i object instances to %s' % (oc,objects_file_name))
             scene_data_include = include.xml_include( efutil.path_relative_to_export(objects_file_name) )
             self.scene_xml.append( scene_data_include.build_xml_element(master_scene) )
             
             #------------------------------------------------------------------------------
             # Write formatted XML for settings, materials and meshes
-            out_file = open(igs_filename, 'w')
+            if float_format is not None:
+                format_floats(self.scene_xml, float_format)
             xml_str = ET.tostring(self.scene_xml, encoding='utf-8').decode()
             
             # substitute back characters protected from entity encoding in CDATA nodes
@@ -469,8 +584,10 @@ class _Impl_OT_indigo(_Impl_operator):
             
             
             xml_dom = MD.parseString(xml_str)
-            xml_dom.writexml(out_file, addindent='\t', newl='\n', encoding='utf-8')
-            out_file.close()
+            out_str = io.StringIO()
+            xml_dom.writexml(out_str, addindent='\t', newl='\n', encoding='utf-8')
+            with publishing(igs_filename) as out_file:
+                out_file.write(out_str.getvalue().encode('utf-8'))
             
             #------------------------------------------------------------------------------
             # Computing devices
@@ -542,6 +659,12 @@ class _Impl_OT_indigo(_Impl_operator):
             
             return {'FINISHED'}
         
+        except ExportCancelledException as err:
+            indigo_log('%s' % err, message_type='WARNING')
+            if write_queue is not None:
+                write_queue.cancel()
+            return {'CANCELLED'}
+        
         except Exception as err:
             indigo_log('%s' % err, message_type='ERROR')
             import traceback
@@ -550,14 +673,127 @@ class _Impl_OT_indigo(_Impl_operator):
                 raise err
             return {'CANCELLED'}
         
+        finally:
+            if geometry_exporter is not None:
+                geometry_exporter.restoreSubdivisionCages()
+            if write_queue is not None:
+                write_queue.close()
+            if mesh_cache is not None:
+                mesh_cache.release_all()
+        
 class EXPORT_OT_indigo(_Impl_OT_indigo, bpy.types.Operator):
     def execute(self, context):
         self.set_report(self.report)
-        return super().execute(context.scene)
+        # The scene stands in for the render engine: both have frame_set(frame, subframe).
+        return super().execute(context.scene, context.evaluated_depsgraph_get())
     
 menu_func = lambda self, context: self.layout.operator("export.indigo", text="Export Indigo Scene...")
 bpy.types.TOPBAR_MT_file_export.append(menu_func)
 
+class INDIGO_OT_preflight(bpy.types.Operator):
+    '''Estimate the meshes, triangles, lights and texture memory of the Indigo export, without exporting'''
+    
+    bl_idname = "indigo.preflight"
+    bl_label = "Pre-flight Report"
+    
+    top_n: bpy.props.IntProperty(name='Top N', description='Number of heaviest meshes and images to list', default=10, min=0)
+    
+    def execute(self, context):
+        scene = context.scene
+        
+        # Sphere primitives, subdivision cages and levels of detail are picked like in the export.
+        geometry_exporter = geometry.GeometryExporter()
+        geometry_exporter.auto_spheres = scene.indigo_engine.auto_sphere_primitives
+        geometry_exporter.sphere_tolerance = scene.indigo_engine.sphere_tolerance
+        geometry_exporter.use_subdivision_cages = scene.indigo_engine.subdivision_cages
+        geometry_exporter.findSubdivisionCages(set(ob.original for ob in context.evaluated_depsgraph_get().objects))
+        if scene.camera is not None:
+            geometry_exporter.camera_view = CameraView(scene)
+        estimator = PreflightEstimator(geometry_exporter)
+        
+        if scene.indigo_engine.camera_culling and scene.camera is not None:
+            estimator.culler = FrustumCuller(
+                geometry_exporter.camera_view,
+                margin=scene.indigo_engine.culling_margin,
+                max_distance=scene.indigo_engine.culling_distance
+            )
+        
+        estimator.iterateScene(context.evaluated_depsgraph_get())
+        
+        lines = estimator.report(self.properties.top_n)
+        for line in lines:
+            indigo_log(line)
+        self.report({'INFO'}, lines[0])
+        return {'FINISHED'}
+
+class INDIGO_OT_bundle_export(bpy.types.Operator):
+    '''Store an exported Indigo scene and everything it refers to in the bundle repository, by content hash'''
+    
+    bl_idname = "indigo.bundle_export"
+    bl_label = "Bundle Export"
+    
+    filepath: bpy.props.StringProperty(name='Scene file', description='Exported Indigo scene (.igs) to bundle', subtype='FILE_PATH')
+    filter_glob: bpy.props.StringProperty(default='*.igs', options={'HIDDEN'})
+    previous_manifest: bpy.props.StringProperty(name='Previous manifest', description='Manifest to compute the delta against. Empty for the latest manifest in the repository', subtype='FILE_PATH')
+    
+    def invoke(self, context, event):
+        if context.scene.indigo_engine.bundle_repository == '':
+            self.report({'ERROR'}, 'Set the bundle repository first')
+            return {'CANCELLED'}
+        self.properties.filepath = efutil.filesystem_path(context.scene.indigo_engine.export_path)
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+    
+    def execute(self, context):
+        repository = efutil.filesystem_path(context.scene.indigo_engine.bundle_repository)
+        scene_path = efutil.filesystem_path(self.properties.filepath)
+        if not os.path.isfile(scene_path):
+            self.report({'ERROR'}, 'No exported scene at %s' % scene_path)
+            return {'CANCELLED'}
+        
+        previous_manifest = None
+        if self.properties.previous_manifest != '':
+            previous_manifest = efutil.filesystem_path(self.properties.previous_manifest)
+        
+        (manifest_path, delta, builder) = make_bundle(scene_path, repository, previous_manifest=previous_manifest)
+        
+        delta_bytes = sum(os.path.getsize(os.path.join(repository, p)) for p in delta)
+        msg = 'Bundled %i files to %s: %i new in the repository (%.1f MB), %i to ship (%.1f MB)' % (
+            len(builder.files), manifest_path, builder.num_stored, builder.bytes_stored / 1048576.0, len(delta), delta_bytes / 1048576.0)
+        indigo_log(msg)
+        self.report({'INFO'}, msg)
+        return {'FINISHED'}
+
+class INDIGO_OT_mesh_cache_gc(bpy.types.Operator):
+    '''List (or delete) the least recently used mesh files beyond the mesh cache size and age limits'''
+    
+    bl_idname = "indigo.mesh_cache_gc"
+    bl_label = "Mesh Cache Report"
+    
+    dry_run: bpy.props.BoolProperty(name='Dry run', description='Only report the files which would be deleted', default=True)
+    
+    def execute(self, context):
+        indigo_engine = context.scene.indigo_engine
+        mesh_dir = efutil.filesystem_path('/'.join([indigo_engine.export_path, efutil.scene_filename()]))
+        if not os.path.isdir(mesh_dir):
+            self.report({'INFO'}, 'No mesh directory at %s' % mesh_dir)
+            return {'FINISHED'}
+        
+        # Meshes referenced by any exported frame are in use.
+        gc = collect_garbage(
+            mesh_dir,
+            max_bytes=int(indigo_engine.mesh_cache_budget * 1024 ** 3),
+            max_age=indigo_engine.mesh_cache_max_age * 86400,
+            keep=referenced_by_scenes(mesh_dir),
+            dry_run=self.properties.dry_run
+        )
+        
+        lines = gc.report()
+        for line in lines:
+            indigo_log(line)
+        self.report({'INFO'}, lines[0])
+        return {'FINISHED'}
+
 class INDIGO_OT_lightlayer_add(bpy.types.Operator):
     '''Add a new light layer definition to the scene'''
     
@@ -26,6 +26,7 @@ class INDIGO_PT_ui_object_settings(bpy.types.Panel):
         col.prop(indigo_mesh, 'disable_smoothing')
         col.prop(indigo_mesh, 'exit_portal')
         col.prop(indigo_mesh, 'invisible_to_camera')
+        col.prop(indigo_mesh, 'never_cull')
         col.prop(indigo_mesh, 'max_num_subdivisions')
         if indigo_mesh.max_num_subdivisions > 0:
             row = col.row()
@@ -35,6 +36,16 @@ class INDIGO_PT_ui_object_settings(bpy.types.Panel):
             col.prop(indigo_mesh, 'subdivide_pixel_threshold')
             col.prop(indigo_mesh, 'subdivide_curvature_threshold')
             col.prop(indigo_mesh, 'displacement_error_threshold')
+        col.prop(indigo_mesh, 'lod_mode')
+        if indigo_mesh.lod_mode != 'none':
+            row = col.row(align=True)
+            row.prop(indigo_mesh, 'lod_pixels_1')
+            row.prop(indigo_mesh, 'lod_pixels_2')
+            if indigo_mesh.lod_mode == 'objects':
+                col.prop(indigo_mesh, 'lod_object_1')
+                col.prop(indigo_mesh, 'lod_object_2')
+            else:
+                col.prop(indigo_mesh, 'lod_ratio')
         col.prop(indigo_mesh, 'mesh_proxy')
         if indigo_mesh.mesh_proxy:
             col.prop(indigo_mesh, 'mesh_path')
\ No newline at end of file
@@ -1,6 +1,7 @@
 import bpy
 
 from .. core import BL_IDNAME
+from .. core.tiles import tiling_conflicts
 class INDIGO_PT_ui_render_engine_settings(bpy.types.Panel):
     bl_label = "Indigo Engine"
     bl_space_type = 'PROPERTIES'
@@ -128,6 +129,25 @@ class INDIGO_PT_ui_render_engine_settings(bpy.types.Panel):
         row = col.row()
         row.prop(indigo_engine, 'auto_start')
         row.prop(indigo_engine, 'console_output', text="Print to console")
+        # Several processes can't share the network port.
+        sc = col.column()
+        sc.enabled = indigo_engine.network_mode == 'off'
+        sc.prop(indigo_engine, 'local_scheduler')
+        if indigo_engine.local_scheduler:
+            sub = sc.row(align=True)
+            sub.prop(indigo_engine, 'scheduler_processes')
+            sub.prop(indigo_engine, 'scheduler_retries')
+        # Tiles are tonemapped on their own, so settings working on the whole image rule them out.
+        conflicts = tiling_conflicts(context.scene)
+        tc = col.column()
+        tc.enabled = len(conflicts) == 0 or indigo_engine.tiled_render
+        tc.prop(indigo_engine, 'tiled_render')
+        if indigo_engine.tiled_render:
+            sub = col.column()
+            sub.enabled = len(conflicts) == 0
+            sub.prop(indigo_engine, 'tile_count')
+            for conflict in conflicts:
+                col.label(text=conflict, icon='ERROR')
         
         ##
         from .. properties.render_settings import IndigoDevice
@@ -178,6 +198,48 @@ class INDIGO_PT_ui_render_export_settings(bpy.types.Panel):
         col = layout.column()
         col.prop(indigo_engine, 'install_path')
         col.prop(indigo_engine, 'skip_existing_meshes')
+        col.prop(indigo_engine, 'background_mesh_writes')
+        if indigo_engine.background_mesh_writes:
+            sub = col.row(align=True)
+            sub.prop(indigo_engine, 'mesh_writer_threads')
+            sub.prop(indigo_engine, 'mesh_writer_memory')
+        row = col.row()
+        row.prop(indigo_engine, 'mesh_cache_gc')
+        row.operator('indigo.mesh_cache_gc', icon='TRASH')
+        if indigo_engine.mesh_cache_gc:
+            sub = col.row(align=True)
+            sub.prop(indigo_engine, 'mesh_cache_budget')
+            sub.prop(indigo_engine, 'mesh_cache_max_age')
+        col.prop(indigo_engine, 'stream_large_meshes')
+        if indigo_engine.stream_large_meshes:
+            sub = col.row(align=True)
+            sub.prop(indigo_engine, 'stream_min_faces')
+            sub.prop(indigo_engine, 'stream_memory_budget')
+        col.prop(indigo_engine, 'geometry_validation')
+        row = col.row()
+        row.prop(indigo_engine, 'deterministic_export')
+        row.prop(indigo_engine, 'export_metadata')
+        col.prop(indigo_engine, 'spatial_reorder')
+        col.prop(indigo_engine, 'convert_obj_proxies')
+        col.prop(indigo_engine, 'subdivision_cages')
+        col.prop(indigo_engine, 'canonical_instancing')
+        col.prop(indigo_engine, 'auto_sphere_primitives')
+        if indigo_engine.auto_sphere_primitives:
+            col.prop(indigo_engine, 'sphere_tolerance')
+        col.prop(indigo_engine, 'camera_culling')
+        if indigo_engine.camera_culling:
+            sub = col.row(align=True)
+            sub.prop(indigo_engine, 'culling_margin')
+            sub.prop(indigo_engine, 'culling_distance')
+        col.prop(indigo_engine, 'texture_budget')
+        if indigo_engine.texture_budget:
+            sub = col.row(align=True)
+            sub.prop(indigo_engine, 'texture_oversampling')
+            sub.prop(indigo_engine, 'texture_min_size')
+        col.operator('indigo.preflight', icon='INFO')
+        row = col.row(align=True)
+        row.prop(indigo_engine, 'bundle_repository')
+        row.operator('indigo.bundle_export', icon='PACKAGE')
         
         col.separator()
         
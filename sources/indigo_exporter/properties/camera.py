@@ -25,6 +25,17 @@ def lens_sensor_dist(context,p):
     #print('Lens Sensor Distance: %f'%lsd)
     return lsd
 
+def lens_shift(context,p):
+    # Lens shift distances on the sensor, (right, up), in metres.
+    aspect = aspect_ratio(context,p)
+    
+    sx = context.camera.data.shift_x * 0.001*context.camera.data.sensor_width
+    sy = context.camera.data.shift_y * 0.001*context.camera.data.sensor_width
+    if aspect < 1.0:
+        sx /= aspect
+        sy /= aspect
+    return sx, sy
+
 def aperture_radius(context,p):
     ar = lens_sensor_dist(context,p) / (2.0*f_stop(context,p))
     #print('Aperture Radius: %f' % ar)
@@ -324,17 +335,11 @@ class Indigo_Camera_Properties(bpy.types.PropertyGroup, export.xml_builder):
             elif self.ad_type == 'circular':
                 xml_format['aperture_shape'][self.ad_type] = {}
         
-        aspect = aspect_ratio(scene, self)
+        sx, sy = lens_shift(scene, self)
         if scene.camera.data.shift_x != 0:
-            sx = scene.camera.data.shift_x * 0.001*scene.camera.data.sensor_width
-            if aspect < 1.0:
-                sx /= aspect
             xml_format['lens_shift_right_distance'] = [sx]
             
         if scene.camera.data.shift_y != 0:
-            sy = scene.camera.data.shift_y * 0.001*scene.camera.data.sensor_width
-            if aspect < 1.0:
-                sy /= aspect
             xml_format['lens_shift_up_distance'] = [sy]
         
         self.build_subelements(scene, xml_format, xml)
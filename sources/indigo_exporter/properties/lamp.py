@@ -5,6 +5,7 @@ from . material import Spectrum
 from .. extensions_framework import util as efutil
 
 from .. import export
+from .. export.texture_budget import budget_texture_path, ENVIRONMENT
 from . import register_properties_dict
 
 
@@ -217,7 +218,7 @@ class Indigo_Lamp_Hemi_Properties(bpy.types.PropertyGroup, export.xml_builder):
     
     # xml_builder members
     
-    def build_xml_element(self, obj, scene):
+    def build_xml_element(self, obj, scene, texture_budget=None):
         xml = self.Element('material')
         xml_format = {
             'name': [obj.name],
@@ -226,7 +227,7 @@ class Indigo_Lamp_Hemi_Properties(bpy.types.PropertyGroup, export.xml_builder):
             xml_format['diffuse'] = self.get_background_format(obj, scene)
         
         if self.type == 'env_map':
-            xml_format['diffuse'] = self.get_env_map_format(obj, scene)
+            xml_format['diffuse'] = self.get_env_map_format(obj, scene, texture_budget)
         
         self.build_subelements(obj, xml_format, xml)
         return xml
@@ -263,7 +264,7 @@ class Indigo_Lamp_Hemi_Properties(bpy.types.PropertyGroup, export.xml_builder):
         
         return fmt
     
-    def get_env_map_format(self, obj, scene):
+    def get_env_map_format(self, obj, scene, texture_budget=None):
         
         # TODO; re-implement spherical/angular and spherical width ?
         
@@ -284,7 +285,9 @@ class Indigo_Lamp_Hemi_Properties(bpy.types.PropertyGroup, export.xml_builder):
         
         fmt = {
             'texture': {
-                'path': [efutil.path_relative_to_export(self.env_map_path)],
+                'path': [efutil.path_relative_to_export(
+                    budget_texture_path(texture_budget, efutil.filesystem_path(self.env_map_path), ENVIRONMENT)
+                )],
                 'exponent': [1.0],    # TODO; make configurable?
                 'tex_coord_generation': {
                     self.env_map_type: {
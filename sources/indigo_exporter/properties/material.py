@@ -688,7 +688,7 @@ class indigo_material_emission(indigo_material_feature):
         },
     ]
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         return []
     
 Cha_Colour = MaterialChannel('colour', spectrum=True, texture=True, shader=True, switch=False, master_colour=True)
@@ -697,7 +697,7 @@ Cha_Colour = MaterialChannel('colour', spectrum=True, texture=True, shader=True,
 class indigo_material_colour(indigo_material_feature):
     properties    = Cha_Colour.properties
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         return []
     
 Cha_Bump = MaterialChannel('bumpmap', spectrum=False, texture=True,  shader=True,  switch=True, label='Bump Map')
@@ -706,7 +706,7 @@ Cha_Bump = MaterialChannel('bumpmap', spectrum=False, texture=True,  shader=True
 class indigo_material_bumpmap(indigo_material_feature):
     properties    = Cha_Bump.properties
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         return []
     
 Cha_Normal = MaterialChannel('normalmap', spectrum=False, texture=True,  shader=True,  switch=True, label='Normal Map')
@@ -715,7 +715,7 @@ Cha_Normal = MaterialChannel('normalmap', spectrum=False, texture=True,  shader=
 class indigo_material_normalmap(indigo_material_feature):
     properties    = Cha_Normal.properties
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         return []
     
 Cha_Disp = MaterialChannel('displacement', spectrum=False, texture=True,  shader=True,  switch=True, label='Displacement Map')
@@ -724,7 +724,7 @@ Cha_Disp = MaterialChannel('displacement', spectrum=False, texture=True,  shader
 class indigo_material_displacement(indigo_material_feature):
     properties    = Cha_Disp.properties
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         return []
 
 #legacy    
@@ -734,7 +734,7 @@ Cha_Exp = MaterialChannel('exponent', spectrum=False, texture=True,  shader=True
 class indigo_material_exponent(indigo_material_feature):
     properties    = Cha_Exp.properties
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         return []
 #new
 Cha_Rough = MaterialChannel('roughness', spectrum=False, texture=True,  shader=True,  switch=True, label='Roughness Map')
@@ -743,7 +743,7 @@ Cha_Rough = MaterialChannel('roughness', spectrum=False, texture=True,  shader=T
 class indigo_material_roughness(indigo_material_feature):
     properties    = Cha_Rough.properties
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         return []
         
 Cha_Fres = MaterialChannel('fresnel_scale', spectrum=False, texture=True,  shader=True,  switch=True, label='Fresnel Scale Map')
@@ -752,7 +752,7 @@ Cha_Fres = MaterialChannel('fresnel_scale', spectrum=False, texture=True,  shade
 class indigo_material_fresnel_scale(indigo_material_feature):
     properties    = Cha_Fres.properties
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         return []
 
 Cha_BlendMap  = MaterialChannel('blendmap', spectrum=False, texture=True,  shader=True,  switch=True, label='Blend Map')
@@ -761,7 +761,7 @@ Cha_BlendMap  = MaterialChannel('blendmap', spectrum=False, texture=True,  shade
 class indigo_material_blendmap(indigo_material_feature):
     properties    = Cha_BlendMap.properties
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         return []
         
 Cha_Transmittance  = MaterialChannel('transmittance', spectrum=True, texture=True,  shader=True,  switch=False, spectrum_types={'rgb':True, 'uniform':True, 'rgb_default':(0.5,0.5,0.5)}, label='Transmittance')
@@ -770,7 +770,7 @@ Cha_Transmittance  = MaterialChannel('transmittance', spectrum=True, texture=Tru
 class indigo_material_transmittance(indigo_material_feature):
     properties    = Cha_Transmittance.properties
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         return []
         
 Cha_Absorption  = MaterialChannel('absorption', spectrum=True, texture=True,  shader=True,  switch=False, spectrum_types={'rgb':True, 'rgbgain':True, 'uniform':True, 'rgb_default':(0.0,0.0,0.0)}, label='Absorption')
@@ -779,7 +779,7 @@ Cha_Absorption  = MaterialChannel('absorption', spectrum=True, texture=True,  sh
 class indigo_material_absorption(indigo_material_feature):
     properties    = Cha_Absorption.properties
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         return []
 
 Cha_AbsorptionLayer  = MaterialChannel('absorption_layer', spectrum=True, texture=True,  shader=True,  switch=True, spectrum_types={'rgb':True, 'rgbgain':True, 'uniform':True, 'blackbody': True, 'rgb_default':(0.0,0.0,0.0)}, label='Absorption Layer')
@@ -788,7 +788,7 @@ Cha_AbsorptionLayer  = MaterialChannel('absorption_layer', spectrum=True, textur
 class indigo_material_absorption_layer(indigo_material_feature):
     properties    = Cha_AbsorptionLayer.properties
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         return []
 
 def getRoughness(self):
@@ -921,10 +921,11 @@ class indigo_material_specular(indigo_material_feature):
                     getattr(src, attr_name)
                 )
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         im = SpecularMaterial(obj, blender_material.name, indigo_material, self).build_xml_element(
             blender_material,
-            scene=scene
+            scene=scene,
+            texture_budget=texture_budget
         )
         
         return [ im ]
@@ -961,10 +962,11 @@ class indigo_material_diffuse(indigo_material_feature):
         },
     ]
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         im = DiffuseMaterial(obj, blender_material.name, indigo_material, self).build_xml_element(
             blender_material,
-            scene=scene
+            scene=scene,
+            texture_budget=texture_budget
         )
         return [im]
     
@@ -1085,10 +1087,11 @@ class indigo_material_phong(indigo_material_feature):
         },
     ]
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         im = PhongMaterial(obj, blender_material.name, indigo_material, self).build_xml_element(
             blender_material,
-            scene=scene
+            scene=scene,
+            texture_budget=texture_budget
         )
         return [im]
         
@@ -1162,24 +1165,19 @@ class indigo_material_coating(indigo_material_feature):
         },
     ]
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
-        
-        materials = []
-        
-        # Try and get the XML for the substrate material
+    def get_dependencies(self):
+        # The substrate material is exported separately, see MaterialGraph.
         if self.substrate_material_index in bpy.data.materials:
-            mata = bpy.data.materials[self.substrate_material_index]
-            materials.extend(
-                mata.indigo_material.factory(obj, mata, scene)
-            )
-            
+            return [self.substrate_material_index]
+        return []
+    
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         im = CoatingMaterial(obj, blender_material.name, indigo_material, self).build_xml_element(
             blender_material,
-            scene=scene
+            scene=scene,
+            texture_budget=texture_budget
         )
-        materials.append(im)
-        
-        return materials
+        return [im]
         
         
 @register_properties_dict
@@ -1280,29 +1278,17 @@ class indigo_material_doublesidedthin(indigo_material_feature):
         },
     ]
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
-        
-        materials = []
-        
-        # Try and get the XML for the front, back material
-        if self.front_material_index in bpy.data.materials:
-            mata = bpy.data.materials[self.front_material_index]
-            materials.extend(
-                mata.indigo_material.factory(obj, mata, scene)
-            )
-        if self.back_material_index in bpy.data.materials:
-            mata = bpy.data.materials[self.back_material_index]
-            materials.extend(
-                mata.indigo_material.factory(obj, mata, scene)
-            )
-            
+    def get_dependencies(self):
+        # The front and back materials are exported separately, see MaterialGraph.
+        return [name for name in (self.front_material_index, self.back_material_index) if name in bpy.data.materials]
+    
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         im = DoubleSidedThinMaterial(obj, blender_material.name, indigo_material, self).build_xml_element(
             blender_material,
-            scene=scene
+            scene=scene,
+            texture_budget=texture_budget
         )
-        materials.append(im)
-        
-        return materials
+        return [im]
         
 
 @register_properties_dict
@@ -1379,26 +1365,22 @@ class indigo_material_blended(indigo_material_feature):
         },
     ]
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
-        materials = []
-        
+    def get_dependencies(self):
+        # Materials a and b are exported separately, see MaterialGraph.
+        names = []
         if not self.a_null and self.a_index in bpy.data.materials:
-            mata = bpy.data.materials[self.a_index]
-            materials.extend(
-                mata.indigo_material.factory(obj, mata, scene)
-            )
-        
+            names.append(self.a_index)
         if not self.b_null and self.b_index in bpy.data.materials:
-            matb = bpy.data.materials[self.b_index]
-            materials.extend(
-                matb.indigo_material.factory(obj, matb, scene)
-            )
-        
-        materials.append( BlendMaterial(obj, blender_material.name, indigo_material, self).build_xml_element(
+            names.append(self.b_index)
+        return names
+    
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
+        im = BlendMaterial(obj, blender_material.name, indigo_material, self).build_xml_element(
             blender_material,
-            scene=scene
-        ) )
-        return materials
+            scene=scene,
+            texture_budget=texture_budget
+        )
+        return [im]
 
 def try_file_decode(raw_bytes):
     if type(raw_bytes) != type(b''):
@@ -1617,7 +1599,7 @@ class indigo_material_external(indigo_material_feature):
     ]
     
     # Returns list of XML elements or something like that.
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
 
         try:
             # Check that we can extract the material name from the external material file.
@@ -1665,10 +1647,11 @@ class indigo_material_external(indigo_material_feature):
 class indigo_material_null(indigo_material_feature):
     properties = []
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         im = NullMaterial(obj, blender_material.name, indigo_material, self).build_xml_element(
             blender_material,
-            scene=scene
+            scene=scene,
+            texture_budget=texture_budget
         )
         return [im]
     
@@ -1714,10 +1697,11 @@ class indigo_material_fastsss(indigo_material_feature):
         },
     ]
     
-    def get_output(self, obj, indigo_material, blender_material, scene):
+    def get_output(self, obj, indigo_material, blender_material, scene, texture_budget=None):
         im = FastSSSMaterial(obj, blender_material.name, indigo_material, self).build_xml_element(
             blender_material,
-            scene=scene
+            scene=scene,
+            texture_budget=texture_budget
         )
         return [im]
 
@@ -1782,15 +1766,28 @@ class Indigo_Material_Properties(bpy.types.PropertyGroup):
         
         return blender_mat.name
     
+    def dependencies(self):
+        '''
+        Names of the materials this material is made of, e.g. the two materials of a
+        blend. They are not part of the output of factory().
+        '''
+        names = []
+        if self.type in MATERIAL_FEATURES.keys():
+            for feature in sorted(MATERIAL_FEATURES[self.type]):
+                fpg = getattr(self, 'indigo_material_%s'%feature)
+                if hasattr(fpg, 'get_dependencies'):
+                    names.extend( fpg.get_dependencies() )
+        return names
+    
     # xml element factory
     
-    def factory(self, obj, mat, scene):
+    def factory(self, obj, mat, scene, texture_budget=None):
         out_elements = []
         
         # Gather elements from features compatible with current mat type
         if self.type in MATERIAL_FEATURES.keys():
             for feature in MATERIAL_FEATURES[self.type]:
                 fpg = getattr(self, 'indigo_material_%s'%feature)
-                out_elements.extend( fpg.get_output(obj, self, mat, scene) )
+                out_elements.extend( fpg.get_output(obj, self, mat, scene, texture_budget) )
         
         return out_elements
\ No newline at end of file
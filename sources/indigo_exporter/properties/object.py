@@ -1,7 +1,7 @@
 import bpy
 import os
 
-from .. extensions_framework.util import path_relative_to_export, filesystem_path
+from .. extensions_framework.util import filesystem_path
 
 from .. export import xml_builder
 
@@ -53,6 +53,13 @@ class Indigo_Mesh_Properties(bpy.types.PropertyGroup, xml_builder):
             'description': 'Make this object invisible to camera when viewed directly',
             'default': False
         },
+        {
+            'type': 'bool',
+            'attr': 'never_cull',
+            'name': 'Never cull',
+            'description': 'Always export this object, even when camera culling would leave it out',
+            'default': False
+        },
         {
             'type': 'bool',
             'attr': 'subdivision_smoothing',
@@ -119,6 +126,65 @@ class Indigo_Mesh_Properties(bpy.types.PropertyGroup, xml_builder):
             'default': 0.1
         },
         
+        {
+            'type': 'enum',
+            'attr': 'lod_mode',
+            'name': 'Level of detail',
+            'description': 'Use coarser meshes for instances which are small on the rendered image',
+            'items': [
+                ('none', 'None', 'Always use the full mesh'),
+                ('objects', 'Objects', 'Use the given LOD objects, which must have the same material slots as this object'),
+                ('auto', 'Automatic', 'Use automatically decimated versions of this mesh'),
+            ],
+            'default': 'none'
+        },
+        {
+            'type': 'pointer',
+            'attr': 'lod_object_1',
+            'ptype': bpy.types.Object,
+            'name': 'LOD 1 object',
+            'description': 'Object used for instances smaller than the LOD 1 size'
+        },
+        {
+            'type': 'pointer',
+            'attr': 'lod_object_2',
+            'ptype': bpy.types.Object,
+            'name': 'LOD 2 object',
+            'description': 'Object used for instances smaller than the LOD 2 size'
+        },
+        {
+            'type': 'float',
+            'attr': 'lod_pixels_1',
+            'name': 'LOD 1 size',
+            'description': 'Use level of detail 1 for instances smaller than this many pixels on the rendered image',
+            'min': 0.0,
+            'soft_min': 0.0,
+            'max': 100000.0,
+            'soft_max': 2000.0,
+            'default': 200.0
+        },
+        {
+            'type': 'float',
+            'attr': 'lod_pixels_2',
+            'name': 'LOD 2 size',
+            'description': 'Use level of detail 2 for instances smaller than this many pixels on the rendered image',
+            'min': 0.0,
+            'soft_min': 0.0,
+            'max': 100000.0,
+            'soft_max': 2000.0,
+            'default': 50.0
+        },
+        {
+            'type': 'float',
+            'attr': 'lod_ratio',
+            'name': 'Decimation ratio',
+            'description': 'Fraction of vertices kept at each automatic level of detail',
+            'min': 0.001,
+            'soft_min': 0.01,
+            'max': 1.0,
+            'soft_max': 1.0,
+            'default': 0.25
+        },
         {
             'type': 'bool',
             'attr': 'mesh_proxy',
@@ -140,7 +206,11 @@ class Indigo_Mesh_Properties(bpy.types.PropertyGroup, xml_builder):
         return self.mesh_proxy and os.path.exists(proxy_path)
     
     # xml_builder members
-    def build_xml_element(self, obj, filename, use_shading_normals, exported_name=""):
+    def build_xml_element(self, obj, filename, use_shading_normals, exported_name="", subdivision=None):
+        '''
+        subdivision is an optional (levels, smooth) tuple from a Subdivision Surface
+        modifier left for Indigo to apply. It is used unless subdivision is set up here.
+        '''
         
         if exported_name == "":
             exported_name = obj.data.name
@@ -156,10 +226,18 @@ class Indigo_Mesh_Properties(bpy.types.PropertyGroup, xml_builder):
             }
         }
         
-        if self.valid_proxy():
-            xml_format['external']['path'] = [path_relative_to_export(self.mesh_path)]
-        
-        if self.max_num_subdivisions > 0:
+        if self.max_num_subdivisions == 0 and subdivision is not None:
+            (levels, smooth) = subdivision
+            xml_format.update({
+                'subdivision_smoothing':                    [str(smooth).lower()],
+                'max_num_subdivisions':                        [levels],
+                'subdivide_pixel_threshold':                [0.0],
+                'subdivide_curvature_threshold':            [0.0],
+                'displacement_error_threshold':                [self.displacement_error_threshold],
+                'view_dependent_subdivision':                ['false'],
+                'merge_vertices_with_same_pos_and_normal':    [str(self.merge_verts).lower()]
+            })
+        elif self.max_num_subdivisions > 0:
             xml_format.update({
                 'subdivision_smoothing':                    [str(self.subdivision_smoothing).lower()],
                 'max_num_subdivisions':                        [self.max_num_subdivisions],
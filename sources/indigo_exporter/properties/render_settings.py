@@ -158,6 +158,53 @@ properties = [
         'description': 'Auto start Indigo after export',
         'default': find_config_value(getAddonDir(), 'defaults', 'auto_start', True)
     },
+    {
+        'type': 'bool',
+        'attr': 'local_scheduler',
+        'name': 'Parallel animation frames',
+        'description': 'Render the frames of an animation with several Indigo console processes at a time, sharing the render threads, instead of one Indigo process. Not used with network rendering',
+        'default': False
+    },
+    {
+        'type': 'int',
+        'attr': 'scheduler_processes',
+        'name': 'Processes',
+        'description': 'Number of Indigo processes rendering frames at the same time',
+        'default': 2,
+        'min': 1,
+        'soft_min': 1,
+        'max': 64,
+        'soft_max': 16
+    },
+    {
+        'type': 'bool',
+        'attr': 'tiled_render',
+        'name': 'Tiled render',
+        'description': 'Render still images as tiles with parallel Indigo console processes, and stitch them together. Needs Linear or Camera tonemapping without post-processing, as each tile is tonemapped on its own',
+        'default': False
+    },
+    {
+        'type': 'int',
+        'attr': 'tile_count',
+        'name': 'Tiles',
+        'description': 'Number of tiles the image is split into, each rendered by its own Indigo process',
+        'default': 4,
+        'min': 2,
+        'soft_min': 2,
+        'max': 256,
+        'soft_max': 16
+    },
+    {
+        'type': 'int',
+        'attr': 'scheduler_retries',
+        'name': 'Retries',
+        'description': 'Number of times a frame whose Indigo process fails is rendered again',
+        'default': 1,
+        'min': 0,
+        'soft_min': 0,
+        'max': 10,
+        'soft_max': 3
+    },
 
     {
         'type': 'enum',
@@ -412,6 +459,229 @@ properties = [
         'name': 'Skip writing existing meshes',
         'default': False,
     },
+    {
+        'type': 'bool',
+        'attr': 'background_mesh_writes',
+        'name': 'Write meshes in background',
+        'description': 'Write mesh files on background threads while the next objects are exported',
+        'default': False,
+    },
+    {
+        'type': 'int',
+        'attr': 'mesh_writer_threads',
+        'name': 'Writer threads',
+        'description': 'Number of background threads writing mesh files',
+        'default': 2,
+        'min': 1,
+        'soft_min': 1,
+        'max': 16,
+        'soft_max': 8
+    },
+    {
+        'type': 'int',
+        'attr': 'mesh_writer_memory',
+        'name': 'Write queue memory (MB)',
+        'description': 'Maximum size of mesh data waiting to be written, before the export waits for the writer threads',
+        'default': 512,
+        'min': 16,
+        'soft_min': 64,
+        'max': 65536,
+        'soft_max': 8192
+    },
+    {
+        'type': 'bool',
+        'attr': 'mesh_cache_gc',
+        'name': 'Clean up mesh cache',
+        'description': 'After each export, delete the least recently used mesh files which no export refers to any more, beyond the size and age limits',
+        'default': False,
+    },
+    {
+        'type': 'float',
+        'attr': 'mesh_cache_budget',
+        'name': 'Cache size (GB)',
+        'description': 'Size of the mesh directory above which the least recently used meshes are deleted. 0 for no limit',
+        'default': 20.0,
+        'min': 0.0,
+        'soft_max': 1000.0
+    },
+    {
+        'type': 'int',
+        'attr': 'mesh_cache_max_age',
+        'name': 'Max age (days)',
+        'description': 'Meshes which no export referred to for this many days are deleted. 0 for no limit',
+        'default': 30,
+        'min': 0,
+        'soft_max': 365
+    },
+    {
+        'type': 'bool',
+        'attr': 'stream_large_meshes',
+        'name': 'Stream large meshes',
+        'description': 'Write meshes above the face count threshold in fixed size blocks, to bound the memory used while exporting them',
+        'default': False,
+    },
+    {
+        'type': 'int',
+        'attr': 'stream_min_faces',
+        'name': 'Streaming threshold (faces)',
+        'description': 'Meshes with at least this many faces are streamed',
+        'default': 5000000,
+        'min': 1000,
+        'soft_min': 100000,
+        'max': 2000000000,
+        'soft_max': 100000000
+    },
+    {
+        'type': 'int',
+        'attr': 'stream_memory_budget',
+        'name': 'Streaming memory (MB)',
+        'description': 'Memory used for encoding each block of a streamed mesh',
+        'default': 256,
+        'min': 16,
+        'soft_min': 64,
+        'max': 16384,
+        'soft_max': 4096
+    },
+    {
+        'type': 'enum',
+        'attr': 'geometry_validation',
+        'name': 'Invalid faces',
+        'description': 'What to do with faces with non-finite coordinates, zero area faces and duplicate faces. Streamed meshes can\'t be checked: they are reported, and stop the export with Fail',
+        'default': 'off',
+        'items': [
+            ('off', 'Don\'t check', 'Write meshes as they are, without checking them'),
+            ('warn', 'Warn', 'Write meshes as they are and report invalid faces in the export log'),
+            ('drop', 'Leave out', 'Leave invalid faces out and report them in the export log'),
+            ('fail', 'Fail', 'Stop the export when a mesh has invalid faces'),
+        ]
+    },
+    {
+        'type': 'bool',
+        'attr': 'deterministic_export',
+        'name': 'Deterministic export',
+        'description': 'Write lamps, materials, meshes and instances in sorted order and floats with a fixed number of digits, so that exporting the same scene again gives the same files',
+        'default': False,
+    },
+    {
+        'type': 'bool',
+        'attr': 'export_metadata',
+        'name': 'Date and machine metadata',
+        'description': 'Write the export date, platform and user name into the scene file',
+        'default': True,
+    },
+    {
+        'type': 'bool',
+        'attr': 'spatial_reorder',
+        'name': 'Spatially reorder meshes',
+        'description': 'Write triangles and quads along a Z-order curve and number vertices in order of use, for faster loading in Indigo. Not applied to streamed meshes',
+        'default': False,
+    },
+    {
+        'type': 'bool',
+        'attr': 'convert_obj_proxies',
+        'name': 'Convert OBJ proxies',
+        'description': 'Convert OBJ proxy meshes to binary igmesh files once, instead of having Indigo parse them on every render. Vertices are split where their faces use different OBJ normals',
+        'default': False,
+    },
+    {
+        'type': 'bool',
+        'attr': 'subdivision_cages',
+        'name': 'Subdivide in Indigo',
+        'description': 'When the last modifier of an object is Subdivision Surface, export the mesh of the modifiers before it and let Indigo subdivide it with the same levels. The modifier is disabled during the export. Objects with creases are subdivided by Blender. UV and boundary smoothing options are not carried over',
+        'default': False,
+    },
+    {
+        'type': 'bool',
+        'attr': 'canonical_instancing',
+        'name': 'Detect copied meshes',
+        'description': 'Export meshes which only differ by a rotation and translation once, and instance them. Useful for CAD and BIM imports with applied transforms',
+        'default': False,
+    },
+    {
+        'type': 'bool',
+        'attr': 'auto_sphere_primitives',
+        'name': 'Detect sphere primitives',
+        'description': 'Export meshes which are spheres, like instanced UV or ico spheres, as native sphere primitives',
+        'default': False,
+    },
+    {
+        'type': 'float',
+        'attr': 'sphere_tolerance',
+        'name': 'Sphere tolerance',
+        'description': 'Largest deviation from a perfect sphere, relative to its radius, for a mesh to be exported as a sphere primitive',
+        'default': 0.05,
+        'min': 0.0,
+        'soft_min': 0.0,
+        'max': 0.5,
+        'soft_max': 0.2
+    },
+    {
+        'type': 'bool',
+        'attr': 'camera_culling',
+        'name': 'Camera culling',
+        'description': 'Leave out instances outside the camera view or beyond the maximum distance (not used with motion blur)',
+        'default': False,
+    },
+    {
+        'type': 'float',
+        'attr': 'culling_margin',
+        'name': 'Margin',
+        'description': 'Extra border around the camera view, as a fraction of the view size, inside which objects are still exported',
+        'default': 0.1,
+        'min': 0.0,
+        'soft_min': 0.0,
+        'max': 10.0,
+        'soft_max': 1.0
+    },
+    {
+        'type': 'float',
+        'attr': 'culling_distance',
+        'name': 'Max distance',
+        'description': 'Leave out instances further from the camera than this. 0 means no limit',
+        'subtype': 'DISTANCE',
+        'default': 0.0,
+        'min': 0.0,
+        'soft_min': 0.0,
+        'max': 1e9,
+        'soft_max': 100000.0
+    },
+    {
+        'type': 'bool',
+        'attr': 'texture_budget',
+        'name': 'Texture budget',
+        'description': 'Export downscaled copies of textures which are larger than their largest size on the rendered image needs',
+        'default': False,
+    },
+    {
+        'type': 'float',
+        'attr': 'texture_oversampling',
+        'name': 'Oversampling',
+        'description': 'Texture pixels per rendered pixel to keep, to allow for UV tiling and close-ups in reflections',
+        'default': 2.0,
+        'min': 0.5,
+        'soft_min': 1.0,
+        'max': 64.0,
+        'soft_max': 8.0
+    },
+    {
+        'type': 'int',
+        'attr': 'texture_min_size',
+        'name': 'Min size',
+        'description': 'Textures are never downscaled below this many pixels along their longest side',
+        'default': 256,
+        'min': 1,
+        'soft_min': 16,
+        'max': 65536,
+        'soft_max': 4096
+    },
+    {
+        'type': 'string',
+        'subtype': 'DIR_PATH',
+        'attr': 'bundle_repository',
+        'name': 'Bundle repository',
+        'description': 'Directory in which export bundles are stored by content hash, for shipping exports to a render farm',
+        'default': ''
+    },
     {
         'type': 'int',
         'attr': 'period_save',
@@ -875,6 +1145,8 @@ class Indigo_Engine_Properties(bpy.types.PropertyGroup, export.xml_builder):
                 'exporter':        ['Blendigo ' + '.'.join(['%i'%v for v in bl_info['version']])],
                 'platform':        ['%s - %s - Python %s' % (PlatformInformation.platform_id, PlatformInformation.uname, PlatformInformation.python)],
                 'author':        [PlatformInformation.user],
+            } if self.export_metadata else {
+                'exporter':        ['Blendigo ' + '.'.join(['%i'%v for v in bl_info['version']])],
             },
             'renderer_settings': {
                 'width':  [xres],
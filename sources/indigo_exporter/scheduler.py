@@ -0,0 +1,230 @@
+'''
+Local render scheduler: runs the items of an Indigo render queue (.igq) as several
+concurrent Indigo console processes, each with a share of the CPU threads.
+
+This module only uses the Python standard library, and not Blender or the rest of
+the addon (whose package imports bpy), so it can also be run on its own:
+
+  python scheduler.py /path/to/animation.igq --console /path/to/indigo_console --processes 4
+
+SIGINT or SIGTERM cancel the render like cancel() does. The exit status is 0 when
+every item was rendered or skipped.
+'''
+
+import os, sys, signal, argparse, subprocess, threading, time, queue
+import xml.etree.cElementTree as ET
+
+class QueueItem(object):
+    def __init__(self, scene_path, output_path, halt_time=-1, halt_spp=-1, seed=None):
+        self.scene_path = scene_path
+        self.output_path = output_path # Image path without extension, as in the .igq
+        self.halt_time = halt_time
+        self.halt_spp = halt_spp
+        self.seed = seed
+
+def read_render_queue(filename):
+    '''
+    Returns the list of QueueItems of an .igq file.
+    '''
+    items = []
+    for item in ET.parse(filename).getroot().findall('item'):
+        items.append(QueueItem(
+            item.findtext('scene_path'),
+            item.findtext('output_path'),
+            int(item.findtext('halt_time', '-1')),
+            int(item.findtext('halt_spp', '-1')),
+            item.findtext('seed')
+        ))
+    return items
+
+def write_render_queue(filename, items):
+    '''
+    Write items to an .igq file, see read_render_queue().
+    '''
+    root = ET.Element('render_queue')
+    for item in items:
+        el = ET.SubElement(root, 'item')
+        ET.SubElement(el, 'scene_path').text = item.scene_path
+        ET.SubElement(el, 'halt_time').text = '%d' % item.halt_time
+        ET.SubElement(el, 'halt_spp').text = '%d' % item.halt_spp
+        ET.SubElement(el, 'output_path').text = item.output_path
+        if item.seed is not None:
+            ET.SubElement(el, 'seed').text = item.seed
+    ET.ElementTree(root).write(filename, encoding='utf-8', xml_declaration=True)
+
+class ItemResult(object):
+    def __init__(self, item):
+        self.item = item
+        self.status = 'pending' # 'done', 'skipped', 'failed' or 'cancelled'
+        self.attempts = 0
+        self.returncode = None
+        self.wall_time = 0.0
+
+class LocalScheduler(object):
+    '''
+    Runs queue items with num_processes Indigo console processes at a time. The
+    num_threads threads (0 for all CPU cores) are split evenly between them.
+    Items whose output image already exists are skipped, and items whose process
+    fails are run again up to max_retries times.
+
+    Items with a seed are rendered from a render queue of their own, next to their
+    scene file, so that Indigo uses the seed and halt conditions of the item like
+    it does when it renders the whole queue. output_args are further outputs of
+    each item, as (argument, suffix) pairs whose path is the output path of the
+    item with the suffix, e.g. ('-uexro', '_untonemapped.exr').
+
+    run() blocks; call cancel() from another thread to stop it.
+
+    Example usage:
+    scheduler = LocalScheduler('/path/to/indigo_console', num_processes=4)
+    results = scheduler.run(read_render_queue('/path/to/animation.igq'))
+    '''
+
+    # Indigo console arguments
+    output_arg = '-o'
+    threads_arg = '-t'
+    output_ext = '.png'
+
+    def __init__(self, console_path, num_processes=2, num_threads=0, max_retries=1, skip_existing=True, output_args=(), log=print):
+        self.console_path = console_path
+        self.num_processes = max(1, num_processes)
+        self.num_threads = num_threads
+        self.max_retries = max_retries
+        self.skip_existing = skip_existing
+        self.output_args = output_args
+        self.log = log
+
+        self.abort = False
+        self.num_finished = 0 # Items finished so far, for progress reports
+        self.lock = threading.Lock()
+        self.processes = set() # Running subprocess.Popen objects, so cancel() can stop them
+
+    def threads_per_process(self):
+        total = self.num_threads if self.num_threads > 0 else (os.cpu_count() or 1)
+        return max(1, total // self.num_processes)
+
+    def output_file(self, item):
+        return item.output_path + self.output_ext
+
+    def queue_file(self, item):
+        return os.path.splitext(item.scene_path)[0] + '.igq'
+
+    def command(self, item, threads):
+        if item.seed is not None:
+            write_render_queue(self.queue_file(item), [item])
+            scene = self.queue_file(item)
+        else:
+            scene = item.scene_path
+        command = [self.console_path, scene, self.output_arg, self.output_file(item), self.threads_arg, str(threads)]
+        for (arg, suffix) in self.output_args:
+            command.extend([arg, item.output_path + suffix])
+        return command
+
+    def cancel(self):
+        '''
+        Stop starting new items and terminate the running processes.
+        '''
+        with self.lock:
+            self.abort = True
+            for process in self.processes:
+                process.terminate()
+
+    def run_item(self, item, threads):
+        result = ItemResult(item)
+
+        if self.skip_existing and os.path.exists(self.output_file(item)):
+            result.status = 'skipped'
+            return result
+
+        start_time = time.time()
+        while result.attempts <= self.max_retries:
+            with self.lock:
+                if self.abort:
+                    result.status = 'cancelled'
+                    break
+                process = subprocess.Popen(self.command(item, threads), stdout=subprocess.DEVNULL)
+                self.processes.add(process)
+
+            result.attempts += 1
+            result.returncode = process.wait()
+            with self.lock:
+                self.processes.discard(process)
+
+            if result.returncode == 0 and os.path.exists(self.output_file(item)):
+                result.status = 'done'
+                break
+
+            if self.abort:
+                # Terminated by cancel()
+                result.status = 'cancelled'
+                break
+
+            result.status = 'failed'
+
+        result.wall_time = time.time() - start_time
+        return result
+
+    def run(self, items):
+        '''
+        Run all items and wait for them. Returns an ItemResult per item, in the order of items.
+        '''
+        results = [None] * len(items)
+        threads = self.threads_per_process()
+        work = queue.Queue()
+        for i in range(len(items)):
+            work.put(i)
+
+        def worker():
+            while True:
+                try:
+                    i = work.get_nowait()
+                except queue.Empty:
+                    return
+                result = self.run_item(items[i], threads)
+                results[i] = result
+                with self.lock:
+                    self.num_finished += 1
+                self.log('%s: %s in %.1f s (%i attempts)' % (os.path.basename(result.item.scene_path), result.status, result.wall_time, result.attempts))
+
+        start_time = time.time()
+        workers = [threading.Thread(target=worker) for i in range(min(self.num_processes, len(items)))]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+        num_done = sum(1 for r in results if r.status == 'done')
+        num_skipped = sum(1 for r in results if r.status == 'skipped')
+        num_failed = sum(1 for r in results if r.status == 'failed')
+        self.log('Rendered %i items (%i skipped, %i failed) with %i processes of %i threads in %.1f s' % (
+            num_done, num_skipped, num_failed, self.num_processes, threads, time.time() - start_time))
+
+        return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render the items of an Indigo render queue with several Indigo console processes.')
+    parser.add_argument('queue', help='Render queue (.igq) file')
+    parser.add_argument('--console', required=True, help='Path of the Indigo console')
+    parser.add_argument('--processes', type=int, default=2, help='Number of concurrent Indigo processes')
+    parser.add_argument('--threads', type=int, default=0, help='Total number of render threads, 0 for all CPU cores')
+    parser.add_argument('--retries', type=int, default=1, help='Number of times a failed item is run again')
+    parser.add_argument('--no-skip-existing', action='store_true', help='Render items whose output image exists already')
+    parser.add_argument('--output-arg', action='append', default=[], metavar='ARG,SUFFIX', help='Further output of each item, e.g. --output-arg=-uexro,_untonemapped.exr')
+    args = parser.parse_args(argv)
+
+    scheduler = LocalScheduler(
+        args.console,
+        num_processes=args.processes,
+        num_threads=args.threads,
+        max_retries=args.retries,
+        skip_existing=not args.no_skip_existing,
+        output_args=[tuple(a.split(',', 1)) for a in args.output_arg]
+    )
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: scheduler.cancel())
+
+    results = scheduler.run(read_render_queue(args.queue))
+    return 0 if all(r.status in ('done', 'skipped') for r in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())